@@ -1,46 +1,53 @@
 #!/usr/bin/env python
-from selenium import webdriver
 import pandas as pd
-import re
 import time
 from pathlib import Path
+from id_index import LIVE, load_id_index
+from inspection_search import get_inspection_id, scrape_inspection_links
+from output_store import append_csv
+from pipeline_metrics import METRICS
 
-driver = webdriver.Chrome()
-driver.implicitly_wait(5)
-driver.get("https://dc.healthinspections.us/webadmin/dhd_431/web/?a=Inspections")
-search_button = driver.find_element_by_name("btnSearch")
-search_button.click()
+scraped_links_filename = "output/scraped_inspection_links.csv"
 
-inspection_link_element_list = driver.\
-    find_elements_by_xpath("//div[@id='divInspectionSearchResultsListing']/descendant::a")
-
-print("Found", len(inspection_link_element_list), "inspection links.")
-
-print("Extracting hrefs from links (this can take a while).")
-
-inspection_link_href_list = [x.get_attribute("href") for x in inspection_link_element_list]
-
-print("Extraction complete.")
-
-driver.quit()
-
-# Make a table of scraped data
-
-scraped_links_dataframe = pd.DataFrame({"link": inspection_link_href_list,
-                                        "inspection_id": [int(re.search("(?<=inspectionID=)([0-9]+)", x).group())
-                                                          for x in inspection_link_href_list],
-                                        "data_extracted": False,
-                                        "date_downloaded": time.strftime("%x")})
-
-if not Path("output/scraped_inspection_links.csv").exists():
-    # If the saved table does not already exist, create it
-    print("Saving data.")
-    scraped_links_dataframe.to_csv("output/scraped_inspection_links.csv", index=False)
+# Only the ids are needed to tell which links are new
+if Path(scraped_links_filename).exists():
+    known_inspection_ids = set(pd.read_csv(scraped_links_filename, usecols=["inspection_id"])["inspection_id"])
 else:
-    # Merge and save the new frame
-    existing_scraped_links_dataframe = pd.read_csv("output/scraped_inspection_links.csv")
-    new_scraped_links_dataframe = scraped_links_dataframe.loc[~scraped_links_dataframe["inspection_id"].isin(
-             existing_scraped_links_dataframe["inspection_id"])]
-    print("Compared with existing data - found", len(new_scraped_links_dataframe), "new links.")
-    merged_scraped_links_dataframe = pd.concat([existing_scraped_links_dataframe, new_scraped_links_dataframe])
-    merged_scraped_links_dataframe.to_csv("output/scraped_inspection_links.csv", index=False)
+    known_inspection_ids = set()
+
+found_links = 0
+new_inspection_ids = []
+
+
+# Add the new links on each page of search results to the saved table as soon as the page comes in
+def save_new_links(inspection_link_href_list):
+    global found_links
+    found_links += len(inspection_link_href_list)
+    new_links = []
+    for link in inspection_link_href_list:
+        inspection_id = get_inspection_id(link)
+        if inspection_id not in known_inspection_ids:
+            known_inspection_ids.add(inspection_id)
+            new_links.append(link)
+            new_inspection_ids.append(inspection_id)
+    if len(new_links) > 0:
+        append_csv(pd.DataFrame({"link": new_links,
+                                 "inspection_id": [get_inspection_id(x) for x in new_links],
+                                 "data_extracted": False,
+                                 "date_downloaded": time.strftime("%x")}), scraped_links_filename)
+    METRICS.increment("search_pages")
+    METRICS.increment("links_found", len(inspection_link_href_list))
+    METRICS.increment("new_links", len(new_links))
+    print("Found", found_links, "inspection links so far,", len(new_inspection_ids), "of them new.")
+    METRICS.emit("01_scrape_inspection_links", found_links)
+
+
+print("Searching for inspection links.")
+number_of_pages = scrape_inspection_links(save_new_links)
+print("Search complete:", number_of_pages, "result pages,", found_links, "inspection links,",
+      len(new_inspection_ids), "new links.")
+
+# Every linked inspection is known to be live
+id_index = load_id_index()
+id_index.update(new_inspection_ids, LIVE)
+id_index.save()
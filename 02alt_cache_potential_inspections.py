@@ -1,71 +1,143 @@
 #!/usr/bin/env python
-import urllib3
 import pandas as pd
-import os
-from multiprocessing.pool import Pool
 import time
+import sys
+from inspection_fetcher import BASE_URL, inspection_report_url, fetch_urls
+from inspection_cache import DEFAULT_CACHE_DIR, get_inspection_cache
+from output_store import append_csv, replace_csv, get_output_format, load_table, table_exists
+from id_index import DEAD, LIVE, load_id_index
+from id_probing import ProbingScheduler
+from page_refresh import get_max_pages, refresh_cached_pages
+from page_triage import PAGE_CLASS_NAMES, UNTRIAGED, triage_page, triage_cached_pages
+from pipeline_metrics import METRICS
 
 
-# This function will attempt to download the report with the specified inspection id from dc.healthinspections.us
-# If the inspection has already been cached in the main download cache, it will be skipped
+# This function will attempt to download the reports with the specified inspection ids from dc.healthinspections.us
+# If an inspection has already been cached (by 02 or a previous run of this script), it will be skipped
 # If the server returns a web-page with nontrivial contents it will be cached (the server almost never gives 404 errors)
+# and triaged (see page_triage.py), so that pages that are not inspection reports are never parsed; an empty page
+# means the id is dead
+# All downloads share one pooled set of connections; ids whose download failed or did not return a 200 are left out of
+# the results so that they are retried on the next run
 #
-def cache_potential_inspection_data(inspection_id, verbose=False,
-                                    downloaded_cache_dir="scraped_inspections_html",
-                                    potential_downloaded_cache_dir="potential_inspections_html"):
+def cache_potential_inspection_data(inspection_ids, verbose=False, cache_dir=DEFAULT_CACHE_DIR,
+                                    concurrency=40, requests_per_second=None, base_url=BASE_URL):
+    cache = get_inspection_cache(cache_dir)
+    results = {}
+    page_classes = {}
+    ids_to_download = []
+    for inspection_id in inspection_ids:
+        if inspection_id in cache:
+            if verbose:
+                print(str(inspection_id) + " Already cached")
+            results[inspection_id] = True
+            METRICS.increment("ids_probed", result="cached")
+        else:
+            ids_to_download.append(inspection_id)
 
-    # First make sure this has not already been cached in the main directory
-    if os.path.exists(downloaded_cache_dir + "/" + str(inspection_id)):
-        if verbose:
-            print(str(inspection_id) + " Already cached in main directory")
-            return {"inspection_id": inspection_id, "was_live": True}
+    # These have not been cached, so we will attempt to download them
+    url_ids = {inspection_report_url(x, base_url): x for x in ids_to_download}
 
-    # Otherwise, check to see if this has already been cached in the potential directory
-    potential_cache_directory = potential_downloaded_cache_dir + "/" + str(inspection_id)
-    if os.path.exists(potential_cache_directory):
+    def save_response(response):
+        inspection_id = url_ids[response["url"]]
         if verbose:
-            print(str(inspection_id) + " Already cached in potential directory")
-            return {"inspection_id": inspection_id, "was_live": True}
+            print(str(inspection_id) + " " + str(response["data"]))
+        # Only a 200 response says whether the id is live: any other status (server errors and rate limiting that
+        # outlasted the retries, redirects, client errors) is neither cached nor recorded, and the id is tried again
+        # on the next run
+        if response["status"] != 200 or response["data"] is None:
+            METRICS.increment("ids_probed", result="failed")
+            return
+        if str(response["data"]) != "b''":
+            cache.put(inspection_id, response["data"])
+            results[inspection_id] = True
+            page_classes[inspection_id] = triage_page(response["data"])
+            METRICS.increment("ids_probed", result="live")
+            METRICS.increment("pages_triaged", page_class=PAGE_CLASS_NAMES[page_classes[inspection_id]])
+        else:
+            results[inspection_id] = False
+            METRICS.increment("ids_probed", result="dead")
+
+    fetch_urls(url_ids.keys(), save_response, concurrency=concurrency, requests_per_second=requests_per_second)
+
+    return [{"inspection_id": x, "was_live": results[x], "page_class": page_classes.get(x, UNTRIAGED)}
+            for x in inspection_ids if x in results]
 
-    # This has not been cached, so we will attempt to download it
-    url = "https://dc.healthinspections.us/webadmin/dhd_431/lib/mod/inspection/paper/" \
-          "_paper_food_inspection_report.cfm?inspectionID=" + str(inspection_id) + "&wguid=1367&wgunm=sysact&wgdmn=431"
-    http = urllib3.PoolManager()
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)  # We don't need to worry about https here
-    r = http.request('Get', url)
-    if verbose:
-        print(str(inspection_id) + " " + str(r.data))
-    if str(r.data) != "b''":
-        try:
-            os.makedirs(potential_cache_directory)
-        except FileExistsError:
-            pass
-        potential_cache_filename = potential_cache_directory + "/inspection.html"
-        potential_cache_file = open(potential_cache_filename, "wb")
-        potential_cache_file.write(r.data)
-        return {"inspection_id": inspection_id, "was_live": True}
-    else:
-        return {"inspection_id": inspection_id, "was_live": False}
 
+# Run with --refresh to re-download cached pages that are due a check instead (see page_refresh.py), at most N of them
+# with --max-pages=N (the most recent inspections first)
+# Pages whose content has changed are stored in the cache again, which makes 03alt re-extract them, and the
+# corresponding links are marked for re-extraction by 02
+if "--refresh" in sys.argv[1:]:
+    output_format = get_output_format(sys.argv[1:])
+    summary_tables = [x for x in ["inspection_summary_data", "potential_inspection_summary_data"]
+                      if table_exists(x, output_format)]
+    if len(summary_tables) == 0:
+        sys.exit("There is no inspection summary data to date the cached pages by yet "
+                 "(run 02_extract_inspection_data.py or 03alt_extract_potential_inspection_data.py)")
+    inspection_dates = pd.concat([load_table(x, ["inspection_id", "inspection_date"], output_format=output_format)
+                                  for x in summary_tables])
+    changed_ids = refresh_cached_pages(inspection_dates.set_index("inspection_id")["inspection_date"],
+                                       max_pages=get_max_pages(sys.argv[1:]))
+    METRICS.emit("02alt_refresh_cached_pages", METRICS.counter_total("pages_refreshed"))
+    id_index = load_id_index()
+    id_index.update_page_classes(changed_ids, triage_cached_pages(changed_ids, get_inspection_cache()))
+    id_index.save()
+    scraped_links_dataframe = pd.read_csv("output/scraped_inspection_links.csv")
+    changed_links = scraped_links_dataframe["inspection_id"].isin(changed_ids)
+    if changed_links.any():
+        scraped_links_dataframe.loc[changed_links, "data_extracted"] = False
+        replace_csv(scraped_links_dataframe, "output/scraped_inspection_links.csv")
 
-scraped_links_dataframe = pd.read_csv("output/scraped_inspection_links.csv")
-potential_inspection_ids_dataframe = pd.read_csv("output/potential_inspection_ids.csv")
+else:
+    scraped_links_dataframe = pd.read_csv("output/scraped_inspection_links.csv")
+    id_index = load_id_index()
+
+    max_known_id = max(scraped_links_dataframe["inspection_id"])
+
+    # By default the id range is probed adaptively (see id_probing.py): regions where live reports have been found
+    # before are fetched in full, while sparse regions are sampled and only filled in around the live reports found
+    # Run with --exhaustive to request every unfetched id instead
+    exhaustive = "--exhaustive" in sys.argv[1:]
+    historical_known_valid_inspection_ids = pd.read_csv("historical_known_valid_inspection_ids.csv")["inspection_id"]
+    scheduler = ProbingScheduler(id_index, max_known_id, pd.concat([scraped_links_dataframe["inspection_id"],
+                                                                    historical_known_valid_inspection_ids]))
+    if exhaustive:
+        ids_to_cache = id_index.unfetched_ids(max_known_id).tolist()
+    else:
+        ids_to_cache = scheduler.next_ids().tolist()
 
-max_known_id = max(scraped_links_dataframe["inspection_id"])
-ids_to_cache = [x for x in range(1, max_known_id + 1) if x not in potential_inspection_ids_dataframe["inspection_id"]]
+    chunk_size = 2000
 
-chunk_size = 2000
+    probing_round = 1
+    ids_requested = 0
+    while len(ids_to_cache) > 0:
+        print("Probing round " + str(probing_round) + ": " + str(len(ids_to_cache)) + " ids to request")
+        chunks = [ids_to_cache[x:x + chunk_size] for x in range(0, len(ids_to_cache), chunk_size)]
+        for i, chunk in enumerate(chunks):
+            print("Processing chunk " + str(i+1) + " of " + str(len(chunks)))
+            results = cache_potential_inspection_data(chunk)
+            ids_requested += len(chunk)
+            METRICS.emit("02alt_cache_potential_inspections", ids_requested,
+                         len(ids_to_cache) if exhaustive else None)
+            if len(results) == 0:
+                continue
+            potential_new_inspection_ids_dataframe = pd.DataFrame.from_records(results,
+                                                                               columns=["inspection_id", "was_live"])
+            potential_new_inspection_ids_dataframe["date_downloaded"] = time.strftime("%x")
+            potential_new_inspection_ids_dataframe["data_extracted"] = False
+            # Only the new rows are appended, so each chunk is a checkpoint that an interrupted run resumes from
+            append_csv(potential_new_inspection_ids_dataframe, "output/potential_inspection_ids.csv")
+            was_live = potential_new_inspection_ids_dataframe["was_live"]
+            id_index.update(potential_new_inspection_ids_dataframe.loc[~was_live, "inspection_id"], DEAD)
+            id_index.update(potential_new_inspection_ids_dataframe.loc[was_live, "inspection_id"], LIVE)
+            id_index.update_page_classes([x["inspection_id"] for x in results], [x["page_class"] for x in results])
+            id_index.save()
+        if exhaustive:
+            break
+        ids_to_cache = scheduler.next_ids().tolist()
+        probing_round += 1
 
-if len(ids_to_cache) > 0:
-    chunks = [ids_to_cache[x:x + chunk_size] for x in range(0, len(ids_to_cache), chunk_size)]
-    pool = Pool(40)
-    for i, chunk in enumerate(chunks):
-        print("Processing chunk " + str(i+1) + " of " + str(len(chunks)))
-        results = pool.map(cache_potential_inspection_data, chunk)
-        potential_new_inspection_ids_dataframe = pd.concat(
-            [pd.DataFrame(x, index=[i]) for i, x in enumerate(results)])
-        potential_new_inspection_ids_dataframe["date_downloaded"] = time.strftime("%x")
-        potential_new_inspection_ids_dataframe["data_extracted"] = False
-        potential_inspection_ids_dataframe = pd.concat([potential_inspection_ids_dataframe,
-                                                        potential_new_inspection_ids_dataframe])
-        potential_inspection_ids_dataframe.to_csv("output/potential_inspection_ids.csv", index=False)
+    print("Sweep summary:")
+    for key, value in scheduler.recall_report().items():
+        print("    " + key + ": " + str(value))
@@ -1,278 +1,276 @@
 #!/usr/bin/env python
-from bs4 import BeautifulSoup
-import datetime
 import pandas as pd
-import os
-from multiprocessing.pool import Pool
+import numpy as np
+import pyarrow as pa
+import time
 import pickle
-
-
-def get_validity_data(inspection_id,
-                      downloaded_cache_dir='scraped_inspections_html',
-                      potential_downloaded_cache_dir='potential_inspections_html'):
-    cache_path = downloaded_cache_dir + '/' + str(inspection_id)
-    if os.path.exists(cache_path):
-        cache_file_name = cache_path + '/inspection.html'
-    else:
-        cache_file_name = potential_downloaded_cache_dir + '/' + str(inspection_id) + '/inspection.html'
-    soup = BeautifulSoup(open(cache_file_name), 'lxml')
-
-    if not soup.find('span', string='Food Establishment Inspection Report'):
-        print(str(inspection_id) + ' is cached but appears to be invalid')
-        return
-
-    def get_datetime_from_mdy_soup_array(mdy_soup_array):
-        # First clean spaces
-        cleaned_mdy_string_array = [x.text.split() for x in mdy_soup_array]
-        if len(cleaned_mdy_string_array[0]) > 0:
-            mdy_array = [int(x[0]) for x in cleaned_mdy_string_array]
-            return datetime.date(month=mdy_array[0], day=mdy_array[1], year=mdy_array[2])
-        else:
-            return None
-
-    def get_time_from_hm_soup_array(hm_soup_array):
-        # First clean spaces
-        clean_hm_string_array = [x.text.replace(u'\xa0', '') for x in hm_soup_array]
-        if clean_hm_string_array[0] == '':
-            return None
-        else:
-            return clean_hm_string_array[0] + ':' + clean_hm_string_array[1] + ' ' + clean_hm_string_array[2]
-
+import sys
+import os
+from pathlib import Path
+from inspection_cache import DEFAULT_CACHE_DIR, get_inspection_cache
+from inspection_parser import parse_inspection_report, ReportParseError, SUMMARY_COLUMNS, VIOLATION_DETAIL_COLUMNS
+from inspection_types import normalize_inspection_types
+from id_index import LIVE, load_id_index
+from page_triage import UNTRIAGED, might_be_report, page_class_counts, triage_cached_pages
+from output_store import get_output_format, save_table, table_exists, table_path, drop_table, remove_rows, \
+    append_csv, replace_csv, records_to_arrow
+from profiling import get_profiler, profiled
+from worker_pool import get_pool, get_pool_size, run_isolated, quarantine, load_quarantined_ids, \
+    release_quarantined_ids
+from pipeline_metrics import METRICS
+from violation_codes import load_violation_codes, report_formats
+
+
+# Parses the cached report for the given inspection id (see inspection_parser.py for the fields extracted)
+def get_validity_data(inspection_id, cache_dir=DEFAULT_CACHE_DIR):
     # File Hash - Note: Not useful for duplicate detection because of individual file signing in hidden input divs
-    # file_md5_hash = hashlib.md5(open(cache_file_name, 'rb').read()).hexdigest()
-
-    # Establishment Name
-    establishment_name_block = soup.find('span', string='Establishment Name').find_parent()
-    establishment_name = ' '.join(establishment_name_block.contents[2].split())
-
-    # Address
-    address_block = soup.find('span', string='Address').find_parent()
-    address = ' '.join(address_block.contents[2].split())
-    city_state_zip_block = soup.find('span', string='City/State/Zip Code').find_parent()
-    address = address + ' ' + ' '.join(city_state_zip_block.contents[2].split())
-
-    # Telephone and E-mail
-    telephone_email_block = soup.find('span', string='Telephone').find_parent()
-    telephone = telephone_email_block.contents[3].text.replace(u'\xa0', '')
-    email = next(iter(telephone_email_block.contents[6].split() or []), None)
-
-    # Inspection Date and Time
-    inspection_date_time_block = soup.find('span', string='Date of Inspection').find_parent()
-    inspection_date = get_datetime_from_mdy_soup_array(inspection_date_time_block.contents[3:12:4])
-    inspection_time_in = get_time_from_hm_soup_array(inspection_date_time_block.contents[x] for x in [15, 19, 21])
-    inspection_time_out = get_time_from_hm_soup_array(inspection_date_time_block.contents[x] for x in [25, 29, 31])
-
-    # License Holder
-    license_holder_block = soup.find('span', string='License Holder').find_parent()
-    license_holder = ' '.join(license_holder_block.contents[2].split())
-
-    # License/Customer Number
-    license_number_block = soup.find('span', string='License/Customer No.').find_parent()
-    license_number = next(iter(license_number_block.contents[2].split() or []), None)
-
-    # License Period
-    license_period_block = soup.find('span', string='License Period').find_parent()
-    license_period_start = get_datetime_from_mdy_soup_array(license_period_block.contents[3:12:4])
-    license_period_end = get_datetime_from_mdy_soup_array(license_period_block.contents[15:24:4])
-
-    # Inspection Type
-    inspection_type = soup.find('span', string='\xa0Type of Inspection').find_next_sibling().get_text(strip=True)
-
-    # Establishment Type
-    establishment_type_block = soup.find('span', string='Establishment Type:').find_parent()
-    establishment_type = ' '.join(establishment_type_block.contents[2].split())
-
-    # Risk Category
-    risk_category_red_square = soup.find('div', class_='checkboxRedN',
-                                         attrs={'style': 'height:5px;width:5px;background-color:#FF0000;'})
-    if risk_category_red_square is not None:
-        risk_category = int(risk_category_red_square.find_previous_sibling().text[-1:])
+    # file_md5_hash = get_inspection_cache(cache_dir).content_hash(inspection_id)
+
+    data = get_inspection_cache(cache_dir).get(inspection_id)
+    try:
+        with METRICS.timer('parse_seconds'):
+            inspection_data = parse_inspection_report(inspection_id, data)
+    except ReportParseError as error:
+        METRICS.increment('reports_parsed', result='failed')
+        METRICS.increment('parse_failures', field=error.field)
+        raise
+    if inspection_data is None:
+        print(str(inspection_id) + ' is cached but appears to be invalid')
+        METRICS.increment('reports_parsed', result='invalid')
     else:
-        risk_category = None
-
-    # Violation Counts
-    def extract_violation_counts(text_block):
-        if text_block is not None:
-            violations_block = text_block.find_parent().find_parent()
-            violations_row_elements = violations_block.contents[3:14:4]
-
-            def get_parsed_contents(x):
-                split_contents = x.contents[0].split()
-                if len(split_contents) > 0:
-                    return int(split_contents[0])
-                else:
-                    return 0
-
-            violations_row_elements_parsed = [get_parsed_contents(x) for x in violations_row_elements]
-            return {'count': violations_row_elements_parsed[0],
-                    'corrected_on_site': violations_row_elements_parsed[1],
-                    'repeated': violations_row_elements_parsed[2]}
-        else:
-            return {'count': None,
-                    'corrected_on_site': None,
-                    'repeated': None}
-
-    # Older inspection reports have 'Critical' and 'Noncritical' violations
-    critical_violations_counts = extract_violation_counts(soup.find('b', string='Critical Violations'))
-    noncritical_violations_counts = extract_violation_counts(soup.find('b', string='Noncritical Violations'))
-
-    # Newer reports have 'Priority', 'Priority Foundation' and 'Core' violations
-    priority_violations_counts = extract_violation_counts(soup.find('b', string='Priority'))
-    priority_foundation_violations_counts = extract_violation_counts(soup.find('b', string='Priority Foundation'))
-    core_violations_counts = extract_violation_counts(soup.find('b', string='Core'))
-
-    # Violation Details
-    violation_details_rows = list(soup.find('td', string='OBSERVATIONS').find_parent().next_siblings)[1:-2:2]
-
-    def get_violation_description(violation_number):
-        violation_number_td = soup.find('td', string = str(violation_number) + ".")
-        if violation_number_td is not None:
-            return violation_number_td.next_sibling.next_sibling.text
-        else:
-            return None
-
-    def parse_violation_details_row(row):
-        observation_tokens = row.td.contents[0].split()
-        if len(observation_tokens) > 0:
-            dcmr_25_code_block = row.td.find_next_sibling()
-            if dcmr_25_code_block is not None:
-                dcmr_25_code = dcmr_25_code_block.get_text(strip=True)
-            else:
-                dcmr_25_code = None
-            try:
-                int(observation_tokens[0][:-1])
-                return {'inspection_id': inspection_id,
-                        'violation_number': observation_tokens[0][:-1],
-                        'violation_description': get_violation_description(observation_tokens[0][:-1]),
-                        'violation_text': ' '.join(observation_tokens[2:]),
-                        'dcmr_25_code': dcmr_25_code}
-            except ValueError:
-                return None
-        else:
-            return None
-
-    violation_details = [x for x in
-                         [parse_violation_details_row(row) for row in violation_details_rows] if x is not None]
-
-    # Inspector Comments
-    inspector_comments_block = soup.find('b', string='Inspector Comments:')
-    inspector_comments = inspector_comments_block.find_parent().get_text(' ', strip=True)[20:]
-
-    # Inspector Data (Name and Badge)
-    inspector_data_block = soup.find('td', string='\xa0\xa0Inspector (Signature)').find_parent().find_previous_sibling()
-    inspector_name = inspector_data_block.contents[3].text.replace(u'\xa0', '')
-    inspector_badge_number = inspector_data_block.contents[5].text.replace(u'\xa0', '')
-
-    return ({'inspection_summary':
-             {'inspection_id': inspection_id,
-              'establishment_name': establishment_name,
-              'address': address,
-              'telephone': telephone,
-              'email': email,
-              'inspection_date': inspection_date,
-              'inspection_time_in': inspection_time_in,
-              'inspection_time_out': inspection_time_out,
-              'license_holder': license_holder,
-              'license_number': license_number,
-              'license_period_start': license_period_start,
-              'license_period_end': license_period_end,
-              'establishment_type': establishment_type,
-              'risk_category': risk_category,
-              'inspection_type': inspection_type,
-              'total_violations': len(violation_details),
-              'priority_violations': priority_violations_counts['count'],
-              'priority_violations_corrected_on_site': priority_violations_counts['corrected_on_site'],
-              'priority_violations_repeated': priority_violations_counts['repeated'],
-              'priority_foundation_violations': priority_foundation_violations_counts['count'],
-              'priority_foundation_violations_corrected_on_site':
-                  priority_foundation_violations_counts['corrected_on_site'],
-              'priority_foundation_violations_repeated': priority_foundation_violations_counts['repeated'],
-              'core_violations': core_violations_counts['count'],
-              'core_violations_corrected_on_site': core_violations_counts['corrected_on_site'],
-              'core_violations_repeated': core_violations_counts['repeated'],
-              'critical_violations': critical_violations_counts['count'],
-              'critical_violations_corrected_on_site': critical_violations_counts['corrected_on_site'],
-              'critical_violations_repeated': critical_violations_counts['repeated'],
-              'noncritical_violations': noncritical_violations_counts['count'],
-              'noncritical_violations_corrected_on_site': noncritical_violations_counts['corrected_on_site'],
-              'noncritical_violations_repeated': noncritical_violations_counts['repeated'],
-              'inspector_comments': inspector_comments,
-              'inspector_name': inspector_name,
-              'inspector_badge_number': inspector_badge_number},
-             'violation_details': violation_details})
+        METRICS.increment('reports_parsed', result='valid')
+    return inspection_data
+
+
+summary_columns = SUMMARY_COLUMNS
+violation_details_columns = VIOLATION_DETAIL_COLUMNS
+
+# Inspections that have been extracted (and saved) during a run are recorded here as the run goes along, so that an
+# interrupted run can carry on where it stopped. It is folded into potential_inspection_ids.csv when the run finishes
+checkpoint_filename = 'output/potential_inspection_extraction_checkpoint.csv'
+
+
+# Inspections are handed to the workers this many at a time
+chunk_size = 100
+
+
+# Summary rows as an Arrow table, with the known_valid and inspection_type_category columns added
+def summary_table(summaries):
+    summary = records_to_arrow(summaries, summary_columns)
+    summary = summary.append_column('known_valid', pa.array([x['inspection_id'] in known_valid_inspection_ids
+                                                             for x in summaries], type=pa.bool_()))
+    return summary.append_column('inspection_type_category', pa.array(
+        normalize_inspection_types(summary.column('inspection_type').to_pandas())))
+
+
+# Violation details rows as an Arrow table, with the report format and inspection year of each row added (from the
+# summary table); the repetitive columns are dictionary encoded, ready for violation_codes.ViolationCodes.encode_arrow
+def violation_details_table(summary, violation_details):
+    summary = summary.select(['inspection_id', 'inspection_date', 'priority_violations', 'core_violations',
+                              'critical_violations', 'noncritical_violations']).to_pandas().set_index('inspection_id')
+    inspection_ids = pd.Series([x['inspection_id'] for x in violation_details], dtype='int64')
+    details = records_to_arrow(violation_details, violation_details_columns)
+    for column in ['violation_number', 'violation_description']:
+        details = details.set_column(details.column_names.index(column), column,
+                                     details.column(column).dictionary_encode())
+    details = details.append_column('report_format', pa.array(
+        inspection_ids.map(report_formats(summary)), type=pa.string()).dictionary_encode())
+    return details.append_column('inspection_year', pa.array(
+        inspection_ids.map(pd.to_datetime(summary['inspection_date']).dt.year), type=pa.int16()))
+
+
+def chunk_tables(summaries, violation_details):
+    summary = summary_table(summaries)
+    return summary, violation_details_table(summary, violation_details)
+
+
+# Extracts a chunk of inspections in a worker, and hands the rows back as Arrow tables, which are far cheaper to send
+# back than the nested dicts of each report, and which the main process only has to concatenate and save
+# Errors (and reports that take too long) are caught for each report, so a broken page never takes down the pool
+# The tables of a chunk are built together, so if that fails none of its rows are kept and all of its inspections are
+# quarantined (rather than the error taking down the pool)
+# The metrics recorded by the worker are passed back with the result
+def extract_inspection_chunk(inspection_ids):
+    summaries, violation_details, failures = [], [], []
+    for inspection_id in inspection_ids:
+        result, failure = run_isolated(get_validity_data, (inspection_id,))
+        if failure is not None:
+            failures.append(dict(inspection_id=inspection_id, **failure))
+        elif result is not None:
+            summaries.append(result['inspection_summary'])
+            violation_details.extend(result['violation_details'])
+    tables, failure = run_isolated(chunk_tables, (summaries, violation_details))
+    if failure is not None:
+        failed_ids = set(x['inspection_id'] for x in failures)
+        failures.extend(dict(inspection_id=x, **failure) for x in inspection_ids if x not in failed_ids)
+        tables = chunk_tables([], [])
+    return (inspection_ids,) + tables + (failures, METRICS.drain())
+
+
+# Runs the extraction over the pool and yields (inspection_ids, summary, violation_details, failures) for every
+# batch_size or so inspections, where summary and violation_details are Arrow tables and failures lists the
+# inspections whose extraction failed
+# Results are handed on as soon as they are ready, so memory use is bounded by the batch size
+def iterate_result_batches(pool, inspection_ids, batch_size):
+    chunks = [inspection_ids[i:i + chunk_size] for i in range(0, len(inspection_ids), chunk_size)]
+    batch = []
+    for result in pool.imap_unordered(extract_inspection_chunk, chunks):
+        METRICS.merge(result[-1])
+        batch.append(result[:-1])
+        if sum(len(x[0]) for x in batch) >= batch_size:
+            yield combine_results(batch)
+            batch = []
+    if len(batch) > 0:
+        yield combine_results(batch)
+
+
+def combine_results(results):
+    return ([x for inspection_ids, _, _, _ in results for x in inspection_ids],
+            pa.concat_tables([x for _, x, _, _ in results]),
+            pa.concat_tables([x for _, _, x, _ in results]),
+            [x for _, _, _, failures in results for x in failures])
+
+
+# Records the extracted inspections in potential_inspection_ids.csv
+def mark_extracted(inspection_ids_dataframe, extracted_hashes):
+    extracted_hashes = extracted_hashes[~extracted_hashes.index.duplicated(keep='last')]
+    extracted = inspection_ids_dataframe['inspection_id'].isin(extracted_hashes.index)
+    inspection_ids_dataframe.loc[extracted, 'data_extracted'] = True
+    inspection_ids_dataframe.loc[extracted, 'content_hash'] = \
+        inspection_ids_dataframe.loc[extracted, 'inspection_id'].map(extracted_hashes)
+    replace_csv(inspection_ids_dataframe, 'output/potential_inspection_ids.csv')
 
 
 potential_inspection_ids_dataframe = pd.read_csv('output/potential_inspection_ids.csv')
 scraped_inspection_links_dataframe = pd.read_csv('output/scraped_inspection_links.csv')
 
 historical_known_valid_inspection_ids = pd.read_csv('historical_known_valid_inspection_ids.csv')['inspection_id']
-
-chunk_size = 2000
-
-ids_to_extract = potential_inspection_ids_dataframe[
-                                   potential_inspection_ids_dataframe['was_live']]['inspection_id']
+known_valid_inspection_ids = set(scraped_inspection_links_dataframe['inspection_id']) | \
+    set(historical_known_valid_inspection_ids)
+
+batch_size = 2000
+
+# By default only inspections that have not been extracted yet, or whose cached page has changed since it was
+# extracted (according to the content hash recorded in potential_inspection_ids.csv), are processed
+# Run with --full to re-extract everything
+if 'content_hash' not in potential_inspection_ids_dataframe.columns:
+    potential_inspection_ids_dataframe['content_hash'] = None
+# Output tables are saved as Parquet datasets unless run with --csv
+output_format = get_output_format(sys.argv[1:])
+# Run with --profile (or --profile=pyinstrument) to profile the extraction in a single process
+profiler = get_profiler(sys.argv[1:])
+full_refresh = '--full' in sys.argv[1:] or not table_exists('potential_inspection_summary_data', output_format)
+# Inspections that failed to extract are quarantined (see worker_pool.py) and only retried when their cached page
+# changes, or when run with --retry-quarantined
+retry_quarantined = '--retry-quarantined' in sys.argv[1:]
+
+
+# Resume an interrupted run
+if Path(checkpoint_filename).exists():
+    checkpoint_dataframe = pd.read_csv(checkpoint_filename).dropna()
+    print("Resuming: found", len(checkpoint_dataframe), "inspections extracted by an interrupted run.")
+    mark_extracted(potential_inspection_ids_dataframe, checkpoint_dataframe.set_index('inspection_id')['content_hash'])
+    os.remove(checkpoint_filename)
+    full_refresh = False
+
+# Live ids that are not in potential_inspection_ids.csv yet (e.g. linked to by the site and cached by 02) are added
+id_index = load_id_index()
+live_ids = id_index.ids_with_state(LIVE)
+missing_live_ids = np.setdiff1d(live_ids, potential_inspection_ids_dataframe['inspection_id'].to_numpy())
+if len(missing_live_ids) > 0:
+    potential_inspection_ids_dataframe = pd.concat([potential_inspection_ids_dataframe,
+                                                    pd.DataFrame({'inspection_id': missing_live_ids,
+                                                                  'was_live': True,
+                                                                  'date_downloaded': time.strftime('%x'),
+                                                                  'data_extracted': False})], ignore_index=True)
+
+# Only pages that are actually in the cache can be extracted
+cached_content_hashes = potential_inspection_ids_dataframe['inspection_id'].map(get_inspection_cache().content_hash)
+needs_extraction = potential_inspection_ids_dataframe['was_live'].astype(bool) & cached_content_hashes.notna()
+if not full_refresh:
+    needs_extraction &= ~potential_inspection_ids_dataframe['data_extracted'].astype(bool) | \
+                        (potential_inspection_ids_dataframe['content_hash'] != cached_content_hashes) | \
+                        (retry_quarantined & potential_inspection_ids_dataframe['inspection_id'].isin(
+                            load_quarantined_ids('03alt_extract_potential_inspection_data')))
+content_hashes_to_extract = pd.Series(cached_content_hashes[needs_extraction].values,
+                                      index=potential_inspection_ids_dataframe.loc[needs_extraction, 'inspection_id'])
+content_hashes_to_extract = content_hashes_to_extract[~content_hashes_to_extract.index.duplicated()]
+ids_to_extract = content_hashes_to_extract.index
 
 if len(ids_to_extract) > 0:
-    chunks = [ids_to_extract[x:x + chunk_size] for x in range(0, len(ids_to_extract), chunk_size)]
-    pool = Pool(7)
-    potential_inspection_summary_data = pd.DataFrame()
-    potential_violation_details_data = pd.DataFrame()
-    for i, chunk in enumerate(chunks):
-        print("Processing chunk " + str(i+1) + " of " + str(len(chunks)))
-        results = pool.map(get_validity_data, chunk)
-        new_potential_inspection_summary_data = pd.concat([pd.DataFrame(x['inspection_summary'], index=[i])
-                                                       for i, x in enumerate(results) if x is not None])
-        potential_inspection_summary_data = pd.concat([potential_inspection_summary_data,
-                                                       new_potential_inspection_summary_data])
-        new_potential_violation_details_data = pd.concat([pd.DataFrame(x['violation_details'])
-                                                      for x in results if x is not None])
-        potential_violation_details_data = pd.concat([potential_violation_details_data,
-                                                      new_potential_violation_details_data])
-
-potential_inspection_summary_data = potential_inspection_summary_data[
-    ['inspection_id',
-     'establishment_name',
-     'address',
-     'telephone',
-     'email',
-     'inspection_date',
-     'inspection_time_in',
-     'inspection_time_out',
-     'license_holder',
-     'license_number',
-     'license_period_start',
-     'license_period_end',
-     'establishment_type',
-     'risk_category',
-     'inspection_type',
-     'total_violations',
-     'priority_violations',
-     'priority_violations_corrected_on_site',
-     'priority_violations_repeated',
-     'priority_foundation_violations',
-     'priority_foundation_violations_corrected_on_site',
-     'priority_foundation_violations_repeated',
-     'core_violations',
-     'core_violations_corrected_on_site',
-     'core_violations_repeated',
-     'critical_violations',
-     'critical_violations_corrected_on_site',
-     'critical_violations_repeated',
-     'noncritical_violations',
-     'noncritical_violations_corrected_on_site',
-     'noncritical_violations_repeated',
-     'inspector_comments',
-     'inspector_name',
-     'inspector_badge_number']]
-potential_inspection_summary_data['known_valid'] = False
-potential_inspection_summary_data.loc[
-    potential_inspection_summary_data['inspection_id'].isin(
-        scraped_inspection_links_dataframe['inspection_id']) |
-    potential_inspection_summary_data['inspection_id'].isin(
-        historical_known_valid_inspection_ids),
-    'known_valid'] = True
-potential_inspection_summary_data.to_csv('output/potential_inspection_summary_data.csv', index=False)
-
-potential_violation_details_data = potential_violation_details_data[
-    ['inspection_id', 'violation_number', 'violation_description', 'violation_text', 'dcmr_25_code']]
-potential_violation_details_data.to_csv('output/potential_violation_details_data.csv', index=False)
+    print("Extracting data for", len(ids_to_extract), "new or changed inspections.")
+    release_quarantined_ids('03alt_extract_potential_inspection_data', ids_to_extract)
+    # Violation descriptions are saved as codes (see violation_codes.py), except when adding to a CSV table that was
+    # saved with the descriptions themselves (until it is re-extracted with --full)
+    violation_codes = load_violation_codes()
+    encode_violation_descriptions = output_format != 'csv' or full_refresh or \
+        not table_exists('potential_violation_details_data', output_format) or \
+        'violation_code' in pd.read_csv(table_path('potential_violation_details_data', output_format), nrows=0).columns
+    # Old rows for the inspections being re-extracted are dropped once up front, new rows are then appended per batch
+    # (for a full refresh everything is first marked as not extracted, so that an interrupted run resumes correctly)
+    if full_refresh:
+        potential_inspection_ids_dataframe['data_extracted'] = False
+        replace_csv(potential_inspection_ids_dataframe, 'output/potential_inspection_ids.csv')
+    for table_name in ['potential_inspection_summary_data', 'potential_violation_details_data']:
+        if full_refresh:
+            drop_table(table_name, output_format)
+        else:
+            remove_rows(table_name, ids_to_extract, output_format)
+
+    # Pages that cannot be reports (see page_triage.py) are not sent to the workers at all; they are recorded as
+    # extracted (with no rows) like the invalid ones. Pages that have not been triaged yet are triaged now, and so are
+    # the ones triaged as not being reports, which are small, in case the cached page has changed since
+    page_classes = id_index.page_class(ids_to_extract)
+    to_triage = ids_to_extract[(page_classes == UNTRIAGED) | ~might_be_report(page_classes)].to_numpy()
+    if len(to_triage) > 0:
+        id_index.update_page_classes(to_triage, triage_cached_pages(to_triage, get_inspection_cache()))
+        id_index.save()
+    page_classes = id_index.page_class(ids_to_extract)
+    ids_to_parse = ids_to_extract[might_be_report(page_classes)]
+    if len(ids_to_parse) < len(ids_to_extract):
+        print(len(ids_to_extract) - len(ids_to_parse), "cached pages are not inspection reports:",
+              {k: v for k, v in page_class_counts(page_classes[~might_be_report(page_classes)]).items() if v > 0})
+        METRICS.increment('reports_parsed', len(ids_to_extract) - len(ids_to_parse), result='triaged_out')
+        skipped_ids = ids_to_extract.difference(ids_to_parse)
+        append_csv(pd.DataFrame({'inspection_id': skipped_ids,
+                                 'content_hash': content_hashes_to_extract[skipped_ids].values}), checkpoint_filename)
+
+    number_of_batches = (len(ids_to_parse) + batch_size - 1) // batch_size
+    METRICS.start_stage('03alt_extract_potential_inspection_data')
+    pool = get_pool(get_pool_size(sys.argv[1:]), in_process=profiler is not None)
+    with profiled('03alt_extract_potential_inspection_data', profiler):
+        number_done = 0
+        for i, (batch_ids, potential_inspection_summary_data, potential_violation_details_data, failures) in \
+                enumerate(iterate_result_batches(pool, ids_to_parse.tolist(), batch_size)):
+            print("Processing batch " + str(i+1) + " of " + str(number_of_batches))
+            if encode_violation_descriptions:
+                potential_violation_details_data = violation_codes.encode_arrow(potential_violation_details_data)
+            else:
+                potential_violation_details_data = potential_violation_details_data.drop_columns(['report_format'])
+                for column in ['violation_number', 'violation_description']:
+                    potential_violation_details_data = potential_violation_details_data.set_column(
+                        potential_violation_details_data.column_names.index(column), column,
+                        potential_violation_details_data.column(column).cast(pa.string()))
+
+            save_table(potential_inspection_summary_data, 'potential_inspection_summary_data',
+                       output_format=output_format)
+            save_table(potential_violation_details_data, 'potential_violation_details_data',
+                       output_format=output_format)
+
+            quarantine([dict(content_hash=content_hashes_to_extract[x['inspection_id']], **x) for x in failures],
+                       '03alt_extract_potential_inspection_data')
+
+            # Quarantined inspections are recorded as extracted too, so that they are not retried on every run
+            append_csv(pd.DataFrame({'inspection_id': batch_ids,
+                                     'content_hash': content_hashes_to_extract[batch_ids].values}),
+                       checkpoint_filename)
+            number_done += len(batch_ids)
+            METRICS.emit('03alt_extract_potential_inspection_data', number_done, len(ids_to_parse))
+    pool.close()
+
+    # Update index
+    mark_extracted(potential_inspection_ids_dataframe, content_hashes_to_extract)
+    os.remove(checkpoint_filename)
+
+else:
+    print("All cached inspections have already been processed")
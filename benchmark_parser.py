@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+import datetime
+import gzip
+import json
+import platform
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+import lxml
+from lxml import etree
+from inspection_cache import DEFAULT_CACHE_DIR, get_inspection_cache
+from inspection_parser import InspectionReport, SUMMARY_FIELDS, VIOLATION_DETAIL_FIELDS, decode_report, \
+    parse_inspection_report, parse_inspection_report_bs4
+from page_refresh import normalize_page
+
+
+# A frozen sample of anonymized reports from the html cache (created with freeze, it is not part of the repository),
+# kept between runs so that timings are comparable across commits
+CORPUS_DIR = "benchmark_corpus"
+RESULTS_DIR = "benchmark_results"
+
+# Slowdowns above this fraction are flagged by compare
+REGRESSION_THRESHOLD = 0.1
+
+# Blocks whose text identifies the establishment or the inspector, and so is masked in the corpus
+# (the label itself is kept, as the parser looks for it)
+IDENTIFYING_BLOCKS = [("span", "Establishment Name"), ("span", "Address"), ("span", "City/State/Zip Code"),
+                      ("span", "Telephone"), ("span", "License Holder"), ("span", "License/Customer No."),
+                      ("b", "Inspector Comments:")]
+
+# Summary fields that must survive anonymization unchanged, so that the corpus exercises the same code paths
+NON_IDENTIFYING_FIELDS = [x for x in SUMMARY_FIELDS if x not in
+                          ["inspection_id", "establishment_name", "address", "telephone", "email", "license_holder",
+                           "license_number", "inspector_comments", "inspector_name", "inspector_badge_number"]]
+
+
+def get_report_format(report):
+    return "new" if report.label("b", "Priority") is not None else "old"
+
+
+# Replaces letters with x and digits with 0, keeping the length, spacing and punctuation of the text
+def _mask(text):
+    if not text:
+        return text
+    return re.sub("[0-9]", "0", re.sub("[^\\W\\d_]", "x", text))
+
+
+# Masks the words of an observation after the violation number and IN/OUT marker (e.g. '12. OUT ...')
+def _mask_observation(text):
+    match = re.match("\\s*\\S+\\s+\\S+", text or "")
+    return text[:match.end()] + _mask(text[match.end():]) if match is not None else text
+
+
+def _mask_element(element, keep=None):
+    for node in element.iter():
+        if node is not keep and node.tag is not etree.Comment:
+            node.text = _mask(node.text)
+        if node is not element:
+            node.tail = _mask(node.tail)
+
+
+# A copy of the report with the names, addresses, contact details, comments and observations masked and the
+# per-download signatures removed, or None if the masked copy does not parse the same way as the original
+def anonymize_report(data):
+    original = InspectionReport(0, data)
+    # The tree of this second parse is modified in place
+    report = InspectionReport(0, normalize_page(data))
+    if not report.is_valid():
+        return None
+    tree = report.label("span", "Food Establishment Inspection Report").getroottree()
+    for tag, label in IDENTIFYING_BLOCKS:
+        if report.label(tag, label) is not None:
+            _mask_element(report.block(tag, label), keep=report.label(tag, label))
+    if report.label("td", "\xa0\xa0Inspector (Signature)") is not None:
+        _mask_element(report.block("td", "\xa0\xa0Inspector (Signature)").getprevious())
+    for row in report.violation_rows():
+        row.td.text = _mask_observation(row.td.text)
+    anonymized = etree.tostring(tree, method="html", encoding="utf-8", doctype="<!DOCTYPE html>")
+
+    anonymized_report = InspectionReport(0, anonymized)
+    if not anonymized_report.is_valid() or \
+            any(anonymized_report.get(x) != original.get(x) for x in NON_IDENTIFYING_FIELDS) or \
+            [x.violation_number for x in anonymized_report.violation_rows()] != \
+            [x.violation_number for x in original.violation_rows()]:
+        return None
+    return anonymized
+
+
+# Writes an anonymized random sample of the cached reports to the corpus directory, sample_size of each format
+# (old: Critical/Noncritical violations, new: Priority/Priority Foundation/Core violations)
+def freeze_corpus(sample_size=50, corpus_dir=CORPUS_DIR, cache_dir=DEFAULT_CACHE_DIR, seed=0):
+    cache = get_inspection_cache(cache_dir)
+    inspection_ids = cache.ids()
+    random.Random(seed).shuffle(inspection_ids)
+    samples = {"old": [], "new": []}
+    for inspection_id in inspection_ids:
+        if all(len(x) >= sample_size for x in samples.values()):
+            break
+        data = cache.get(inspection_id)
+        report = InspectionReport(inspection_id, data)
+        if not report.is_valid() or len(samples[get_report_format(report)]) >= sample_size:
+            continue
+        anonymized = anonymize_report(data)
+        if anonymized is not None:
+            samples[get_report_format(report)].append(anonymized)
+
+    Path(corpus_dir).mkdir(exist_ok=True)
+    for old_file in Path(corpus_dir).glob("*.html.gz"):
+        old_file.unlink()
+    for report_format, reports in samples.items():
+        for i, anonymized in enumerate(reports):
+            # mtime=0 so that refreezing the same sample gives identical files
+            with open(Path(corpus_dir) / (report_format + "_" + str(i).zfill(3) + ".html.gz"), "wb") as report_file:
+                report_file.write(gzip.compress(anonymized, mtime=0))
+        print("Froze", len(reports), report_format, "format reports.")
+
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    corpus = {}
+    for report_file in sorted(Path(corpus_dir).glob("*.html.gz")):
+        corpus[report_file.name] = report_file.read_bytes()
+    if len(corpus) == 0:
+        raise FileNotFoundError("No reports in " + corpus_dir +
+                                " (create them with: python benchmark_parser.py freeze)")
+    return corpus
+
+
+def _best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# Times each stage of parsing every report in the corpus (the best of repeat runs), and each field on its own
+# Field timings start from an already built tree with nothing computed, so they include locating the blocks the field
+# needs (which, when all fields are extracted, are shared with other fields)
+def run_benchmark(corpus_dir=CORPUS_DIR, repeat=5, include_bs4=True):
+    read_start = time.perf_counter()
+    compressed_corpus = load_corpus(corpus_dir)
+    corpus = {name: gzip.decompress(x) for name, x in compressed_corpus.items()}
+    read_seconds = time.perf_counter() - read_start
+
+    reports = []
+    field_seconds = {x: [] for x in list(SUMMARY_FIELDS) + ["violation_rows"] +
+                     ["violation_details." + y for y in VIOLATION_DETAIL_FIELDS]}
+    for name, data in corpus.items():
+        report = InspectionReport(0, data)
+        result = {"report": name,
+                  "format": get_report_format(report),
+                  "bytes": len(data),
+                  "violations": len(report.violation_rows()),
+                  "decode_seconds": _best_time(lambda: decode_report(data), repeat),
+                  "tree_seconds": _best_time(lambda: InspectionReport(0, data), repeat),
+                  "parse_seconds": _best_time(lambda: parse_inspection_report(0, data), repeat)}
+        if include_bs4:
+            result["bs4_parse_seconds"] = _best_time(lambda: parse_inspection_report_bs4(0, data), repeat)
+        reports.append(result)
+
+        def time_field(function):
+            def run():
+                report.computed = {}
+                function()
+            return _best_time(run, repeat)
+
+        for field in SUMMARY_FIELDS:
+            field_seconds[field].append(time_field(lambda: report.get(field)))
+        field_seconds["violation_rows"].append(time_field(report.violation_rows))
+        rows = report.violation_rows()
+        for field, function in VIOLATION_DETAIL_FIELDS.items():
+            field_seconds["violation_details." + field].append(
+                time_field(lambda: [function(report, row) for row in rows]))
+
+    parse_seconds = sum(x["parse_seconds"] for x in reports)
+    results = {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+               "commit": _git_commit(),
+               "python": platform.python_version(),
+               "lxml": ".".join(str(x) for x in lxml.etree.LXML_VERSION),
+               "corpus_reports": len(reports),
+               "corpus_bytes": sum(x["bytes"] for x in reports),
+               "repeat": repeat,
+               "read_seconds": read_seconds,
+               "parse_seconds": parse_seconds,
+               "docs_per_second": len(reports) / parse_seconds,
+               "docs_per_second_by_format": {
+                   y: len([x for x in reports if x["format"] == y]) /
+                   sum(x["parse_seconds"] for x in reports if x["format"] == y)
+                   for y in sorted(set(x["format"] for x in reports))},
+               "field_mean_seconds": {x: statistics.mean(y) for x, y in field_seconds.items()},
+               "reports": reports}
+    if include_bs4:
+        results["bs4_docs_per_second"] = len(reports) / sum(x["bs4_parse_seconds"] for x in reports)
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, results_dir=RESULTS_DIR):
+    Path(results_dir).mkdir(exist_ok=True)
+    filename = Path(results_dir) / (results["date"].replace(":", "") + "_" + str(results["commit"]) + ".json")
+    with open(filename, "w") as results_file:
+        json.dump(results, results_file, indent=1)
+    return filename
+
+
+def print_results(results):
+    print("Parsed", results["corpus_reports"], "reports at", round(results["docs_per_second"], 1), "docs/sec",
+          results["docs_per_second_by_format"])
+    if "bs4_docs_per_second" in results:
+        print("bs4 reference implementation:", round(results["bs4_docs_per_second"], 1), "docs/sec")
+    print("Reading the corpus took", round(results["read_seconds"], 3), "seconds, peak RSS", results["peak_rss_kb"],
+          "kB")
+    print("Mean time per report by field (microseconds):")
+    for field, seconds in sorted(results["field_mean_seconds"].items(), key=lambda x: -x[1]):
+        print("    " + field + ":", round(seconds * 1e6, 1))
+
+
+# Prints the change in each timing between two saved results, returning True if any got slower by more than
+# REGRESSION_THRESHOLD
+def compare_results(baseline_filename, results_filename):
+    with open(baseline_filename) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(results_filename) as results_file:
+        results = json.load(results_file)
+    timings = [("parse_seconds", baseline["parse_seconds"], results["parse_seconds"])] + \
+        [(x, baseline["field_mean_seconds"][x], results["field_mean_seconds"][x])
+         for x in results["field_mean_seconds"] if x in baseline["field_mean_seconds"]]
+    regressed = False
+    for name, before, after in timings:
+        change = after / before - 1 if before > 0 else 0.0
+        flag = ""
+        if change > REGRESSION_THRESHOLD:
+            flag = "  <-- slower"
+            regressed = True
+        print(name + ":", "{:+.1%}".format(change), flag)
+    print("peak_rss_kb:", baseline["peak_rss_kb"], "->", results["peak_rss_kb"])
+    return regressed
+
+
+# python benchmark_parser.py freeze [sample_size]  - (re)create the corpus from the html cache
+# python benchmark_parser.py [run] [--no-bs4]      - run the benchmark and save the results as JSON
+# python benchmark_parser.py compare <baseline.json> <results.json>
+if __name__ == "__main__":
+    args = [x for x in sys.argv[1:] if not x.startswith("--")]
+    if len(args) > 0 and args[0] == "freeze":
+        freeze_corpus(int(args[1]) if len(args) > 1 else 50)
+    elif len(args) > 0 and args[0] == "compare":
+        sys.exit(1 if compare_results(args[1], args[2]) else 0)
+    else:
+        benchmark_results = run_benchmark(include_bs4="--no-bs4" not in sys.argv[1:])
+        print_results(benchmark_results)
+        print("Results saved to", save_results(benchmark_results))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import sys
+import random
+from multiprocessing.pool import Pool
+from lxml import etree
+from inspection_cache import get_inspection_cache
+from inspection_parser import HTML_PARSER, parse_inspection_report, parse_inspection_report_bs4
+
+
+# The report re-serialized with every element on its own indented line, which adds whitespace-only strings
+# throughout the page (BeautifulSoup collapses those, and the lxml parser has to do the same)
+def indent_report(data):
+    root = etree.fromstring(data, HTML_PARSER)
+    etree.indent(root, space='    ')
+    return etree.tostring(root, method='html', encoding='utf-8')
+
+
+# Compares the lxml parser with the BeautifulSoup reference implementation on one cached report (or on the report
+# re-indented by indent_report)
+# Returns a list of the fields that differ (empty if the two agree)
+def compare_parsers(inspection_id, indented=False):
+    data = get_inspection_cache().get(inspection_id)
+    if indented and data:
+        data = indent_report(data)
+    try:
+        expected = parse_inspection_report_bs4(inspection_id, data)
+    except Exception as e:
+        expected = type(e).__name__
+    try:
+        actual = parse_inspection_report(inspection_id, data)
+    except Exception as e:
+        actual = type(e).__name__
+    if expected == actual:
+        return []
+    if not isinstance(expected, dict) or not isinstance(actual, dict):
+        return ["result: " + repr(expected)[:80] + " != " + repr(actual)[:80]]
+    differences = [x for x in expected["inspection_summary"]
+                   if expected["inspection_summary"][x] != actual["inspection_summary"].get(x)]
+    if expected["violation_details"] != actual["violation_details"]:
+        differences.append("violation_details")
+    return differences
+
+
+# Differences on the report as served and on the report re-indented
+def compare_parsers_with_indentation(inspection_id):
+    return compare_parsers(inspection_id) + ["indented " + x for x in compare_parsers(inspection_id, indented=True)]
+
+
+# Usage: python check_parser_parity.py [sample_size]
+# Runs both parsers over the whole html cache (or a random sample of it), as served and re-indented, and reports
+# every report where they differ
+if __name__ == "__main__":
+    inspection_ids = sorted(get_inspection_cache().ids())
+    if len(sys.argv) > 1:
+        inspection_ids = sorted(random.sample(inspection_ids, min(int(sys.argv[1]), len(inspection_ids))))
+
+    print("Comparing parsers on", len(inspection_ids), "cached reports.")
+    mismatches = 0
+    with Pool() as pool:
+        for inspection_id, differences in zip(inspection_ids,
+                                              pool.imap(compare_parsers_with_indentation, inspection_ids, 100)):
+            if len(differences) > 0:
+                mismatches += 1
+                print(str(inspection_id) + " differs: " + ", ".join(differences))
+
+    print("Found", mismatches, "mismatching reports.")
+    sys.exit(1 if mismatches > 0 else 0)
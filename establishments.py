@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+import os
+import re
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from geocodes import load_geocodes
+from output_store import get_output_format, load_table, replace_csv, table_exists
+
+
+# There is no establishment id on the reports, so inspections are linked into establishments here
+# Instead of comparing every pair of inspections, inspections are only compared within blocks that share a key:
+#  - the same license number, which on its own is enough to link them
+#  - the same normalized street address, or the same (rounded) geocode, where they are linked if the establishment
+#    names are similar enough and their license numbers do not contradict each other (food courts and shopping
+#    centres have many establishments at one address)
+# The index is kept in output/establishment_index.csv and updated incrementally: new inspections are resolved against
+# the establishments already in the index (an inspection that links two existing establishments merges them, keeping
+# the lower id) and existing ids are never renumbered otherwise
+
+ESTABLISHMENT_INDEX_FILENAME = "output/establishment_index.csv"
+
+INDEX_COLUMNS = ["inspection_id", "establishment_id", "license_key", "name_key", "address_key", "geocode_key"]
+
+# Geocodes are rounded to this many decimal places (about 10 metres) for blocking
+GEOCODE_DECIMALS = 4
+
+# Establishments at the same address or geocode are linked if their names share at least this fraction of words
+NAME_SIMILARITY_THRESHOLD = 0.5
+
+NAME_STOPWORDS = {"THE", "AND", "INC", "LLC", "CORP", "CO", "LTD", "OF"}
+ADDRESS_ABBREVIATIONS = {"STREET": "ST", "AVENUE": "AVE", "AV": "AVE", "ROAD": "RD", "BOULEVARD": "BLVD",
+                         "PLACE": "PL", "DRIVE": "DR", "COURT": "CT", "TERRACE": "TER", "LANE": "LN", "CIRCLE": "CIR",
+                         "PARKWAY": "PKWY", "SQUARE": "SQ", "HIGHWAY": "HWY", "NORTHWEST": "NW", "NORTHEAST": "NE",
+                         "SOUTHWEST": "SW", "SOUTHEAST": "SE", "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W"}
+# Words that start the unit part of an address (which is dropped along with the word after it)
+ADDRESS_UNIT_WORDS = {"SUITE", "STE", "UNIT", "APT", "FLOOR", "FL", "RM", "ROOM", "BLDG", "SPACE", "STALL", "#"}
+ADDRESS_CITY_WORDS = {"WASHINGTON", "DC", "D.C."}
+
+
+def _words(text):
+    if not isinstance(text, str):
+        return []
+    text = re.sub("([0-9]{5})-[0-9]{4}", "\\1", text.upper().replace("&", " AND "))
+    return re.sub("[^0-9A-Z# ]", " ", re.sub("['.]", "", text)).split()
+
+
+def license_key(license_number):
+    if not isinstance(license_number, str):
+        return None
+    key = re.sub("[^0-9A-Z]", "", license_number.upper())
+    # Placeholders such as 'N/A' or 'NONE' are not license numbers
+    return key if re.search("[0-9]", key) else None
+
+
+def name_key(establishment_name):
+    words = [x for x in _words(establishment_name) if x not in NAME_STOPWORDS]
+    return " ".join(words) if len(words) > 0 else None
+
+
+# Street address without the unit, city, state and zip code, with the usual abbreviations
+def address_key(address):
+    words = []
+    skip_next = False
+    for word in _words(address):
+        if skip_next:
+            skip_next = False
+        elif word in ADDRESS_UNIT_WORDS:
+            skip_next = True
+        elif word.startswith("#"):
+            continue
+        elif word not in ADDRESS_CITY_WORDS and not re.fullmatch("[0-9]{5}([0-9]{4})?", word):
+            words.append(ADDRESS_ABBREVIATIONS.get(word, word))
+    # An address needs a street as well as a number to identify a place
+    return " ".join(words) if len(words) >= 2 else None
+
+
+def geocode_keys(latitudes, longitudes):
+    latitudes = pd.Series(latitudes).round(GEOCODE_DECIMALS)
+    longitudes = pd.Series(longitudes).round(GEOCODE_DECIMALS).set_axis(latitudes.index)
+    keys = latitudes.map("{:.4f}".format) + "," + longitudes.map("{:.4f}".format)
+    return keys.where(latitudes.notna() & longitudes.notna(), None)
+
+
+def name_similarity(name_words_a, name_words_b):
+    if len(name_words_a) == 0 or len(name_words_b) == 0:
+        return 0.0
+    return len(name_words_a & name_words_b) / len(name_words_a | name_words_b)
+
+
+# Applies function to each distinct value only
+def _map_distinct(function, values):
+    codes, distinct_values = pd.factorize(pd.Series(values))
+    return np.array([function(x) for x in distinct_values] + [function(None)], dtype=object)[codes]
+
+
+# Blocking keys for a table of inspections (inspection_id, establishment_name, license_number and optionally address,
+# latitude and longitude)
+def establishment_keys(inspections):
+    keys = pd.DataFrame({"inspection_id": inspections["inspection_id"].values})
+    keys["license_key"] = _map_distinct(license_key, inspections["license_number"])
+    keys["name_key"] = _map_distinct(name_key, inspections["establishment_name"])
+    keys["address_key"] = _map_distinct(address_key, inspections["address"]) if "address" in inspections else None
+    if "latitude" in inspections:
+        keys["geocode_key"] = geocode_keys(inspections["latitude"], inspections["longitude"]).values
+    else:
+        keys["geocode_key"] = None
+    return keys
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            self.parent[max(x, y)] = min(x, y)
+
+
+class EstablishmentIndex:
+    def __init__(self, records=None):
+        self.records = records if records is not None else pd.DataFrame(columns=INDEX_COLUMNS)
+        self._by_inspection = None
+        self._by_establishment = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def _build_lookups(self):
+        if self._by_inspection is None:
+            self._by_inspection = pd.Series(self.records["establishment_id"].values,
+                                            index=self.records["inspection_id"].values)
+            self._by_establishment = self.records.groupby("establishment_id")["inspection_id"].apply(np.sort)
+
+    def establishment_ids(self, inspection_ids):
+        self._build_lookups()
+        return self._by_inspection.reindex(inspection_ids).values
+
+    # Ids of all inspections of the given establishment, in id order
+    def inspections_of(self, establishment_id):
+        self._build_lookups()
+        return self._by_establishment.get(establishment_id, np.zeros(0, dtype=np.int64))
+
+    # Adds the inspections (a table of keys, see establishment_keys) that are not in the index yet, linking them to
+    # existing establishments or new ones
+    def update(self, keys):
+        keys = keys.loc[~keys["inspection_id"].isin(self.records["inspection_id"])]
+        keys = keys.drop_duplicates("inspection_id", keep="last").reset_index(drop=True)
+        if len(keys) == 0:
+            return 0
+        key_columns = ["license_key", "name_key", "address_key", "geocode_key"]
+
+        # Only the existing establishments that share a key with one of the new inspections can be affected
+        shares_key = np.zeros(len(self.records), dtype=bool)
+        for key_column in ["license_key", "address_key", "geocode_key"]:
+            shares_key |= self.records[key_column].isin(keys[key_column].dropna()).to_numpy()
+        affected_records = self.records.loc[
+            self.records["establishment_id"].isin(self.records.loc[shares_key, "establishment_id"])]
+
+        # Nodes are the affected establishments followed by each distinct combination of keys among the new inspections
+        establishment_ids = list(affected_records["establishment_id"].drop_duplicates().sort_values())
+        number_of_existing = len(establishment_ids)
+        node_of_establishment = {x: i for i, x in enumerate(establishment_ids)}
+
+        def existing_key_sets(key_column):
+            key_sets = [set() for _ in establishment_ids]
+            existing_keys = affected_records[["establishment_id", key_column]].dropna().drop_duplicates()
+            for establishment_id, key in zip(existing_keys["establishment_id"], existing_keys[key_column]):
+                key_sets[node_of_establishment[establishment_id]].add(key)
+            return key_sets
+
+        signature_numbers = {}
+        signature_ids = [signature_numbers.setdefault(tuple(x if isinstance(x, str) else None for x in signature),
+                                                      len(signature_numbers))
+                         for signature in zip(*[keys[x] for x in key_columns])]
+        distinct_signatures = list(signature_numbers)
+        node_licenses = existing_key_sets("license_key") + \
+            [{x[0]} if x[0] is not None else set() for x in distinct_signatures]
+        node_names = existing_key_sets("name_key") + \
+            [{x[1]} if x[1] is not None else set() for x in distinct_signatures]
+        node_name_words = [set(" ".join(x).split()) for x in node_names]
+        union_find = _UnionFind(len(node_names))
+
+        # Block members: key -> nodes, the existing establishments first and then the new signatures
+        def block_members(key_column, position):
+            members = {}
+            existing_keys = affected_records[["establishment_id", key_column]].dropna().drop_duplicates()
+            for establishment_id, key in zip(existing_keys["establishment_id"], existing_keys[key_column]):
+                members.setdefault(key, []).append(node_of_establishment[establishment_id])
+            for i, signature in enumerate(distinct_signatures):
+                if signature[position] is not None:
+                    members.setdefault(signature[position], []).append(number_of_existing + i)
+            return members
+
+        for block in block_members("license_key", 0).values():
+            for node in block[1:]:
+                union_find.union(block[0], node)
+
+        for key_column, position in [("address_key", 2), ("geocode_key", 3)]:
+            # Each new signature is compared with the members of its block before it (existing establishments are not
+            # compared with each other again)
+            for block in block_members(key_column, position).values():
+                for j, node in enumerate(block):
+                    if node < number_of_existing:
+                        continue
+                    for other in block[:j]:
+                        if len(node_licenses[node]) > 0 and len(node_licenses[other]) > 0 and \
+                                node_licenses[node].isdisjoint(node_licenses[other]):
+                            continue
+                        if not node_names[node].isdisjoint(node_names[other]) or \
+                                name_similarity(node_name_words[node], node_name_words[other]) >= \
+                                NAME_SIMILARITY_THRESHOLD:
+                            union_find.union(node, other)
+
+        # Each group of nodes takes the lowest existing establishment id in it, or a new id
+        roots = np.array([union_find.find(x) for x in range(len(node_names))])
+        next_id = int(self.records["establishment_id"].max()) + 1 if len(self.records) > 0 else 1
+        root_ids = {}
+        for node, root in enumerate(roots):
+            if root not in root_ids:
+                if root < number_of_existing:
+                    root_ids[root] = establishment_ids[root]
+                else:
+                    root_ids[root] = next_id
+                    next_id += 1
+        existing_ids = {establishment_ids[x]: root_ids[roots[x]] for x in range(number_of_existing)}
+        new_records = keys[["inspection_id"] + key_columns].copy()
+        new_records.insert(1, "establishment_id",
+                           [root_ids[roots[number_of_existing + x]] for x in signature_ids])
+        records = self.records.copy()
+        records["establishment_id"] = records["establishment_id"].map(existing_ids).fillna(records["establishment_id"])
+        self.records = pd.concat([records, new_records], ignore_index=True)[INDEX_COLUMNS]
+        self.records["establishment_id"] = self.records["establishment_id"].astype(np.int64)
+        self._by_inspection = None
+        self._by_establishment = None
+        return len(new_records)
+
+    def save(self, filename=ESTABLISHMENT_INDEX_FILENAME):
+        replace_csv(self.records, filename)
+
+
+def load_establishment_index(filename=ESTABLISHMENT_INDEX_FILENAME):
+    if not Path(filename).exists() or os.path.getsize(filename) == 0:
+        return EstablishmentIndex()
+    return EstablishmentIndex(pd.read_csv(filename, dtype={"license_key": object, "name_key": object,
+                                                           "address_key": object, "geocode_key": object}))
+
+
+# The extracted inspections (from both summary tables) with their geocodes
+def load_inspections_to_resolve(output_format):
+    tables = []
+    if table_exists("potential_inspection_summary_data", output_format):
+        tables.append(load_table("potential_inspection_summary_data",
+                                 ["inspection_id", "establishment_name", "license_number", "address"],
+                                 output_format=output_format))
+    if table_exists("inspection_summary_data", output_format):
+        tables.append(load_table("inspection_summary_data", ["inspection_id", "establishment_name", "license_number"],
+                                 output_format=output_format))
+    inspections = pd.concat(tables, ignore_index=True).drop_duplicates("inspection_id", keep="first")
+    return load_geocodes().attach(inspections)
+
+
+# Assigns an establishment id to every extracted inspection that does not have one yet
+# Run with --rebuild to resolve all inspections from scratch
+if __name__ == "__main__":
+    output_format = get_output_format(sys.argv[1:])
+    index = EstablishmentIndex() if "--rebuild" in sys.argv[1:] else load_establishment_index()
+    all_inspections = load_inspections_to_resolve(output_format)
+    new_inspections = all_inspections.loc[~all_inspections["inspection_id"].isin(index.records["inspection_id"])]
+    print("Resolving", len(new_inspections), "new inspections against", index.records["establishment_id"].nunique(),
+          "known establishments.")
+    index.update(establishment_keys(new_inspections))
+    index.save()
+    print(len(index), "inspections of", index.records["establishment_id"].nunique(), "establishments in the index.")
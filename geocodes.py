@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+import sys
+import numpy as np
+import pandas as pd
+
+
+# Spatial index over output/inspection_geocodes.csv (inspection_id, latitude, longitude)
+# The coordinates are kept as float32 arrays (a float32 latitude is good to well under a metre), with each distinct
+# location stored once (most establishments are inspected many times), and the locations are bucketed into a grid of
+# GRID_CELL_METERS square cells, so that a query only measures the distance to the locations in the cells it overlaps
+
+GEOCODES_FILENAME = "output/inspection_geocodes.csv"
+
+GRID_CELL_METERS = 200
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = np.pi * EARTH_RADIUS_METERS / 180
+
+
+# Concatenation of the ranges [start, end) as one array
+def _ranges(starts, ends):
+    counts = ends - starts
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+def distance_meters(latitude_a, longitude_a, latitude_b, longitude_b):
+    latitude_a, longitude_a, latitude_b, longitude_b = [np.radians(np.asarray(x, dtype=np.float64)) for x in
+                                                        [latitude_a, longitude_a, latitude_b, longitude_b]]
+    a = np.sin((latitude_b - latitude_a) / 2) ** 2 + \
+        np.cos(latitude_a) * np.cos(latitude_b) * np.sin((longitude_b - longitude_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+
+class GeocodeIndex:
+    def __init__(self, inspection_ids, latitudes, longitudes):
+        inspection_ids = np.asarray(inspection_ids, dtype=np.int64)
+        latitudes = np.asarray(latitudes, dtype=np.float32)
+        longitudes = np.asarray(longitudes, dtype=np.float32)
+        # The last geocode of an inspection is kept, and inspections without one are dropped
+        located = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        inspection_ids, latitudes, longitudes = inspection_ids[located], latitudes[located], longitudes[located]
+        last = len(inspection_ids) - 1 - np.unique(inspection_ids[::-1], return_index=True)[1]
+        self.inspection_ids = inspection_ids[last]
+
+        # Distinct locations, and the location of each inspection (in inspection id order)
+        coordinates = np.column_stack([latitudes[last], longitudes[last]])
+        locations, self.location_of_inspection = np.unique(coordinates, axis=0, return_inverse=True)
+        self.location_of_inspection = self.location_of_inspection.reshape(-1).astype(np.int32)
+        self.latitudes = np.ascontiguousarray(locations[:, 0])
+        self.longitudes = np.ascontiguousarray(locations[:, 1])
+
+        # Inspections at each location: inspection ids grouped by location
+        self._inspection_order = np.argsort(self.location_of_inspection, kind="stable")
+        self._location_starts = np.searchsorted(self.location_of_inspection[self._inspection_order],
+                                                np.arange(len(locations) + 1))
+
+        # Grid cells (x, y) of a local flat projection around the middle of the locations, packed into one integer,
+        # with the locations sorted by cell
+        self._reference_latitude = float(np.median(self.latitudes)) if len(locations) > 0 else 0.0
+        cells = self._cells(self.latitudes, self.longitudes)
+        self._location_order = np.argsort(cells, kind="stable")
+        self._cells_sorted = cells[self._location_order]
+
+    def __len__(self):
+        return len(self.inspection_ids)
+
+    def _cell_xy(self, latitudes, longitudes):
+        x = np.floor(np.asarray(longitudes, dtype=np.float64) * METERS_PER_DEGREE *
+                     np.cos(np.radians(self._reference_latitude)) / GRID_CELL_METERS).astype(np.int64)
+        y = np.floor(np.asarray(latitudes, dtype=np.float64) * METERS_PER_DEGREE / GRID_CELL_METERS).astype(np.int64)
+        return x, y
+
+    def _cells(self, latitudes, longitudes):
+        x, y = self._cell_xy(latitudes, longitudes)
+        return (x << 32) + y
+
+    # Locations in the square of cells within rings cells of the one the point is in
+    def _candidate_locations(self, latitude, longitude, rings):
+        x, y = self._cell_xy(latitude, longitude)
+        columns = (np.arange(x - rings, x + rings + 1) << 32)
+        cells = (columns[:, None] + np.arange(y - rings, y + rings + 1)[None, :]).ravel()
+        starts = np.searchsorted(self._cells_sorted, cells, side="left")
+        ends = np.searchsorted(self._cells_sorted, cells, side="right")
+        return self._location_order[_ranges(starts, ends)]
+
+    # Indices of the locations within meters of the point, and their distances, nearest first
+    def locations_within(self, latitude, longitude, meters):
+        # The cell width is measured at the reference latitude, which is close enough within one city; one extra ring
+        # covers the difference
+        candidates = self._candidate_locations(latitude, longitude, int(np.ceil(meters / GRID_CELL_METERS)) + 1)
+        distances = distance_meters(latitude, longitude, self.latitudes[candidates], self.longitudes[candidates])
+        within = distances <= meters
+        order = np.argsort(distances[within], kind="stable")
+        return candidates[within][order], distances[within][order]
+
+    # Ids of the inspections at the given locations, with the location of each
+    def inspections_at(self, locations):
+        locations = np.asarray(locations, dtype=np.int64)
+        starts, ends = self._location_starts[locations], self._location_starts[locations + 1]
+        positions = _ranges(starts, ends)
+        return self.inspection_ids[self._inspection_order[positions]], np.repeat(locations, ends - starts)
+
+    # Inspections (inspection_id, latitude, longitude, distance_meters) within meters of the point, nearest first
+    def inspections_within(self, latitude, longitude, meters):
+        locations, distances = self.locations_within(latitude, longitude, meters)
+        inspection_ids, inspection_locations = self.inspections_at(locations)
+        return pd.DataFrame({"inspection_id": inspection_ids,
+                             "latitude": self.latitudes[inspection_locations],
+                             "longitude": self.longitudes[inspection_locations],
+                             "distance_meters": np.repeat(distances, np.diff(self._location_starts)[locations])})
+
+    # The count nearest locations to the point (searching out to max_meters at most), nearest first
+    def nearest_locations(self, latitude, longitude, count=1, max_meters=50000):
+        meters = GRID_CELL_METERS
+        while True:
+            locations, distances = self.locations_within(latitude, longitude, meters)
+            if len(locations) >= count or meters >= max_meters:
+                return locations[:count], distances[:count]
+            meters *= 2
+
+    # Latitude and longitude (float32, NaN if not geocoded) of each of the given inspections, found by binary search
+    # in the sorted inspection ids rather than by merging tables
+    def geocode(self, inspection_ids):
+        inspection_ids = np.asarray(inspection_ids, dtype=np.int64)
+        positions = np.searchsorted(self.inspection_ids, inspection_ids).clip(max=max(len(self.inspection_ids) - 1, 0))
+        found = (self.inspection_ids[positions] == inspection_ids) if len(self.inspection_ids) > 0 else \
+            np.zeros(len(inspection_ids), dtype=bool)
+        latitudes = np.full(len(inspection_ids), np.nan, dtype=np.float32)
+        longitudes = np.full(len(inspection_ids), np.nan, dtype=np.float32)
+        locations = self.location_of_inspection[positions[found]]
+        latitudes[found] = self.latitudes[locations]
+        longitudes[found] = self.longitudes[locations]
+        return latitudes, longitudes
+
+    # Adds (or replaces) latitude and longitude columns in a table with an inspection_id column
+    def attach(self, inspections):
+        latitudes, longitudes = self.geocode(inspections["inspection_id"].to_numpy())
+        return inspections.assign(latitude=latitudes, longitude=longitudes)
+
+
+def load_geocodes(geocodes_filename=GEOCODES_FILENAME):
+    try:
+        geocodes = pd.read_csv(geocodes_filename, dtype={"inspection_id": np.int64, "latitude": np.float32,
+                                                         "longitude": np.float32})
+    except FileNotFoundError:
+        geocodes = pd.DataFrame({"inspection_id": [], "latitude": [], "longitude": []})
+    return GeocodeIndex(geocodes["inspection_id"], geocodes["latitude"], geocodes["longitude"])
+
+
+# The count establishments (see establishments.py) nearest to the point, with the distance to the nearest of their
+# geocoded inspections, nearest first
+def nearest_establishments(geocode_index, establishment_index, latitude, longitude, count=5, max_meters=50000):
+    meters = GRID_CELL_METERS
+    while True:
+        nearby = geocode_index.inspections_within(latitude, longitude, meters)
+        nearby["establishment_id"] = establishment_index.establishment_ids(nearby["inspection_id"].to_numpy())
+        nearby = nearby.dropna(subset="establishment_id").drop_duplicates("establishment_id")
+        if len(nearby) >= count or meters >= max_meters:
+            nearby["establishment_id"] = nearby["establishment_id"].astype(np.int64)
+            return nearby.head(count).reset_index(drop=True)
+        meters *= 2
+
+
+# python geocodes.py <inspection_id> [meters]  - lists the inspections within meters (default 100) of the given
+# inspection, and the establishments nearest to it
+if __name__ == "__main__":
+    from establishments import load_establishment_index
+    index = load_geocodes()
+    inspection_id = int(sys.argv[1])
+    search_meters = float(sys.argv[2]) if len(sys.argv) > 2 else 100
+    (inspection_latitude,), (inspection_longitude,) = index.geocode([inspection_id])
+    if np.isnan(inspection_latitude):
+        sys.exit("Inspection " + str(inspection_id) + " has no geocode")
+    print(len(index), "geocoded inspections at", len(index.latitudes), "distinct locations.")
+    print("Inspections within", search_meters, "meters:")
+    print(index.inspections_within(inspection_latitude, inspection_longitude, search_meters).to_string(index=False))
+    print("Nearest establishments:")
+    print(nearest_establishments(index, load_establishment_index(), inspection_latitude, inspection_longitude)
+          .to_string(index=False))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from page_triage import UNTRIAGED
+
+
+ID_INDEX_FILENAME = "output/potential_inspection_id_index.npy"
+POTENTIAL_INSPECTION_IDS_FILENAME = "output/potential_inspection_ids.csv"
+SCRAPED_INSPECTION_LINKS_FILENAME = "output/scraped_inspection_links.csv"
+
+# What is known about each inspection id
+UNFETCHED = 0  # never requested from the server
+DEAD = 1  # requested, but the server returned an empty page
+LIVE = 2  # the server returned a page (or the id has been linked to by the site)
+
+
+# Coverage of the inspection id space, stored as one state byte per id (so ~1MB per million ids), with a second byte
+# per id for the class of its cached page (see page_triage.py)
+# Lookups and updates are vectorized, e.g. all unfetched ids up to the highest known id are found in milliseconds
+class InspectionIdIndex:
+    def __init__(self, states=None, page_classes=None):
+        self.states = states if states is not None else np.zeros(0, dtype=np.uint8)
+        self.page_classes = page_classes if page_classes is not None else np.zeros(len(self.states), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.states)
+
+    def _grow(self, max_id):
+        if max_id >= len(self.states):
+            size = max(max_id + 1, 2 * len(self.states))
+            states = np.zeros(size, dtype=np.uint8)
+            states[:len(self.states)] = self.states
+            page_classes = np.zeros(size, dtype=np.uint8)
+            page_classes[:len(self.page_classes)] = self.page_classes
+            self.states, self.page_classes = states, page_classes
+
+    def update(self, inspection_ids, state):
+        inspection_ids = np.asarray(inspection_ids, dtype=np.int64)
+        if len(inspection_ids) == 0:
+            return
+        self._grow(int(inspection_ids.max()))
+        self.states[inspection_ids] = state
+
+    def state(self, inspection_ids):
+        inspection_ids = np.asarray(inspection_ids, dtype=np.int64)
+        states = np.full(len(inspection_ids), UNFETCHED, dtype=np.uint8)
+        in_range = inspection_ids < len(self.states)
+        states[in_range] = self.states[inspection_ids[in_range]]
+        return states
+
+    # Records the page classes of the given ids (untriaged classes are ignored, so they never overwrite a known one)
+    def update_page_classes(self, inspection_ids, page_classes):
+        inspection_ids = np.asarray(inspection_ids, dtype=np.int64)
+        page_classes = np.asarray(page_classes, dtype=np.uint8)
+        triaged = page_classes != UNTRIAGED
+        if not triaged.any():
+            return
+        self._grow(int(inspection_ids[triaged].max()))
+        self.page_classes[inspection_ids[triaged]] = page_classes[triaged]
+
+    def page_class(self, inspection_ids):
+        inspection_ids = np.asarray(inspection_ids, dtype=np.int64)
+        page_classes = np.full(len(inspection_ids), UNTRIAGED, dtype=np.uint8)
+        in_range = inspection_ids < len(self.page_classes)
+        page_classes[in_range] = self.page_classes[inspection_ids[in_range]]
+        return page_classes
+
+    # Ids between 1 and max_id (default: the highest id in the index) with the given state
+    def ids_with_state(self, state, max_id=None):
+        max_id = len(self.states) - 1 if max_id is None else max_id
+        states = self.states[:max_id + 1]
+        inspection_ids = np.flatnonzero(states == state)
+        if state == UNFETCHED and max_id >= len(self.states):
+            inspection_ids = np.concatenate([inspection_ids, np.arange(len(self.states), max_id + 1)])
+        return inspection_ids[inspection_ids >= 1]
+
+    def unfetched_ids(self, max_id):
+        return self.ids_with_state(UNFETCHED, max_id)
+
+    # Runs of consecutive ids with the given state, as an array of inclusive (start, end) rows
+    def ranges(self, state, max_id=None):
+        inspection_ids = self.ids_with_state(state, max_id)
+        if len(inspection_ids) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        breaks = np.flatnonzero(np.diff(inspection_ids) != 1)
+        starts = np.concatenate([[inspection_ids[0]], inspection_ids[breaks + 1]])
+        ends = np.concatenate([inspection_ids[breaks], [inspection_ids[-1]]])
+        return np.column_stack([starts, ends])
+
+    def counts(self):
+        return {"unfetched": int(np.sum(self.states[1:] == UNFETCHED)),
+                "dead": int(np.sum(self.states == DEAD)),
+                "live": int(np.sum(self.states == LIVE))}
+
+    def save(self, filename=ID_INDEX_FILENAME):
+        with open(filename + ".tmp", "wb") as index_file:
+            np.save(index_file, np.stack([self.states, self.page_classes]))
+        os.replace(filename + ".tmp", filename)
+
+
+# Builds the index from potential_inspection_ids.csv and scraped_inspection_links.csv
+def build_id_index(potential_inspection_ids_filename=POTENTIAL_INSPECTION_IDS_FILENAME,
+                   scraped_inspection_links_filename=SCRAPED_INSPECTION_LINKS_FILENAME):
+    id_index = InspectionIdIndex()
+    if Path(potential_inspection_ids_filename).exists():
+        potential_inspection_ids_dataframe = pd.read_csv(potential_inspection_ids_filename,
+                                                         usecols=["inspection_id", "was_live"])
+        was_live = potential_inspection_ids_dataframe["was_live"].astype(bool)
+        id_index.update(potential_inspection_ids_dataframe.loc[~was_live, "inspection_id"], DEAD)
+        id_index.update(potential_inspection_ids_dataframe.loc[was_live, "inspection_id"], LIVE)
+    if Path(scraped_inspection_links_filename).exists():
+        id_index.update(pd.read_csv(scraped_inspection_links_filename, usecols=["inspection_id"])["inspection_id"],
+                        LIVE)
+    return id_index
+
+
+def _load_saved_id_index(filename):
+    saved = np.load(filename)
+    # Indexes saved before pages were triaged only have the states
+    if saved.ndim == 1:
+        return InspectionIdIndex(saved)
+    return InspectionIdIndex(np.ascontiguousarray(saved[0]), np.ascontiguousarray(saved[1]))
+
+
+# Loads the saved index, rebuilding it from the csv files if either of them has been modified since it was saved
+# The page classes are not in the csv files, so a rebuilt index keeps those of the saved one
+def load_id_index(filename=ID_INDEX_FILENAME,
+                  potential_inspection_ids_filename=POTENTIAL_INSPECTION_IDS_FILENAME,
+                  scraped_inspection_links_filename=SCRAPED_INSPECTION_LINKS_FILENAME):
+    saved_index = None
+    if Path(filename).exists():
+        saved_index = _load_saved_id_index(filename)
+        index_mtime = os.path.getmtime(filename)
+        if all(not Path(x).exists() or os.path.getmtime(x) <= index_mtime
+               for x in [potential_inspection_ids_filename, scraped_inspection_links_filename]):
+            return saved_index
+    id_index = build_id_index(potential_inspection_ids_filename, scraped_inspection_links_filename)
+    if saved_index is not None:
+        triaged_ids = np.flatnonzero(saved_index.page_classes != UNTRIAGED)
+        id_index.update_page_classes(triaged_ids, saved_index.page_classes[triaged_ids])
+    id_index.save(filename)
+    return id_index
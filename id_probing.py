@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+import numpy as np
+from id_index import UNFETCHED, LIVE
+
+
+# Ids are grouped into blocks of this size to estimate how densely populated each part of the id space is
+BLOCK_SIZE = 1000
+
+# Blocks where at least this fraction of the fetched ids were live are fetched exhaustively
+DENSE_THRESHOLD = 0.05
+
+# In sparse (or not yet explored) blocks only every SAMPLE_STRIDE-th id is fetched at first
+# Around every live id that turns up, the ids within SAMPLE_STRIDE on either side are then fetched as well, so the
+# run of live ids containing a hit is filled in and any further hits it uncovers are followed up in the next round
+SAMPLE_STRIDE = 50
+
+
+# Decides which ids to request next when sweeping the inspection id space
+# Each call to next_ids returns the ids for one round, based on what has been learned so far (the live and dead ids
+# in the id index and the historical known valid ids); the sweep is complete when it returns nothing
+class ProbingScheduler:
+    def __init__(self, id_index, max_id, known_valid_ids=(), block_size=BLOCK_SIZE,
+                 dense_threshold=DENSE_THRESHOLD, sample_stride=SAMPLE_STRIDE):
+        self.id_index = id_index
+        self.max_id = max_id
+        self.block_size = block_size
+        self.dense_threshold = dense_threshold
+        self.sample_stride = sample_stride
+        self.ids = np.arange(max_id + 1)
+        self.blocks = self.ids // block_size
+        self.number_of_blocks = int(self.blocks[-1]) + 1
+        known_valid_ids = np.asarray(known_valid_ids, dtype=np.int64)
+        known_valid_ids = known_valid_ids[(known_valid_ids >= 1) & (known_valid_ids <= max_id)]
+        self.known_valid_ids = known_valid_ids
+        self.known_valid_counts = np.bincount(known_valid_ids // block_size, minlength=self.number_of_blocks)
+        # Ids handed out by this scheduler, so that ids whose download failed are not requested over and over
+        self.scheduled = np.zeros(max_id + 1, dtype=bool)
+
+    def _block_counts(self, states):
+        # Id 0 is not a real inspection id
+        valid = self.ids >= 1
+        fetched = np.bincount(self.blocks, weights=valid & (states != UNFETCHED), minlength=self.number_of_blocks)
+        live = np.bincount(self.blocks, weights=valid & (states == LIVE), minlength=self.number_of_blocks)
+        unfetched = np.bincount(self.blocks, weights=valid & (states == UNFETCHED), minlength=self.number_of_blocks)
+        return fetched, live, unfetched
+
+    def dense_blocks(self, states):
+        fetched, live, _ = self._block_counts(states)
+        density = np.divide(live, fetched, out=np.zeros_like(live), where=fetched > 0)
+        return (density >= self.dense_threshold) | (self.known_valid_counts > 0)
+
+    # Whether each id is within sample_stride of an id in mask
+    def _near(self, mask):
+        before = np.concatenate([[0], np.cumsum(mask)])
+        upper = np.minimum(self.ids + self.sample_stride + 1, self.max_id + 1)
+        lower = np.maximum(self.ids - self.sample_stride, 0)
+        return before[upper] - before[lower] > 0
+
+    def next_ids(self):
+        states = self.id_index.state(self.ids)
+        near_live = self._near(states == LIVE)
+        candidates = (states == UNFETCHED) & ~self.scheduled & \
+            (self.dense_blocks(states)[self.blocks] | (self.ids % self.sample_stride == 0) | near_live)
+        candidates[0] = False
+        self.scheduled |= candidates
+        return np.flatnonzero(candidates)
+
+    # Summary of the sweep so far, including an estimate of how many live ids were skipped
+    # The estimate covers the area that was sampled: the blocks that have been explored and hold no known valid ids
+    # (those are fetched in full from the start), leaving out the ids near failed downloads. In that area every
+    # sample id was fetched whatever happened around it, and a run of L < sample_stride consecutive live ids contains
+    # a sample id with probability L / sample_stride, so each run that contains one stands for sample_stride live ids
+    # (runs of sample_stride or more always contain one, and stand for themselves). The live ids missed are this
+    # estimate of all the live ids in the area less the ones found there (by any means); it is zero where the area has
+    # been fetched in full
+    def recall_report(self):
+        states = self.id_index.state(self.ids)
+        fetched, _, _ = self._block_counts(states)
+        valid = self.ids >= 1
+        live_ids = np.flatnonzero((states == LIVE) & valid)
+        estimated_missed = 0.0
+        if len(live_ids) > 0:
+            breaks = np.flatnonzero(np.diff(live_ids) != 1)
+            run_starts = np.concatenate([[live_ids[0]], live_ids[breaks + 1]])
+            run_ends = np.concatenate([live_ids[breaks], [live_ids[-1]]])
+            run_lengths = run_ends - run_starts + 1
+
+            sample_id = self.ids % self.sample_stride == 0
+            failed = valid & (states == UNFETCHED) & (sample_id | self._near(states == LIVE))
+            area = ((fetched > 0) & (self.known_valid_counts == 0))[self.blocks] & valid & ~self._near(failed)
+            outside_before = np.concatenate([[0], np.cumsum(~area)])
+            in_area = outside_before[run_ends + 1] - outside_before[run_starts] == 0
+            sampled = run_ends // self.sample_stride * self.sample_stride >= run_starts
+            short = run_lengths < self.sample_stride
+            estimated_live = self.sample_stride * np.sum(in_area & short & sampled) + \
+                np.sum(run_lengths[in_area & ~short])
+            unfetched_in_area = int(np.sum(area & (states == UNFETCHED)))
+            estimated_missed = float(min(max(estimated_live - np.sum(run_lengths[in_area]), 0), unfetched_in_area))
+        found = len(live_ids)
+        known_valid_found = int(np.sum(states[self.known_valid_ids] == LIVE))
+        return {"ids_in_range": self.max_id,
+                "ids_fetched": int(np.sum(fetched)),
+                "ids_requested_this_run": int(np.sum(self.scheduled)),
+                "fraction_of_full_sweep": float(np.sum(fetched)) / self.max_id,
+                "live_ids_found": found,
+                "estimated_live_ids_missed": estimated_missed,
+                "estimated_recall": found / (found + estimated_missed) if found + estimated_missed > 0 else 1.0,
+                "known_valid_ids": len(self.known_valid_ids),
+                "known_valid_recall": known_valid_found / len(self.known_valid_ids)
+                if len(self.known_valid_ids) > 0 else 1.0}
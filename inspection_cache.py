@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+import fcntl
+import gzip
+import hashlib
+import mmap
+import os
+import sys
+import time
+from pipeline_metrics import METRICS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_CACHE_DIR = "inspection_html_cache"
+
+# Segment files are rolled over once they reach this size
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+def _compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return gzip.compress(data, mtime=0)
+
+
+# Fails up front if pages compressed with the given codec could not be read (rather than on the first get)
+def _check_codec(codec, cache_dir):
+    if codec not in ["gzip", "zstd"]:
+        raise ValueError("Unknown compression codec " + repr(codec) + " in the inspection cache in " + cache_dir)
+    if codec == "zstd" and zstandard is None:
+        raise ImportError("The inspection cache in " + cache_dir + " has zstd compressed pages, which need the "
+                          "zstandard package (pip install zstandard)")
+
+
+def _decompress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+# Content-addressed store for downloaded inspection report pages
+# Pages are compressed and appended to a small number of segment files, and an append-only index file maps each
+# inspection id to the sha256 of its page and the location of the compressed page in a segment
+# Identical pages are only stored once, and re-storing an id simply appends a new index line (the last line wins)
+# Appends are serialized with a lock on the index file so that several processes can share the same cache
+#
+# index.csv columns: inspection_id, sha256, segment, offset, length, codec, stored_time (the unix time the line was
+# written, missing from lines written before it was recorded)
+class InspectionCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, codec=None, segment_size=DEFAULT_SEGMENT_SIZE, use_mmap=False):
+        self.cache_dir = cache_dir
+        self.codec = codec or ("zstd" if zstandard is not None else "gzip")
+        _check_codec(self.codec, cache_dir)
+        self.segment_size = segment_size
+        self.use_mmap = use_mmap
+        self.index_filename = cache_dir + "/index.csv"
+        self.entries = {}  # inspection_id -> (sha256, segment, offset, length, codec)
+        self.locations = {}  # sha256 -> (segment, offset, length, codec)
+        self.stored_times = {}  # inspection_id -> stored_time
+        self.codecs = set()
+        self.index_offset = 0
+        self.segment_files = {}
+        self.segment_maps = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        open(self.index_filename, "a").close()
+        self.refresh()
+
+    # Read any index lines appended (possibly by other processes) since the index was last read
+    def refresh(self):
+        with open(self.index_filename, "rb") as index_file:
+            index_file.seek(self.index_offset)
+            for line in index_file:
+                if not line.endswith(b"\n"):
+                    # Partially written line, pick it up next time
+                    break
+                self.index_offset += len(line)
+                fields = line.decode().rstrip("\n").split(",")
+                inspection_id, sha256, segment, offset, length, codec = fields[:6]
+                if codec not in self.codecs:
+                    _check_codec(codec, self.cache_dir)
+                    self.codecs.add(codec)
+                location = (int(segment), int(offset), int(length), codec)
+                self.entries[int(inspection_id)] = (sha256,) + location
+                self.locations[sha256] = location
+                if len(fields) > 6:
+                    self.stored_times[int(inspection_id)] = int(fields[6])
+                else:
+                    self.stored_times.pop(int(inspection_id), None)
+
+    def __contains__(self, inspection_id):
+        return int(inspection_id) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ids(self):
+        return list(self.entries.keys())
+
+    # sha256 of the raw page stored for the given id (or None if it is not cached)
+    def content_hash(self, inspection_id):
+        entry = self.entries.get(int(inspection_id))
+        return entry[0] if entry is not None else None
+
+    # Unix time at which the page for the given id was stored (or None if it is not cached)
+    # Pages stored before this was recorded get the time their segment file was last written, which is no earlier
+    def stored_time(self, inspection_id):
+        inspection_id = int(inspection_id)
+        if inspection_id not in self.entries:
+            return None
+        if inspection_id not in self.stored_times:
+            segment = self.entries[inspection_id][1]
+            self.stored_times[inspection_id] = int(os.path.getmtime(self.segment_filename(segment)))
+        return self.stored_times[inspection_id]
+
+    def segment_filename(self, segment):
+        return self.cache_dir + "/segment-" + str(segment).zfill(5) + ".dat"
+
+    def _read_segment(self, segment, offset, length):
+        if self.use_mmap:
+            if segment not in self.segment_maps or len(self.segment_maps[segment]) < offset + length:
+                # The segment has grown since it was mapped (slices of a map are copies, so it can be closed)
+                if segment in self.segment_maps:
+                    self.segment_maps.pop(segment).close()
+                with open(self.segment_filename(segment), "rb") as segment_file:
+                    self.segment_maps[segment] = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.segment_maps[segment][offset:offset + length]
+        if segment not in self.segment_files:
+            self.segment_files[segment] = os.open(self.segment_filename(segment), os.O_RDONLY)
+        # pread does not move a shared file offset, so forked worker processes can all read through the same handle
+        return os.pread(self.segment_files[segment], length, offset)
+
+    # Returns the raw page stored for the given id, or None if it is not cached
+    def get(self, inspection_id):
+        inspection_id = int(inspection_id)
+        if inspection_id not in self.entries:
+            self.refresh()
+            if inspection_id not in self.entries:
+                METRICS.increment("cache_requests", result="miss")
+                return None
+        METRICS.increment("cache_requests", result="hit")
+        sha256, segment, offset, length, codec = self.entries[inspection_id]
+        return _decompress(self._read_segment(segment, offset, length), codec)
+
+    def put(self, inspection_id, data):
+        inspection_id = int(inspection_id)
+        sha256 = hashlib.sha256(data).hexdigest()
+        with open(self.index_filename, "ab") as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                if self.content_hash(inspection_id) == sha256:
+                    METRICS.increment("cache_writes", result="unchanged")
+                    return sha256
+                if sha256 not in self.locations:
+                    self.locations[sha256] = self._append_record(_compress(data, self.codec))
+                    METRICS.increment("cache_writes", result="new_content")
+                else:
+                    METRICS.increment("cache_writes", result="duplicate_content")
+                segment, offset, length, codec = self.locations[sha256]
+                stored_time = int(time.time())
+                line = ",".join(str(x) for x in [inspection_id, sha256, segment, offset, length, codec,
+                                                  stored_time]) + "\n"
+                index_file.write(line.encode())
+                index_file.flush()
+                self.index_offset += len(line)
+                self.entries[inspection_id] = (sha256, segment, offset, length, codec)
+                self.stored_times[inspection_id] = stored_time
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+        return sha256
+
+    # Must be called with the index lock held
+    def _append_record(self, compressed_data):
+        segment = max([x[0] for x in self.locations.values()] or [1])
+        segment_filename = self.segment_filename(segment)
+        if os.path.exists(segment_filename) and os.path.getsize(segment_filename) >= self.segment_size:
+            segment += 1
+            segment_filename = self.segment_filename(segment)
+        with open(segment_filename, "ab") as segment_file:
+            offset = segment_file.tell()
+            segment_file.write(compressed_data)
+        return segment, offset, len(compressed_data), self.codec
+
+    def close(self):
+        for segment_file in self.segment_files.values():
+            os.close(segment_file)
+        for segment_map in self.segment_maps.values():
+            segment_map.close()
+        self.segment_files = {}
+        self.segment_maps = {}
+
+
+_open_caches = {}
+
+
+# Shared cache instance for the given directory (one per process)
+def get_inspection_cache(cache_dir=DEFAULT_CACHE_DIR):
+    if cache_dir not in _open_caches:
+        _open_caches[cache_dir] = InspectionCache(cache_dir)
+    return _open_caches[cache_dir]
+
+
+# Copies pages from the old one-directory-per-inspection layout (<dir>/<id>/inspection.html) into the cache
+# Directories are migrated in the given order and ids that are already in the cache are skipped
+def migrate_html_directories(html_dirs, cache_dir=DEFAULT_CACHE_DIR, verbose=False):
+    cache = get_inspection_cache(cache_dir)
+    migrated = 0
+    for html_dir in html_dirs:
+        if not os.path.isdir(html_dir):
+            continue
+        for inspection_id in os.listdir(html_dir):
+            html_filename = html_dir + "/" + inspection_id + "/inspection.html"
+            if not inspection_id.isdigit() or inspection_id in cache or not os.path.exists(html_filename):
+                continue
+            with open(html_filename, "rb") as html_file:
+                cache.put(inspection_id, html_file.read())
+            migrated += 1
+            if verbose and migrated % 10000 == 0:
+                print("Migrated", migrated, "pages.")
+    return migrated
+
+
+# Usage: python inspection_cache.py migrate [html_dir ...]
+# With no directories given, migrates scraped_inspections_html and then potential_inspections_html
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python inspection_cache.py migrate [html_dir ...]")
+        sys.exit(1)
+    source_dirs = sys.argv[2:] or ["scraped_inspections_html", "potential_inspections_html"]
+    print("Migrated", migrate_html_directories(source_dirs, verbose=True), "pages into", DEFAULT_CACHE_DIR)
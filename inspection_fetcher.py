@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import asyncio
+import time
+from urllib.parse import urlsplit
+import aiohttp
+from pipeline_metrics import METRICS
+
+
+# URL of the printable report for a given inspection id on dc.healthinspections.us
+# Passing a different base_url (e.g. a local stub server) to inspection_report_url allows testing the fetcher offline
+BASE_URL = "https://dc.healthinspections.us"
+
+
+def inspection_report_url(inspection_id, base_url=BASE_URL):
+    return base_url + "/webadmin/dhd_431/lib/mod/inspection/paper/" \
+                      "_paper_food_inspection_report.cfm?inspectionID=" + str(inspection_id) + \
+                      "&wguid=1367&wgunm=sysact&wgdmn=431"
+
+
+# Spaces out request start times per host so that we never exceed requests_per_second against a single server
+class HostRateLimiter:
+    def __init__(self, requests_per_second=None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.next_slot = {}
+        self.locks = {}
+
+    async def wait(self, url):
+        if self.interval == 0.0:
+            return
+        host = urlsplit(url).netloc
+        lock = self.locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def _fetch_url(session, url, semaphore, rate_limiter, retries, backoff):
+    async with semaphore:
+        for attempt in range(retries + 1):
+            await rate_limiter.wait(url)
+            if attempt > 0:
+                METRICS.increment("fetch_retries")
+            start = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    data = await response.read()
+                    METRICS.observe("fetch_seconds", time.perf_counter() - start)
+                    METRICS.increment("fetch_responses", status=response.status)
+                    METRICS.increment("fetch_bytes", len(data))
+                    # Retry on server side errors and throttling, anything else is a final answer
+                    if (response.status < 500 and response.status != 429) or attempt == retries:
+                        return {"url": url, "status": response.status, "data": data}
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                METRICS.increment("fetch_errors", error=type(error).__name__)
+                if attempt == retries:
+                    return {"url": url, "status": None, "data": None}
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+
+async def _fetch_urls(urls, handle_response, concurrency, requests_per_second, retries, backoff, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = HostRateLimiter(requests_per_second)
+    # One connector for the whole run so that connections (and TLS sessions) are kept alive and reused
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False)  # We don't need to worry about https here
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+
+        async def fetch_and_handle(url):
+            response = await _fetch_url(session, url, semaphore, rate_limiter, retries, backoff)
+            if handle_response is not None:
+                return handle_response(response)
+            return response
+
+        return await asyncio.gather(*[fetch_and_handle(url) for url in urls])
+
+
+# Downloads all of the given urls from a single process, with at most `concurrency` requests in flight
+# Each response is passed as {"url", "status", "data"} to handle_response (if given) as soon as it arrives, and the
+# list of handler results (or responses) is returned in the same order as urls
+# Failed requests are retried with exponential backoff; after the final attempt status and data are None
+def fetch_urls(urls, handle_response=None, concurrency=40, requests_per_second=None, retries=3, backoff=0.5,
+               timeout=60):
+    return asyncio.run(_fetch_urls(list(urls), handle_response, concurrency, requests_per_second, retries, backoff,
+                                   timeout))
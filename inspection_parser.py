@@ -0,0 +1,595 @@
+#!/usr/bin/env python
+from bs4 import BeautifulSoup
+from lxml import etree
+from collections import namedtuple
+import datetime
+from page_triage import triage_page, might_be_report
+
+
+# Cached pages are stored as the raw bytes from the server, the reports themselves are utf-8
+def decode_report(data):
+    return data.decode('utf-8', errors='replace')
+
+
+# Reference implementation of the report parser using BeautifulSoup
+# Kept so that parse_inspection_report can be checked against it (see check_parser_parity.py)
+# Returns None if the page does not look like an inspection report
+def parse_inspection_report_bs4(inspection_id, data):
+    soup = BeautifulSoup(decode_report(data), 'lxml')
+
+    if not soup.find('span', string='Food Establishment Inspection Report'):
+        return None
+
+    def get_datetime_from_mdy_soup_array(mdy_soup_array):
+        # First clean spaces
+        cleaned_mdy_string_array = [x.text.split() for x in mdy_soup_array]
+        if len(cleaned_mdy_string_array[0]) > 0:
+            mdy_array = [int(x[0]) for x in cleaned_mdy_string_array]
+            return datetime.date(month=mdy_array[0], day=mdy_array[1], year=mdy_array[2])
+        else:
+            return None
+
+    def get_time_from_hm_soup_array(hm_soup_array):
+        # First clean spaces
+        clean_hm_string_array = [x.text.replace(u'\xa0', '') for x in hm_soup_array]
+        if clean_hm_string_array[0] == '':
+            return None
+        else:
+            return clean_hm_string_array[0] + ':' + clean_hm_string_array[1] + ' ' + clean_hm_string_array[2]
+
+    # Establishment Name
+    establishment_name_block = soup.find('span', string='Establishment Name').find_parent()
+    establishment_name = ' '.join(establishment_name_block.contents[2].split())
+
+    # Address
+    address_block = soup.find('span', string='Address').find_parent()
+    address = ' '.join(address_block.contents[2].split())
+    city_state_zip_block = soup.find('span', string='City/State/Zip Code').find_parent()
+    address = address + ' ' + ' '.join(city_state_zip_block.contents[2].split())
+
+    # Telephone and E-mail
+    telephone_email_block = soup.find('span', string='Telephone').find_parent()
+    telephone = telephone_email_block.contents[3].text.replace(u'\xa0', '')
+    email = next(iter(telephone_email_block.contents[6].split() or []), None)
+
+    # Inspection Date and Time
+    inspection_date_time_block = soup.find('span', string='Date of Inspection').find_parent()
+    inspection_date = get_datetime_from_mdy_soup_array(inspection_date_time_block.contents[3:12:4])
+    inspection_time_in = get_time_from_hm_soup_array(inspection_date_time_block.contents[x] for x in [15, 19, 21])
+    inspection_time_out = get_time_from_hm_soup_array(inspection_date_time_block.contents[x] for x in [25, 29, 31])
+
+    # License Holder
+    license_holder_block = soup.find('span', string='License Holder').find_parent()
+    license_holder = ' '.join(license_holder_block.contents[2].split())
+
+    # License/Customer Number
+    license_number_block = soup.find('span', string='License/Customer No.').find_parent()
+    license_number = next(iter(license_number_block.contents[2].split() or []), None)
+
+    # License Period
+    license_period_block = soup.find('span', string='License Period').find_parent()
+    license_period_start = get_datetime_from_mdy_soup_array(license_period_block.contents[3:12:4])
+    license_period_end = get_datetime_from_mdy_soup_array(license_period_block.contents[15:24:4])
+
+    # Inspection Type
+    inspection_type = soup.find('span', string='\xa0Type of Inspection').find_next_sibling().get_text(strip=True)
+
+    # Establishment Type
+    establishment_type_block = soup.find('span', string='Establishment Type:').find_parent()
+    establishment_type = ' '.join(establishment_type_block.contents[2].split())
+
+    # Risk Category
+    risk_category_red_square = soup.find('div', class_='checkboxRedN',
+                                         attrs={'style': 'height:5px;width:5px;background-color:#FF0000;'})
+    if risk_category_red_square is not None:
+        risk_category = int(risk_category_red_square.find_previous_sibling().text[-1:])
+    else:
+        risk_category = None
+
+    # Violation Counts
+    def extract_violation_counts(text_block):
+        if text_block is not None:
+            violations_block = text_block.find_parent().find_parent()
+            violations_row_elements = violations_block.contents[3:14:4]
+
+            def get_parsed_contents(x):
+                split_contents = x.contents[0].split()
+                if len(split_contents) > 0:
+                    return int(split_contents[0])
+                else:
+                    return 0
+
+            violations_row_elements_parsed = [get_parsed_contents(x) for x in violations_row_elements]
+            return {'count': violations_row_elements_parsed[0],
+                    'corrected_on_site': violations_row_elements_parsed[1],
+                    'repeated': violations_row_elements_parsed[2]}
+        else:
+            return {'count': None,
+                    'corrected_on_site': None,
+                    'repeated': None}
+
+    # Older inspection reports have 'Critical' and 'Noncritical' violations
+    critical_violations_counts = extract_violation_counts(soup.find('b', string='Critical Violations'))
+    noncritical_violations_counts = extract_violation_counts(soup.find('b', string='Noncritical Violations'))
+
+    # Newer reports have 'Priority', 'Priority Foundation' and 'Core' violations
+    priority_violations_counts = extract_violation_counts(soup.find('b', string='Priority'))
+    priority_foundation_violations_counts = extract_violation_counts(soup.find('b', string='Priority Foundation'))
+    core_violations_counts = extract_violation_counts(soup.find('b', string='Core'))
+
+    # Violation Details
+    violation_details_rows = list(soup.find('td', string='OBSERVATIONS').find_parent().next_siblings)[1:-2:2]
+
+    def get_violation_description(violation_number):
+        violation_number_td = soup.find('td', string = str(violation_number) + ".")
+        if violation_number_td is not None:
+            return violation_number_td.next_sibling.next_sibling.text
+        else:
+            return None
+
+    def parse_violation_details_row(row):
+        observation_tokens = row.td.contents[0].split()
+        if len(observation_tokens) > 0:
+            dcmr_25_code_block = row.td.find_next_sibling()
+            if dcmr_25_code_block is not None:
+                dcmr_25_code = dcmr_25_code_block.get_text(strip=True)
+            else:
+                dcmr_25_code = None
+            try:
+                int(observation_tokens[0][:-1])
+                return {'inspection_id': inspection_id,
+                        'violation_number': observation_tokens[0][:-1],
+                        'violation_description': get_violation_description(observation_tokens[0][:-1]),
+                        'violation_text': ' '.join(observation_tokens[2:]),
+                        'dcmr_25_code': dcmr_25_code}
+            except ValueError:
+                return None
+        else:
+            return None
+
+    violation_details = [x for x in
+                         [parse_violation_details_row(row) for row in violation_details_rows] if x is not None]
+
+    # Inspector Comments
+    inspector_comments_block = soup.find('b', string='Inspector Comments:')
+    inspector_comments = inspector_comments_block.find_parent().get_text(' ', strip=True)[20:]
+
+    # Inspector Data (Name and Badge)
+    inspector_data_block = soup.find('td', string='\xa0\xa0Inspector (Signature)').find_parent().find_previous_sibling()
+    inspector_name = inspector_data_block.contents[3].text.replace(u'\xa0', '')
+    inspector_badge_number = inspector_data_block.contents[5].text.replace(u'\xa0', '')
+
+    return ({'inspection_summary':
+             {'inspection_id': inspection_id,
+              'establishment_name': establishment_name,
+              'address': address,
+              'telephone': telephone,
+              'email': email,
+              'inspection_date': inspection_date,
+              'inspection_time_in': inspection_time_in,
+              'inspection_time_out': inspection_time_out,
+              'license_holder': license_holder,
+              'license_number': license_number,
+              'license_period_start': license_period_start,
+              'license_period_end': license_period_end,
+              'establishment_type': establishment_type,
+              'risk_category': risk_category,
+              'inspection_type': inspection_type,
+              'total_violations': len(violation_details),
+              'priority_violations': priority_violations_counts['count'],
+              'priority_violations_corrected_on_site': priority_violations_counts['corrected_on_site'],
+              'priority_violations_repeated': priority_violations_counts['repeated'],
+              'priority_foundation_violations': priority_foundation_violations_counts['count'],
+              'priority_foundation_violations_corrected_on_site':
+                  priority_foundation_violations_counts['corrected_on_site'],
+              'priority_foundation_violations_repeated': priority_foundation_violations_counts['repeated'],
+              'core_violations': core_violations_counts['count'],
+              'core_violations_corrected_on_site': core_violations_counts['corrected_on_site'],
+              'core_violations_repeated': core_violations_counts['repeated'],
+              'critical_violations': critical_violations_counts['count'],
+              'critical_violations_corrected_on_site': critical_violations_counts['corrected_on_site'],
+              'critical_violations_repeated': critical_violations_counts['repeated'],
+              'noncritical_violations': noncritical_violations_counts['count'],
+              'noncritical_violations_corrected_on_site': noncritical_violations_counts['corrected_on_site'],
+              'noncritical_violations_repeated': noncritical_violations_counts['repeated'],
+              'inspector_comments': inspector_comments,
+              'inspector_name': inspector_name,
+              'inspector_badge_number': inspector_badge_number},
+             'violation_details': violation_details})
+
+
+
+# Fast path parser using lxml directly
+#
+# The page is parsed once and the labels that the bs4 implementation looks up with soup.find(..., string=...) are all
+# collected in a single walk over the tree. The navigation that follows (parents, contents, siblings) is then done
+# with helpers that reproduce BeautifulSoup's view of the tree, so that the output is identical field-for-field
+
+# Labels looked up by the parser, by tag name
+LABELS = {'span': {'Food Establishment Inspection Report', 'Establishment Name', 'Address', 'City/State/Zip Code',
+                   'Telephone', 'Date of Inspection', 'License Holder', 'License/Customer No.', 'License Period',
+                   '\xa0Type of Inspection', 'Establishment Type:'},
+          'b': {'Critical Violations', 'Noncritical Violations', 'Priority', 'Priority Foundation', 'Core',
+                'Inspector Comments:'},
+          'td': {'OBSERVATIONS', '\xa0\xa0Inspector (Signature)'}}
+
+RISK_CATEGORY_STYLE = 'height:5px;width:5px;background-color:#FF0000;'
+
+# Strings inside these elements are not part of BeautifulSoup's get_text() of an enclosing element
+NON_TEXT_TAGS = {'script', 'style', 'template'}
+# BeautifulSoup replaces every string made only of these characters by a single newline (if it has one) or space,
+# except inside these elements
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+
+HTML_PARSER = etree.HTMLParser(recover=True, encoding='utf-8')
+
+
+# The text or tail of an element as bs4 has it (parent is the element the string is in)
+def _bs4_string(string, parent):
+    if not string or string.strip(ASCII_SPACES):
+        return string
+    if parent is not None and (parent.tag in PRESERVE_WHITESPACE_TAGS or
+                               any(x.tag in PRESERVE_WHITESPACE_TAGS for x in parent.iterancestors())):
+        return string
+    return '\n' if '\n' in string else ' '
+
+
+def _element_text(element):
+    return _bs4_string(element.text, element if isinstance(element.tag, str) else element.getparent())
+
+
+def _tail(element):
+    return _bs4_string(element.tail, element.getparent())
+
+
+# Equivalent of bs4's Tag.string: the only string in the element, following single children down the tree
+def _string(element):
+    while True:
+        if len(element) == 0:
+            return _element_text(element) or None
+        if len(element) > 1 or element.text or element[0].tail:
+            return None
+        element = element[0]
+        if not isinstance(element.tag, str):
+            # A lone comment
+            return _element_text(element)
+
+
+# Equivalent of bs4's Tag.contents: child elements interleaved with the text between them
+def _contents(element):
+    contents = [_element_text(element)] if element.text else []
+    for child in element:
+        contents.append(child)
+        if child.tail:
+            contents.append(_tail(child))
+    return contents
+
+
+# Equivalent of bs4's next_siblings: the text after the element, then each following sibling and its text
+def _next_siblings(element):
+    siblings = [_tail(element)] if element.tail else []
+    for sibling in element.itersiblings():
+        siblings.append(sibling)
+        if sibling.tail:
+            siblings.append(_tail(sibling))
+    return siblings
+
+
+def _next_element_sibling(element):
+    return next((x for x in element.itersiblings() if isinstance(x.tag, str)), None)
+
+
+def _previous_element_sibling(element):
+    return next((x for x in element.itersiblings(preceding=True) if isinstance(x.tag, str)), None)
+
+
+def _strings(node):
+    if isinstance(node, str):
+        yield node
+        return
+    if node.text and isinstance(node.tag, str):
+        yield _element_text(node)
+    for child in node:
+        if isinstance(child.tag, str) and child.tag not in NON_TEXT_TAGS:
+            yield from _strings(child)
+        if child.tail:
+            yield _tail(child)
+
+
+# Equivalent of bs4's get_text()/text
+def _text(node, separator='', strip=False):
+    strings = _strings(node)
+    if strip:
+        strings = [x for x in (y.strip() for y in strings) if len(x) > 0]
+    return separator.join(strings)
+
+
+# Collects the first element for every label in LABELS, the first td for each violation number ('1.', '2.', ...)
+# and the risk category marker, in one pass over the tree
+def _find_labels(root):
+    found = {}
+    violation_number_tds = {}
+    risk_category_red_square = None
+    for element in root.iter('span', 'b', 'td', 'div'):
+        tag = element.tag
+        if tag == 'div':
+            if risk_category_red_square is None and element.get('style') == RISK_CATEGORY_STYLE and \
+                    'checkboxRedN' in element.get('class', '').split():
+                risk_category_red_square = element
+            continue
+        string = _string(element)
+        if string is None:
+            continue
+        if string in LABELS[tag]:
+            found.setdefault((tag, string), element)
+        elif tag == 'td' and string.endswith('.'):
+            violation_number_tds.setdefault(string, element)
+    return found, violation_number_tds, risk_category_red_square
+
+
+def _get_date_from_mdy_nodes(mdy_nodes):
+    # First clean spaces
+    cleaned_mdy_string_array = [_text(x).split() for x in mdy_nodes]
+    if len(cleaned_mdy_string_array[0]) > 0:
+        mdy_array = [int(x[0]) for x in cleaned_mdy_string_array]
+        return datetime.date(month=mdy_array[0], day=mdy_array[1], year=mdy_array[2])
+    else:
+        return None
+
+
+def _get_time_from_hm_nodes(hm_nodes):
+    # First clean spaces
+    clean_hm_string_array = [_text(x).replace(u'\xa0', '') for x in hm_nodes]
+    if clean_hm_string_array[0] == '':
+        return None
+    else:
+        return clean_hm_string_array[0] + ':' + clean_hm_string_array[1] + ' ' + clean_hm_string_array[2]
+
+
+def _extract_violation_counts(text_block):
+    if text_block is not None:
+        violations_block = text_block.getparent().getparent()
+        violations_row_elements = _contents(violations_block)[3:14:4]
+
+        def get_parsed_contents(x):
+            split_contents = _contents(x)[0].split()
+            if len(split_contents) > 0:
+                return int(split_contents[0])
+            else:
+                return 0
+
+        violations_row_elements_parsed = [get_parsed_contents(x) for x in violations_row_elements]
+        return {'count': violations_row_elements_parsed[0],
+                'corrected_on_site': violations_row_elements_parsed[1],
+                'repeated': violations_row_elements_parsed[2]}
+    else:
+        return {'count': None,
+                'corrected_on_site': None,
+                'repeated': None}
+
+
+# A numbered row of the observations table: its first cell, the violation number and the words of the observation
+ViolationRow = namedtuple('ViolationRow', ['td', 'violation_number', 'observation_tokens'])
+
+
+# A parsed report; fields are only computed when they are asked for (see SUMMARY_FIELDS)
+# With numbered_violations_only=False every non-empty row of the observations table is a violation, as 02 has always
+# counted them, rather than only the rows that start with a violation number (as 03alt does)
+class InspectionReport:
+    def __init__(self, inspection_id, data, numbered_violations_only=True):
+        self.inspection_id = inspection_id
+        self.numbered_violations_only = numbered_violations_only
+        # Round trip through decode_report so that undecodable bytes are replaced exactly as in the bs4 implementation
+        root = etree.fromstring(decode_report(data).encode('utf-8'), HTML_PARSER) if data else None
+        if root is not None:
+            self.found, self.violation_number_tds, self.risk_category_red_square = _find_labels(root)
+        else:
+            self.found, self.violation_number_tds, self.risk_category_red_square = {}, {}, None
+        self.computed = {}
+
+    def is_valid(self):
+        return ('span', 'Food Establishment Inspection Report') in self.found
+
+    def label(self, tag, label):
+        return self.found.get((tag, label))
+
+    def block(self, tag, label):
+        return self.found[(tag, label)].getparent()
+
+    # Computes (once) and returns a value shared by several fields
+    def memoized(self, key, compute):
+        if key not in self.computed:
+            self.computed[key] = compute()
+        return self.computed[key]
+
+    def block_contents(self, tag, label):
+        return self.memoized(('contents', tag, label), lambda: _contents(self.block(tag, label)))
+
+    def violation_counts(self, label):
+        return self.memoized(('violation_counts', label),
+                             lambda: _extract_violation_counts(self.label('b', label)))
+
+    def get(self, field):
+        return self.memoized(field, lambda: SUMMARY_FIELDS[field](self))
+
+    # The numbered rows of the observations table
+    def violation_rows(self):
+        return self.memoized('violation_rows', self._parse_violation_rows)
+
+    def _parse_violation_rows(self):
+        violation_rows = []
+        for row in _next_siblings(self.block('td', 'OBSERVATIONS'))[1:-2:2]:
+            row_td = row.find('.//td')
+            observation_tokens = _contents(row_td)[0].split()
+            if len(observation_tokens) > 0:
+                try:
+                    if self.numbered_violations_only:
+                        int(observation_tokens[0][:-1])
+                    violation_rows.append(ViolationRow(row_td, observation_tokens[0][:-1], observation_tokens))
+                except ValueError:
+                    pass
+        return violation_rows
+
+    def violation_description(self, violation_number):
+        violation_number_td = self.violation_number_tds.get(str(violation_number) + '.')
+        if violation_number_td is not None:
+            return _text(_next_siblings(violation_number_td)[1])
+        else:
+            return None
+
+
+def _label_text(tag, label):
+    return lambda report: ' '.join(report.block_contents(tag, label)[2].split())
+
+
+def _first_word(tag, label):
+    return lambda report: next(iter(report.block_contents(tag, label)[2].split() or []), None)
+
+
+def _address(report):
+    return _label_text('span', 'Address')(report) + ' ' + _label_text('span', 'City/State/Zip Code')(report)
+
+
+def _telephone(report):
+    return _text(report.block_contents('span', 'Telephone')[3]).replace(u'\xa0', '')
+
+
+def _email(report):
+    return next(iter(report.block_contents('span', 'Telephone')[6].split() or []), None)
+
+
+def _date(label, first, last):
+    return lambda report: _get_date_from_mdy_nodes(report.block_contents('span', label)[first:last:4])
+
+
+def _time(label, positions):
+    return lambda report: _get_time_from_hm_nodes(report.block_contents('span', label)[x] for x in positions)
+
+
+def _inspection_type(report):
+    return _text(_next_element_sibling(report.label('span', '\xa0Type of Inspection')), strip=True)
+
+
+def _risk_category(report):
+    if report.risk_category_red_square is not None:
+        return int(_text(_previous_element_sibling(report.risk_category_red_square))[-1:])
+    else:
+        return None
+
+
+def _violation_count(label, key):
+    return lambda report: report.violation_counts(label)[key]
+
+
+def _inspector_comments(report):
+    return _text(report.block('b', 'Inspector Comments:'), ' ', strip=True)[20:]
+
+
+def _inspector_data(position):
+    def inspector_data(report):
+        inspector_data_contents = report.memoized(
+            'inspector_data', lambda: _contents(_previous_element_sibling(
+                report.block('td', '\xa0\xa0Inspector (Signature)'))))
+        return _text(inspector_data_contents[position]).replace(u'\xa0', '')
+    return inspector_data
+
+
+# Every summary field that can be extracted from a report, in output column order
+# Older inspection reports have 'Critical' and 'Noncritical' violations, newer reports have 'Priority',
+# 'Priority Foundation' and 'Core' violations (the counts for the other kind are None)
+SUMMARY_FIELDS = {
+    'inspection_id': lambda report: report.inspection_id,
+    'establishment_name': _label_text('span', 'Establishment Name'),
+    'address': _address,
+    'telephone': _telephone,
+    'email': _email,
+    'inspection_date': _date('Date of Inspection', 3, 12),
+    'inspection_time_in': _time('Date of Inspection', [15, 19, 21]),
+    'inspection_time_out': _time('Date of Inspection', [25, 29, 31]),
+    'license_holder': _label_text('span', 'License Holder'),
+    'license_number': _first_word('span', 'License/Customer No.'),
+    'license_period_start': _date('License Period', 3, 12),
+    'license_period_end': _date('License Period', 15, 24),
+    'establishment_type': _label_text('span', 'Establishment Type:'),
+    'risk_category': _risk_category,
+    'inspection_type': _inspection_type,
+    'total_violations': lambda report: len(report.violation_rows()),
+    'priority_violations': _violation_count('Priority', 'count'),
+    'priority_violations_corrected_on_site': _violation_count('Priority', 'corrected_on_site'),
+    'priority_violations_repeated': _violation_count('Priority', 'repeated'),
+    'priority_foundation_violations': _violation_count('Priority Foundation', 'count'),
+    'priority_foundation_violations_corrected_on_site': _violation_count('Priority Foundation', 'corrected_on_site'),
+    'priority_foundation_violations_repeated': _violation_count('Priority Foundation', 'repeated'),
+    'core_violations': _violation_count('Core', 'count'),
+    'core_violations_corrected_on_site': _violation_count('Core', 'corrected_on_site'),
+    'core_violations_repeated': _violation_count('Core', 'repeated'),
+    'critical_violations': _violation_count('Critical Violations', 'count'),
+    'critical_violations_corrected_on_site': _violation_count('Critical Violations', 'corrected_on_site'),
+    'critical_violations_repeated': _violation_count('Critical Violations', 'repeated'),
+    'noncritical_violations': _violation_count('Noncritical Violations', 'count'),
+    'noncritical_violations_corrected_on_site': _violation_count('Noncritical Violations', 'corrected_on_site'),
+    'noncritical_violations_repeated': _violation_count('Noncritical Violations', 'repeated'),
+    'inspector_comments': _inspector_comments,
+    'inspector_name': _inspector_data(3),
+    'inspector_badge_number': _inspector_data(5)}
+
+
+def _dcmr_25_code(report, row):
+    dcmr_25_code_block = _next_element_sibling(row.td)
+    if dcmr_25_code_block is not None:
+        return _text(dcmr_25_code_block, strip=True)
+    else:
+        return None
+
+
+# Every field of a violation details row, in output column order
+VIOLATION_DETAIL_FIELDS = {
+    'inspection_id': lambda report, row: report.inspection_id,
+    'violation_number': lambda report, row: row.violation_number,
+    'violation_description': lambda report, row: report.violation_description(row.violation_number),
+    'violation_text': lambda report, row: ' '.join(row.observation_tokens[2:]),
+    'dcmr_25_code': _dcmr_25_code}
+
+SUMMARY_COLUMNS = list(SUMMARY_FIELDS)
+VIOLATION_DETAIL_COLUMNS = list(VIOLATION_DETAIL_FIELDS)
+
+
+# Raised when a field cannot be extracted from a page that looked like an inspection report (e.g. a broken duplicate)
+class ReportParseError(Exception):
+    def __init__(self, inspection_id, field):
+        super().__init__('Failed to extract ' + field + ' from inspection ' + str(inspection_id))
+        self.inspection_id = inspection_id
+        self.field = field
+
+
+def _extract(inspection_id, field, compute):
+    try:
+        return compute()
+    except Exception as error:
+        raise ReportParseError(inspection_id, field) from error
+
+
+# Parses a cached inspection report page into {'inspection_summary': {...}, 'violation_details': [{...}, ...]}
+# Only the requested summary and violation detail fields are extracted (all of them by default), in which case the
+# result is identical to parse_inspection_report_bs4
+# Returns None if the page does not look like an inspection report, and raises ReportParseError (naming the field) if
+# it does but a field cannot be extracted
+# numbered_violations_only=False keeps 02's rule for violation rows (see InspectionReport)
+def parse_inspection_report(inspection_id, data, summary_fields=None, violation_detail_fields=None,
+                            numbered_violations_only=True):
+    # Pages that cannot be reports (see page_triage.py) are recognised from their bytes, without building the tree
+    if not might_be_report(triage_page(data)):
+        return None
+    report = InspectionReport(inspection_id, data, numbered_violations_only)
+    if not report.is_valid():
+        return None
+    summary_fields = SUMMARY_COLUMNS if summary_fields is None else summary_fields
+    violation_detail_fields = VIOLATION_DETAIL_COLUMNS if violation_detail_fields is None else violation_detail_fields
+    violation_details = []
+    if len(violation_detail_fields) > 0:
+        for row in _extract(inspection_id, 'violation_rows', report.violation_rows):
+            violation_details.append({x: _extract(inspection_id, x, lambda: VIOLATION_DETAIL_FIELDS[x](report, row))
+                                      for x in violation_detail_fields})
+    return {'inspection_summary': {x: _extract(inspection_id, x, lambda: report.get(x)) for x in summary_fields},
+            'violation_details': violation_details}
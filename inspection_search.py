@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+import asyncio
+import re
+from urllib.parse import urljoin
+import aiohttp
+from lxml import html
+from inspection_fetcher import BASE_URL
+
+
+SEARCH_PAGE_PATH = "/webadmin/dhd_431/web/?a=Inspections"
+
+LINK_XPATH = "//div[@id='divInspectionSearchResultsListing']/descendant::a/@href"
+NEXT_PAGE_XPATH = "//div[@id='divInspectionSearchResultsListing']/descendant::a" \
+                  "[translate(normalize-space(.), 'NEXT', 'next') = 'next' or " \
+                  "starts-with(translate(normalize-space(.), 'NEXT', 'next'), 'next ')]/@href"
+
+
+# Raised when the search page does not have the search form (e.g. an error page, or the site has changed)
+class SearchFormError(Exception):
+    def __init__(self, page_url, status):
+        super().__init__("No search form with a btnSearch button on " + page_url + " (HTTP status " + str(status) +
+                         ")")
+        self.page_url = page_url
+        self.status = status
+
+
+def get_inspection_id(link):
+    match = re.search("(?<=inspectionID=)([0-9]+)", link)
+    return int(match.group()) if match is not None else None
+
+
+# The fields a browser would submit for the given form when its submit_name button is clicked
+def get_form_fields(form, submit_name):
+    fields = []
+    for element in form.xpath(".//input | .//select | .//textarea"):
+        name = element.get("name")
+        if name is None or element.get("disabled") is not None:
+            continue
+        if element.tag == "select":
+            options = element.xpath(".//option[@selected]") or element.xpath(".//option")
+            if len(options) > 0:
+                fields.append((name, options[0].get("value", options[0].text_content())))
+        elif element.tag == "textarea":
+            fields.append((name, element.text_content()))
+        else:
+            input_type = element.get("type", "text").lower()
+            if input_type in ("submit", "button", "image", "reset", "file"):
+                if name == submit_name:
+                    fields.append((name, element.get("value", "")))
+            elif input_type in ("checkbox", "radio"):
+                if element.get("checked") is not None:
+                    fields.append((name, element.get("value", "on")))
+            else:
+                fields.append((name, element.get("value", "")))
+    return fields
+
+
+# Inspection report links on one page of search results (as absolute urls), and the url of the next page (if any)
+def parse_search_results(page, page_url):
+    document = html.fromstring(page)
+    links = [urljoin(page_url, x) for x in document.xpath(LINK_XPATH)]
+    links = [x for x in links if get_inspection_id(x) is not None]
+    next_page = next(iter(document.xpath(NEXT_PAGE_XPATH)), None)
+    return links, urljoin(page_url, next_page) if next_page is not None else None
+
+
+async def _scrape_inspection_links(handle_links, base_url, timeout):
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False),  # We don't need to worry about https
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        # Load the search form (this also sets any session cookies), then submit it as the search button would
+        search_page_url = base_url + SEARCH_PAGE_PATH
+        async with session.get(search_page_url) as response:
+            search_page = await response.read()
+            search_page_url = str(response.url)
+            search_page_status = response.status
+        forms = html.fromstring(search_page).xpath("//form[.//*[@name='btnSearch']]") if search_page.strip() else []
+        if len(forms) == 0:
+            raise SearchFormError(search_page_url, search_page_status)
+        form = forms[0]
+        form_url = urljoin(search_page_url, form.get("action") or search_page_url)
+        form_fields = get_form_fields(form, "btnSearch")
+        if form.get("method", "get").lower() == "post":
+            request = session.post(form_url, data=form_fields)
+        else:
+            request = session.get(form_url, params=form_fields)
+
+        visited_page_urls = set()
+        while request is not None:
+            async with request as response:
+                page = await response.read()
+                page_url = str(response.url)
+            visited_page_urls.add(page_url)
+            links, next_page_url = parse_search_results(page, page_url)
+            handle_links(links)
+            if next_page_url is not None and next_page_url not in visited_page_urls:
+                request = session.get(next_page_url)
+            else:
+                request = None
+        return len(visited_page_urls)
+
+
+# Runs the inspection search on dc.healthinspections.us and calls handle_links with the report links found on each
+# page of results as soon as that page has been downloaded
+# Returns the number of result pages
+def scrape_inspection_links(handle_links, base_url=BASE_URL, timeout=600):
+    return asyncio.run(_scrape_inspection_links(handle_links, base_url, timeout))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+
+# The inspection type on a report is free text typed in by the inspector (e.g. 'Routine', 'Routune', 'follow bup',
+# 'HACCP FOLLOW-UP ', 'Complaint (Follow-up)'), so it is mapped onto a canonical category by the first of these rules
+# that matches it
+# Follow-ups come first, so that e.g. 'Complaint / Follow-up' and 'ROUTINE FOR FOLLOW-UP' count as follow-ups (as in
+# Issue17_Shashank.R), then routine inspections, so that e.g. 'Routine / License Renewal' and 'Routine/HACCP' count as
+# routine
+INSPECTION_TYPE_RULES = [
+    ("follow_up", re.compile(r"\bfol+o?w?[\W_]*b?up|\bre-?inspect", re.IGNORECASE)),
+    ("routine", re.compile(r"\brout[iu]ne\b", re.IGNORECASE)),
+    ("complaint", re.compile(r"\bcomplain", re.IGNORECASE)),
+    ("preoperational", re.compile(r"\bpre[\W_]*op", re.IGNORECASE)),
+    ("license", re.compile(r"\blicen[sc]e|\brenewal|\btransfer", re.IGNORECASE)),
+    ("restoration", re.compile(r"\brestor", re.IGNORECASE)),
+    ("haccp", re.compile(r"\bhaccp", re.IGNORECASE))]
+OTHER_INSPECTION_TYPE = "other"
+INSPECTION_TYPE_CATEGORIES = [x for x, _ in INSPECTION_TYPE_RULES] + [OTHER_INSPECTION_TYPE]
+INSPECTION_TYPE_DTYPE = pd.CategoricalDtype(INSPECTION_TYPE_CATEGORIES)
+
+
+# Canonical category of a single inspection type (None if there is no inspection type)
+def classify_inspection_type(inspection_type):
+    if not isinstance(inspection_type, str) or inspection_type.strip() == "":
+        return None
+    for category, pattern in INSPECTION_TYPE_RULES:
+        if pattern.search(inspection_type):
+            return category
+    return OTHER_INSPECTION_TYPE
+
+
+# Canonical categories of a column of inspection types, as a categorical Series
+# Each distinct inspection type is only classified once, however many rows it appears in
+def normalize_inspection_types(inspection_types):
+    inspection_types = pd.Series(inspection_types)
+    codes, distinct_inspection_types = pd.factorize(inspection_types)
+    category = [classify_inspection_type(x) for x in distinct_inspection_types]
+    # The extra -1 at the end maps the -1 code of missing values to a missing category
+    category_codes = np.array([INSPECTION_TYPE_CATEGORIES.index(x) if x is not None else -1 for x in category] + [-1],
+                              dtype=np.int8)
+    return pd.Series(pd.Categorical.from_codes(category_codes[codes], dtype=INSPECTION_TYPE_DTYPE),
+                     index=inspection_types.index, name="inspection_type_category")
+
+
+# Number of rows of each distinct inspection type with its category, to check the rules against the data
+def inspection_type_table(inspection_types):
+    counts = pd.Series(inspection_types).value_counts()
+    return pd.DataFrame({"inspection_type": counts.index,
+                         "inspection_type_category": normalize_inspection_types(counts.index.to_series()).values,
+                         "rows": counts.values})
+
+
+# python inspection_types.py [--csv]  - lists the inspection types in the potential inspection summary table that no
+# rule matches, to spot new spellings that need a rule
+if __name__ == "__main__":
+    from output_store import get_output_format, load_table
+    summary = load_table("potential_inspection_summary_data", ["inspection_type"],
+                         output_format=get_output_format(sys.argv[1:]))
+    table = inspection_type_table(summary["inspection_type"])
+    print(table.groupby("inspection_type_category", observed=False)["rows"].sum())
+    print("Inspection types that are not matched by any rule:")
+    print(table.loc[table["inspection_type_category"] == OTHER_INSPECTION_TYPE].to_string(index=False))
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+import os
+import shutil
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from inspection_types import INSPECTION_TYPE_DTYPE
+
+
+OUTPUT_DIR = "output"
+
+# Tables are written as Parquet datasets (output/<name>/inspection_year=<year>/part-<batch>-0.parquet) by default
+# Passing output_format="csv" keeps the original single output/<name>.csv file instead
+DEFAULT_OUTPUT_FORMAT = "parquet"
+# Rows removed from a Parquet table are recorded as tombstones (inspection_id, _batch) in
+# output/<name>/_removed/removed-<batch>.parquet: every row saved for the inspection before that batch is gone
+# (pyarrow skips directories starting with _ when it reads the table)
+TOMBSTONES_DIR = "_removed"
+# Partition directory name of rows whose inspection_year is null
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Column types for the Parquet datasets, so that every batch has the same schema (anything not listed is a string)
+DATE_COLUMNS = ["inspection_date", "license_period_start", "license_period_end"]
+COUNT_COLUMNS = ["total_violations"] + \
+    [x + y for x in ["priority_violations", "priority_foundation_violations", "core_violations",
+                     "critical_violations", "noncritical_violations"]
+     for y in ["", "_corrected_on_site", "_repeated"]]
+COLUMN_TYPES = dict([("inspection_id", pa.int64()), ("risk_category", pa.int8()), ("known_valid", pa.bool_()),
+                     ("inspection_year", pa.int16()), ("_batch", pa.int64()), ("violation_code", pa.int32()),
+                     ("inspection_type_category", pa.dictionary(pa.int8(), pa.string()))] +
+                    [(x, pa.date32()) for x in DATE_COLUMNS] +
+                    [(x, pa.int32()) for x in COUNT_COLUMNS])
+
+# Columns that are loaded as pandas categoricals (with a fixed set of categories)
+CATEGORICAL_COLUMNS = {"inspection_type_category": INSPECTION_TYPE_DTYPE}
+
+
+def get_output_format(argv):
+    return "csv" if "--csv" in argv else DEFAULT_OUTPUT_FORMAT
+
+
+def table_path(name, output_format=DEFAULT_OUTPUT_FORMAT, output_dir=OUTPUT_DIR):
+    if output_format == "csv":
+        return output_dir + "/" + name + ".csv"
+    return output_dir + "/" + name
+
+
+def table_exists(name, output_format=DEFAULT_OUTPUT_FORMAT, output_dir=OUTPUT_DIR):
+    return Path(table_path(name, output_format, output_dir)).exists()
+
+
+# Appends rows to a CSV file in a single write, creating it (with a header) if it does not exist yet
+# Columns are put in the order of the existing header, so an interrupted run never leaves a misaligned file
+def append_csv(data, filename):
+    if Path(filename).exists() and os.path.getsize(filename) > 0:
+        data = data.reindex(columns=pd.read_csv(filename, nrows=0).columns)
+        text = data.to_csv(index=False, header=False)
+    else:
+        text = data.to_csv(index=False)
+    with open(filename, "a") as csv_file:
+        csv_file.write(text)
+        csv_file.flush()
+        os.fsync(csv_file.fileno())
+
+
+# Writes a whole CSV file by replacing it, so that readers never see a half written file
+def replace_csv(data, filename):
+    data.to_csv(filename + ".tmp", index=False)
+    os.replace(filename + ".tmp", filename)
+
+
+def drop_table(name, output_format=DEFAULT_OUTPUT_FORMAT, output_dir=OUTPUT_DIR):
+    path = table_path(name, output_format, output_dir)
+    if not Path(path).exists():
+        return
+    if output_format == "csv":
+        os.remove(path)
+    else:
+        shutil.rmtree(path)
+
+
+# Drops the rows for the given inspections from a table
+# Parquet tables are not rewritten: the removal is recorded as tombstones, which load_table applies
+def remove_rows(name, inspection_ids, output_format=DEFAULT_OUTPUT_FORMAT, output_dir=OUTPUT_DIR):
+    path = table_path(name, output_format, output_dir)
+    if not Path(path).exists() or len(inspection_ids) == 0:
+        return
+    if output_format != "csv":
+        _write_tombstones(path, inspection_ids, time.time_ns())
+        return
+    existing_dataframe = pd.read_csv(path)
+    replace_csv(existing_dataframe.loc[~existing_dataframe["inspection_id"].isin(inspection_ids)], path)
+
+
+def _write_tombstones(path, inspection_ids, batch):
+    Path(path, TOMBSTONES_DIR).mkdir(parents=True, exist_ok=True)
+    filename = str(Path(path, TOMBSTONES_DIR, "removed-" + str(batch) + ".parquet"))
+    inspection_ids = pa.array(np.unique(np.asarray(inspection_ids, dtype=np.int64)))
+    pq.write_table(pa.table({"inspection_id": inspection_ids,
+                             "_batch": pa.repeat(pa.scalar(batch, pa.int64()), len(inspection_ids))}),
+                   filename + ".tmp")
+    os.replace(filename + ".tmp", filename)
+
+
+# Tombstones of a Parquet table (inspection_id, _batch), optionally only those written after the given batch
+def load_tombstones(name, after_batch=None, output_dir=OUTPUT_DIR):
+    filenames = [x for x in Path(table_path(name, "parquet", output_dir), TOMBSTONES_DIR).glob("removed-*.parquet")
+                 if after_batch is None or int(x.stem.split("-")[1]) > after_batch]
+    if len(filenames) == 0:
+        return pd.DataFrame({"inspection_id": pd.Series(dtype="int64"), "_batch": pd.Series(dtype="int64")})
+    return pd.concat([pd.read_parquet(x) for x in filenames], ignore_index=True)
+
+
+def _to_arrow(data):
+    columns = []
+    for column in data.columns:
+        values = data[column].astype(object).where(data[column].notna(), None)
+        columns.append(pa.array(values.tolist(), type=COLUMN_TYPES.get(column, pa.string()), from_pandas=True))
+    return pa.Table.from_arrays(columns, names=list(data.columns))
+
+
+# Arrow table of the given columns from a list of row dicts (e.g. parsed reports), with the output column types
+# (types overrides them for some columns)
+def records_to_arrow(records, columns, types=None):
+    types = dict(COLUMN_TYPES, **(types or {}))
+    return pa.Table.from_arrays([pa.array([x[column] for x in records], type=types.get(column, pa.string()))
+                                 for column in columns], names=list(columns))
+
+
+# Saves a batch of newly extracted rows to the named output table
+# Rows for inspections in replaced_ids that were saved by earlier runs are removed (even if the batch has no rows for
+# them, e.g. a report that no longer has any violations)
+# years gives the inspection year of each row for tables without an inspection_date column (e.g. violation details)
+# data can also be an Arrow table with the output column types (see records_to_arrow), which may include the
+# inspection_year column itself
+# With overwrite=True any existing data in the table is discarded first
+def save_table(data, name, replaced_ids=(), years=None, overwrite=False, output_format=DEFAULT_OUTPUT_FORMAT,
+               output_dir=OUTPUT_DIR):
+    path = table_path(name, output_format, output_dir)
+    if overwrite:
+        drop_table(name, output_format, output_dir)
+
+    if len(data) == 0:
+        remove_rows(name, replaced_ids, output_format, output_dir)
+        return
+
+    if output_format == "csv":
+        if isinstance(data, pa.Table):
+            data = data.drop_columns([x for x in ["inspection_year"] if x in data.column_names]).to_pandas()
+        remove_rows(name, replaced_ids, output_format, output_dir)
+        print("Saving data." if not Path(path).exists() else "Adding data.")
+        append_csv(data, path)
+        return
+
+    # Each batch goes into new files, earlier batches are never rewritten
+    print("Adding data.")
+    batch = time.time_ns()
+    if isinstance(data, pa.Table):
+        table = data
+        if "inspection_year" not in table.column_names:
+            years = pc.year(table["inspection_date"]) if years is None else pa.array(years)
+            table = table.append_column("inspection_year", years.cast(pa.int16()))
+        table = table.append_column("_batch", pa.repeat(pa.scalar(batch, pa.int64()), len(table)))
+    else:
+        data = data.copy()
+        if years is None:
+            years = pd.to_datetime(data["inspection_date"]).dt.year
+        data["inspection_year"] = pd.Series(years, index=data.index).astype("Int16")
+        data["_batch"] = batch
+        table = _to_arrow(data)
+    ds.write_dataset(table, path, format="parquet",
+                     partitioning=ds.partitioning(pa.schema([("inspection_year", pa.int16())]), flavor="hive"),
+                     basename_template="part-" + str(batch) + "-{i}.parquet",
+                     existing_data_behavior="overwrite_or_ignore")
+    # The tombstones are of the same batch, so they only remove the rows saved before it
+    if len(replaced_ids) > 0:
+        _write_tombstones(path, replaced_ids, batch)
+
+
+# Batch numbers (save times) of the files of a Parquet table, from their names, without opening them
+def table_batches(name, output_dir=OUTPUT_DIR):
+    return sorted({int(x.name.split("-")[1]) for x in Path(table_path(name, "parquet", output_dir)).glob("*/part-*")})
+
+
+# Loads the named output table, optionally only some of its columns and inspection years (None in years stands for
+# the rows without an inspection date, which are saved in the inspection_year=__HIVE_DEFAULT_PARTITION__ partition)
+# For Parquet tables only the most recently saved batch of rows is kept for each inspection (over all years, so a
+# report whose date moved to another year is only returned once), rows removed by later tombstones are dropped, and
+# after_batch only reads the rows saved in later batches (include "_batch" in columns to get the batch of each row)
+def load_table(name, columns=None, years=None, output_format=DEFAULT_OUTPUT_FORMAT, output_dir=OUTPUT_DIR,
+               after_batch=None, current_batches=None):
+    path = table_path(name, output_format, output_dir)
+    if output_format == "csv":
+        # CSV tables can only be filtered by year if they have an inspection_date column
+        read_columns = columns
+        if columns is not None and years is not None:
+            read_columns = list(dict.fromkeys(list(columns) + ["inspection_date"]))
+        data = pd.read_csv(path, usecols=read_columns)
+        if years is not None:
+            inspection_years = pd.to_datetime(data["inspection_date"]).dt.year
+            data = data.loc[inspection_years.isin([x for x in years if x is not None]) |
+                            (inspection_years.isna() & (None in years))]
+        return _set_categories(data[columns if columns is not None else data.columns].reset_index(drop=True))
+
+    dataset = _open_dataset(path)
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(list(columns) + ["inspection_id", "_batch"]))
+    row_filter = None
+    if years is not None:
+        row_filter = ds.field("inspection_year").isin([x for x in years if x is not None])
+        if None in years:
+            row_filter = row_filter | ds.field("inspection_year").is_null()
+    if after_batch is not None:
+        batch_filter = ds.field("_batch") > after_batch
+        row_filter = batch_filter if row_filter is None else row_filter & batch_filter
+    data = dataset.to_table(columns=read_columns, filter=row_filter).to_pandas()
+
+    # The latest batch of each inspection can be found from the rows themselves, unless only some years were read
+    if current_batches is None:
+        current_batches = _current_batches(name, dataset if years is not None else data, output_dir)
+    data = data.loc[data["_batch"].to_numpy() == current_batches.reindex(data["inspection_id"]).to_numpy()]
+    data = data.sort_values(["_batch"], kind="stable")
+    if columns is None:
+        columns = [x for x in data.columns if x not in ["inspection_year", "_batch"]]
+    return _set_categories(data[columns].reset_index(drop=True))
+
+
+def _open_dataset(path):
+    # Columns added in later batches are only in some of the files, so the schema is taken from all of them
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    schema = pa.unify_schemas([dataset.schema] + [x.physical_schema for x in dataset.get_fragments()])
+    return ds.dataset(path, schema=schema, format="parquet", partitioning="hive")
+
+
+# Batch of the rows to keep for each inspection of a Parquet table (a dataset, or rows already read from it): the
+# latest one, unless a later tombstone removed the inspection's rows
+def _current_batches(name, rows, output_dir=OUTPUT_DIR):
+    if isinstance(rows, ds.Dataset):
+        rows = rows.to_table(columns=["inspection_id", "_batch"]).to_pandas()
+    latest = rows.groupby("inspection_id")["_batch"].max()
+    removed = load_tombstones(name, output_dir=output_dir).groupby("inspection_id")["_batch"].max()
+    return latest.loc[~(removed.reindex(latest.index) > latest).to_numpy()]
+
+
+# Loads the named output table a piece at a time: chunk_size rows at a time (CSV tables) or one inspection year at a
+# time (Parquet tables), so that the whole table never has to be in memory at once
+def iterate_table(name, columns=None, chunk_size=50000, output_format=DEFAULT_OUTPUT_FORMAT, output_dir=OUTPUT_DIR):
+    path = table_path(name, output_format, output_dir)
+    if output_format == "csv":
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_size):
+            yield _set_categories(chunk.reset_index(drop=True))
+        return
+    current_batches = _current_batches(name, _open_dataset(path), output_dir)
+    years = [x.name.split("=")[1] for x in Path(path).glob("inspection_year=*")]
+    years = sorted(int(x) for x in years if x != HIVE_NULL_PARTITION) + ([None] if HIVE_NULL_PARTITION in years else [])
+    for year in years:
+        yield load_table(name, columns, years=[year], output_format=output_format, output_dir=output_dir,
+                         current_batches=current_batches)
+
+
+def _set_categories(data):
+    for column, dtype in CATEGORICAL_COLUMNS.items():
+        if column in data.columns:
+            data[column] = data[column].astype(object).astype(dtype)
+    return data
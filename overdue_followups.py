@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import sys
+import time
+import pandas as pd
+from establishments import load_establishment_index
+from geocodes import load_geocodes
+from inspection_types import normalize_inspection_types
+from output_store import get_output_format, load_table, replace_csv
+from report_fingerprints import load_duplicate_ids
+
+
+# Issue 17: find inspections whose required follow-up inspection did not happen on time, and establishments that did
+# not get as many routine inspections in a year as their risk category requires
+
+OVERDUE_FOLLOWUPS_FILENAME = "output/overdue_followups.csv"
+ROUTINE_INSPECTION_DEFICIT_FILENAME = "output/routine_inspection_deficit.csv"
+
+# Violations left uncorrected at the end of an inspection require a follow-up inspection within this many days
+FOLLOW_UP_DAYS = {"priority": 3, "priority_foundation": 3, "core": 14}
+
+# Geocodes are rounded to this many decimal places (about a metre) when used to identify an establishment
+GEOCODE_DECIMALS = 5
+
+SUMMARY_COLUMNS = ["inspection_id", "establishment_name", "inspection_date", "license_number", "risk_category",
+                   "inspection_type", "known_valid"] + \
+    [x + y for x in FOLLOW_UP_DAYS for y in ["_violations", "_violations_corrected_on_site"]]
+
+
+# The valid inspections in the potential inspection summary data, with their geocodes and inspection type categories
+# Reports flagged as duplicates of other reports (see report_fingerprints.py) are left out
+def load_inspections(output_format):
+    inspections = load_table("potential_inspection_summary_data", SUMMARY_COLUMNS, output_format=output_format)
+    inspections = inspections.loc[inspections["known_valid"].astype(bool) &
+                                  ~inspections["inspection_id"].isin(load_duplicate_ids())]
+    inspections = inspections.drop_duplicates("inspection_id", keep="last")
+    inspections = load_geocodes().attach(inspections)
+    inspections["inspection_date"] = pd.to_datetime(inspections["inspection_date"])
+    inspections["inspection_type_category"] = normalize_inspection_types(inspections["inspection_type"])
+    inspections["establishment_key"] = establishment_keys(inspections)
+    return inspections.dropna(subset=["inspection_date", "establishment_key"]).reset_index(drop=True)
+
+
+# Key identifying the establishment an inspection was of: its id in the establishment index (see establishments.py),
+# or for inspections that are not in the index yet its license number, or where there is none its (rounded) geocode
+def establishment_keys(inspections):
+    establishment_ids = pd.Series(load_establishment_index().establishment_ids(inspections["inspection_id"]),
+                                  index=inspections.index)
+    license_numbers = inspections["license_number"].astype("string").str.strip().str.upper()
+    license_numbers = license_numbers.mask(license_numbers == "")
+    geocodes = "geo:" + inspections["latitude"].round(GEOCODE_DECIMALS).astype("string") + "," + \
+        inspections["longitude"].round(GEOCODE_DECIMALS).astype("string")
+    establishment_ids = "establishment:" + establishment_ids.astype("Int64").astype("string")
+    return establishment_ids.fillna("license:" + license_numbers).fillna(geocodes).astype(object) \
+        .where(lambda x: x.notna(), None)
+
+
+# One row per inspection and kind of violation that required a follow-up, with the date it was due by, the first
+# follow-up inspection of the same establishment after the inspection, and whether it came too late (or, if the
+# due date is after as_of, has not happened yet)
+def find_overdue_followups(inspections, as_of=None):
+    as_of = pd.Timestamp(as_of) if as_of is not None else inspections["inspection_date"].max()
+    required = []
+    for violation_kind, days in FOLLOW_UP_DAYS.items():
+        uncorrected = inspections[violation_kind + "_violations"].fillna(0) - \
+            inspections[violation_kind + "_violations_corrected_on_site"].fillna(0)
+        needs_follow_up = inspections.loc[uncorrected > 0, ["inspection_id", "establishment_key", "inspection_date"]]
+        required.append(needs_follow_up.assign(violation_kind=violation_kind,
+                                               uncorrected_violations=uncorrected[uncorrected > 0].astype(int),
+                                               due_date=needs_follow_up["inspection_date"] + pd.Timedelta(days=days)))
+    required = pd.concat(required, ignore_index=True)
+
+    # For each inspection the first follow-up strictly after its date is found with a single sorted as-of join
+    follow_ups = inspections.loc[inspections["inspection_type_category"] == "follow_up",
+                                 ["establishment_key", "inspection_date", "inspection_id"]]
+    follow_ups = follow_ups.rename(columns={"inspection_date": "follow_up_date",
+                                            "inspection_id": "follow_up_inspection_id"})
+    required["search_date"] = (required["inspection_date"] + pd.Timedelta(days=1)).astype(
+        follow_ups["follow_up_date"].dtype)
+    required = pd.merge_asof(required.sort_values("search_date"), follow_ups.sort_values("follow_up_date"),
+                             left_on="search_date", right_on="follow_up_date", by="establishment_key",
+                             direction="forward")
+    required = required.drop(columns="search_date")
+
+    required["days_late"] = (required["follow_up_date"].fillna(as_of) - required["due_date"]).dt.days.clip(lower=0)
+    required["pending"] = required["follow_up_date"].isna() & (required["due_date"] >= as_of)
+    required["overdue"] = ~required["pending"] & (required["days_late"] > 0)
+    return required.sort_values(["establishment_key", "inspection_date", "violation_kind"]).reset_index(drop=True)
+
+
+# Routine inspections of each establishment in each year it was inspected, compared to the number required by its
+# risk category (category N requires N routine inspections a year; the latest known category in the year is used)
+def find_routine_inspection_deficit(inspections):
+    inspections = inspections.sort_values("inspection_date", kind="stable")
+    inspections = inspections.assign(inspection_year=inspections["inspection_date"].dt.year,
+                                     routine=inspections["inspection_type_category"] == "routine")
+    grouped = inspections.groupby(["establishment_key", "inspection_year"])
+    deficit = pd.DataFrame({"risk_category": grouped["risk_category"].last(),
+                            "inspections": grouped.size(),
+                            "routine_inspections": grouped["routine"].sum()}).reset_index()
+    deficit["required_routine_inspections"] = deficit["risk_category"]
+    deficit["routine_inspection_deficit"] = \
+        (deficit["required_routine_inspections"] - deficit["routine_inspections"]).clip(lower=0)
+    return deficit
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    all_inspections = load_inspections(get_output_format(sys.argv[1:]))
+    print("Loaded", len(all_inspections), "inspections of", all_inspections["establishment_key"].nunique(),
+          "establishments.")
+
+    overdue_followups = find_overdue_followups(all_inspections)
+    replace_csv(overdue_followups, OVERDUE_FOLLOWUPS_FILENAME)
+    print(len(overdue_followups), "required follow-ups,", int(overdue_followups["overdue"].sum()), "of them overdue,",
+          int(overdue_followups["pending"].sum()), "pending.")
+    print(overdue_followups.groupby("violation_kind")[["overdue", "pending"]].mean().to_string())
+
+    routine_inspection_deficit = find_routine_inspection_deficit(all_inspections)
+    replace_csv(routine_inspection_deficit, ROUTINE_INSPECTION_DEFICIT_FILENAME)
+    print("Routine inspection deficit by year:")
+    print(routine_inspection_deficit.groupby("inspection_year")[
+        ["required_routine_inspections", "routine_inspections", "routine_inspection_deficit"]].sum().to_string())
+    print("Finished in", round(time.perf_counter() - start, 2), "seconds.")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+import datetime
+import hashlib
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from inspection_cache import get_inspection_cache
+from inspection_fetcher import BASE_URL, inspection_report_url, fetch_urls
+from output_store import append_csv
+from pipeline_metrics import METRICS
+
+
+REFRESH_LOG_FILENAME = "output/page_refresh_log.csv"
+
+# A cached page is re-downloaded once it has gone unchecked for a quarter of the age of its inspection, between
+# MIN_REFRESH_INTERVAL_DAYS and MAX_REFRESH_INTERVAL_DAYS, so recent reports (which are the ones that still get
+# corrected) are checked far more often than old ones
+REFRESH_INTERVAL_FRACTION = 0.25
+MIN_REFRESH_INTERVAL_DAYS = 1
+MAX_REFRESH_INTERVAL_DAYS = 365
+
+# Every download of a report is signed in hidden input elements, which differ even when the report has not changed
+HIDDEN_INPUT_PATTERN = re.compile(rb"<input[^>]*type\s*=\s*[\"']?hidden[\"']?[^>]*>", re.IGNORECASE)
+
+
+# Page contents with the per-download signatures removed, so that equal reports give equal content
+def normalize_page(data):
+    return HIDDEN_INPUT_PATTERN.sub(b"", data).replace(b"\r\n", b"\n")
+
+
+def normalized_content_hash(data):
+    return hashlib.sha256(normalize_page(data)).hexdigest()
+
+
+# Maximum number of pages to refresh, given as --max-pages=N (all due pages if not given)
+def get_max_pages(argv):
+    for arg in argv:
+        if arg.startswith("--max-pages="):
+            return int(arg[len("--max-pages="):])
+    return None
+
+
+def load_last_checked_dates(refresh_log_filename=REFRESH_LOG_FILENAME):
+    if not Path(refresh_log_filename).exists():
+        return pd.Series(dtype="datetime64[ns]")
+    refresh_log = pd.read_csv(refresh_log_filename, parse_dates=["date_checked"])
+    return refresh_log.groupby("inspection_id")["date_checked"].max()
+
+
+# Dates on which the given cached pages were stored (see InspectionCache.stored_time), indexed by inspection id
+def cached_dates(inspection_ids, cache):
+    stored_times = [cache.stored_time(x) for x in inspection_ids]
+    return pd.Series(pd.to_datetime([x for x in stored_times if x is not None], unit="s").normalize(),
+                     index=[x for x, y in zip(inspection_ids, stored_times) if y is not None], dtype="datetime64[ns]")
+
+
+# Ids of the cached pages that are due a re-download, most recent inspections first (so that the pages most likely
+# to have been corrected are checked first when only some of them are)
+# inspection_dates is a Series of inspection dates indexed by inspection id, and stored_dates one of the dates the
+# pages were cached; pages never checked before are treated as last checked when they were cached (or, if that is not
+# known, on their inspection date)
+def pages_due_for_refresh(inspection_dates, last_checked_dates, stored_dates=None, today=None):
+    today = pd.Timestamp(today or datetime.date.today())
+    inspection_dates = pd.to_datetime(inspection_dates).dropna()
+    inspection_dates = inspection_dates[~inspection_dates.index.duplicated(keep="last")]
+    age_days = (today - inspection_dates).dt.days.clip(lower=0)
+    interval_days = np.clip(age_days * REFRESH_INTERVAL_FRACTION, MIN_REFRESH_INTERVAL_DAYS, MAX_REFRESH_INTERVAL_DAYS)
+    last_checked = last_checked_dates.reindex(inspection_dates.index)
+    if stored_dates is not None:
+        last_checked = last_checked.fillna(stored_dates.reindex(inspection_dates.index))
+    last_checked = last_checked.fillna(inspection_dates)
+    due = (today - last_checked).dt.days >= interval_days
+    return inspection_dates[due].sort_values(ascending=False, kind="stable").index
+
+
+# Re-downloads the cached pages that are due (at most max_pages of them) and stores the ones whose normalized
+# content has changed, so that the extraction steps see a new content hash for them only
+# Returns the ids of the changed pages
+def refresh_cached_pages(inspection_dates, max_pages=None, today=None, base_url=BASE_URL, concurrency=40,
+                         requests_per_second=None, refresh_log_filename=REFRESH_LOG_FILENAME):
+    cache = get_inspection_cache()
+    inspection_dates = inspection_dates[[x in cache for x in inspection_dates.index]]
+    due_ids = list(pages_due_for_refresh(inspection_dates, load_last_checked_dates(refresh_log_filename),
+                                         cached_dates(list(inspection_dates.index.unique()), cache), today))
+    if max_pages is not None:
+        due_ids = due_ids[:max_pages]
+    print("Refreshing", len(due_ids), "cached pages.")
+
+    url_ids = {inspection_report_url(x, base_url): x for x in due_ids}
+    checked_ids = []
+    changed_ids = []
+
+    def compare_response(response):
+        inspection_id = url_ids[response["url"]]
+        if response["status"] != 200:
+            METRICS.increment("pages_refreshed", result="failed")
+            return
+        checked_ids.append(inspection_id)
+        # An empty page is what the server returns for ids it does not know, which is not a correction
+        if str(response["data"]) == "b''":
+            METRICS.increment("pages_refreshed", result="empty")
+            return
+        if normalized_content_hash(response["data"]) != normalized_content_hash(cache.get(inspection_id)):
+            cache.put(inspection_id, response["data"])
+            changed_ids.append(inspection_id)
+            METRICS.increment("pages_refreshed", result="changed")
+        else:
+            METRICS.increment("pages_refreshed", result="unchanged")
+
+    fetch_urls(url_ids.keys(), compare_response, concurrency=concurrency, requests_per_second=requests_per_second)
+
+    append_csv(pd.DataFrame({"inspection_id": checked_ids,
+                             "date_checked": str(pd.Timestamp(today or datetime.date.today()).date())}),
+               refresh_log_filename)
+    print("Found", len(changed_ids), "changed pages.")
+    return changed_ids
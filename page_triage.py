@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+import sys
+import numpy as np
+
+
+# Classes of cached page, found by looking for a few marker strings in the raw bytes (without parsing the page), so
+# that pages that cannot be inspection reports (the server returns error pages and stubs for many ids) never reach
+# the parser. They are recorded in the id index (see id_index.py) when a page is fetched
+UNTRIAGED = 0
+EMPTY_PAGE = 1
+NOT_A_REPORT = 2  # too small, or no report title, e.g. an error page
+BROKEN_REPORT = 3  # a report title but no observations table, e.g. the broken duplicates on the server
+OLD_FORMAT_REPORT = 4  # Critical/Noncritical violations
+NEW_FORMAT_REPORT = 5  # Priority/Priority Foundation/Core violations
+UNKNOWN_FORMAT_REPORT = 6  # a report with neither kind of violation label
+PAGE_CLASS_NAMES = {UNTRIAGED: "untriaged", EMPTY_PAGE: "empty", NOT_A_REPORT: "not_a_report",
+                    BROKEN_REPORT: "broken_report", OLD_FORMAT_REPORT: "old_format_report",
+                    NEW_FORMAT_REPORT: "new_format_report", UNKNOWN_FORMAT_REPORT: "unknown_format_report"}
+
+# A report's header and tables alone take well over this many bytes, so smaller pages (stubs, error messages, bare
+# redirects) are not reports, whatever strings they contain, and are not searched for the markers
+MIN_REPORT_SIZE = 1024
+
+# The parser only accepts pages with a span of exactly this text, so pages without these bytes cannot be reports
+REPORT_MARKER = b"Food Establishment Inspection Report"
+OBSERVATIONS_MARKER = b"OBSERVATIONS"
+NEW_FORMAT_MARKER = b"Priority Foundation"
+OLD_FORMAT_MARKER = b"Critical Violations"
+
+
+def triage_page(data):
+    if data is None or len(data) == 0 or data.isspace():
+        return EMPTY_PAGE
+    if len(data) < MIN_REPORT_SIZE or REPORT_MARKER not in data:
+        return NOT_A_REPORT
+    if OBSERVATIONS_MARKER not in data:
+        return BROKEN_REPORT
+    if NEW_FORMAT_MARKER in data:
+        return NEW_FORMAT_REPORT
+    if OLD_FORMAT_MARKER in data:
+        return OLD_FORMAT_REPORT
+    return UNKNOWN_FORMAT_REPORT
+
+
+# Whether pages of the given classes need to be parsed (untriaged pages and anything that may be a report, including
+# broken reports, which are parsed so that the field that fails is recorded)
+def might_be_report(page_classes):
+    return ~np.isin(page_classes, [EMPTY_PAGE, NOT_A_REPORT])
+
+
+def triage_cached_pages(inspection_ids, cache):
+    return np.array([triage_page(cache.get(x)) for x in inspection_ids], dtype=np.uint8)
+
+
+def page_class_counts(page_classes):
+    counts = np.bincount(np.asarray(page_classes, dtype=np.int64), minlength=len(PAGE_CLASS_NAMES))
+    return {name: int(counts[page_class]) for page_class, name in PAGE_CLASS_NAMES.items()}
+
+
+# python page_triage.py [--all]  - triages the cached pages of the live ids that have not been triaged yet (or all of
+# them) and records the classes in the id index
+if __name__ == "__main__":
+    from id_index import LIVE, load_id_index
+    from inspection_cache import get_inspection_cache
+    id_index = load_id_index()
+    inspection_cache = get_inspection_cache()
+    live_ids = id_index.ids_with_state(LIVE)
+    if "--all" not in sys.argv[1:]:
+        live_ids = live_ids[id_index.page_class(live_ids) == UNTRIAGED]
+    live_ids = np.array([x for x in live_ids if x in inspection_cache], dtype=np.int64)
+    print("Triaging", len(live_ids), "cached pages.")
+    id_index.update_page_classes(live_ids, triage_cached_pages(live_ids, inspection_cache))
+    id_index.save()
+    for name, count in page_class_counts(id_index.page_class(id_index.ids_with_state(LIVE))).items():
+        print("    " + name + ": " + str(count))
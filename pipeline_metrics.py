@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+METRICS_JSON_FILENAME = "output/metrics.jsonl"
+METRICS_PROMETHEUS_FILENAME = "output/metrics.prom"
+METRIC_PREFIX = "dc_inspections_"
+
+# Upper bounds of the histogram buckets (in seconds) for each histogram
+HISTOGRAM_BUCKETS = {"fetch_seconds": [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],
+                     "parse_seconds": [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1]}
+DEFAULT_BUCKETS = [0.001, 0.01, 0.1, 1, 10, 100]
+
+
+def _key(name, labels):
+    return name, tuple(sorted((x, str(y)) for x, y in labels.items()))
+
+
+# Counters and histograms for one process
+# Worker processes hand what they recorded back to the main process with drain and merge, so that only the main
+# process writes the metrics files
+#
+# Every call to emit appends the running totals (plus progress and rates for the stage) as one line of
+# output/metrics.jsonl, and rewrites output/metrics.prom in the Prometheus text format (e.g. for the node exporter
+# textfile collector)
+class Metrics:
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts (last is +Inf), sum, count]
+        self.start_time = time.time()
+        self.stage_starts = {}
+
+    def increment(self, name, value=1, **labels):
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        buckets = HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS)
+        if key not in self.histograms:
+            self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram = self.histograms[key]
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_total(self, name):
+        return sum(y for x, y in self.counters.items() if x[0] == name)
+
+    # Returns what has been recorded since the last drain (as a picklable snapshot) and resets the counts
+    def drain(self):
+        snapshot = (self.counters, self.histograms)
+        self.counters = {}
+        self.histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        counters, histograms = snapshot
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, (bucket_counts, total, count) in histograms.items():
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(bucket_counts), 0.0, 0]
+            histogram = self.histograms[key]
+            histogram[0] = [x + y for x, y in zip(histogram[0], bucket_counts)]
+            histogram[1] += total
+            histogram[2] += count
+
+    def to_json(self):
+        return {"counters": [{"name": x[0], "labels": dict(x[1]), "value": y} for x, y in self.counters.items()],
+                "histograms": [{"name": x[0], "labels": dict(x[1]),
+                                "buckets": HISTOGRAM_BUCKETS.get(x[0], DEFAULT_BUCKETS), "bucket_counts": y[0],
+                                "sum": y[1], "count": y[2]} for x, y in self.histograms.items()]}
+
+    def to_prometheus(self):
+        def format_labels(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if len(labels) == 0:
+                return ""
+            return "{" + ",".join(x + '="' + y.replace("\\", "\\\\").replace('"', '\\"') + '"'
+                                  for x, y in labels) + "}"
+
+        lines = []
+        for name in sorted(set(x[0] for x in self.counters)):
+            lines.append("# TYPE " + METRIC_PREFIX + name + "_total counter")
+            for key in sorted(x for x in self.counters if x[0] == name):
+                lines.append(METRIC_PREFIX + name + "_total" + format_labels(key[1]) + " " +
+                             str(self.counters[key]))
+        for name in sorted(set(x[0] for x in self.histograms)):
+            lines.append("# TYPE " + METRIC_PREFIX + name + " histogram")
+            buckets = [str(x) for x in HISTOGRAM_BUCKETS.get(name, DEFAULT_BUCKETS)] + ["+Inf"]
+            for key in sorted(x for x in self.histograms if x[0] == name):
+                bucket_counts, total, count = self.histograms[key]
+                cumulative = 0
+                for bucket, bucket_count in zip(buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(METRIC_PREFIX + name + "_bucket" + format_labels(key[1], [("le", bucket)]) + " " +
+                                 str(cumulative))
+                lines.append(METRIC_PREFIX + name + "_sum" + format_labels(key[1]) + " " + repr(total))
+                lines.append(METRIC_PREFIX + name + "_count" + format_labels(key[1]) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    # Records progress through a stage (done out of total items), prints a one line summary and writes the metrics
+    def emit(self, stage, done, total=None, json_filename=METRICS_JSON_FILENAME,
+             prometheus_filename=METRICS_PROMETHEUS_FILENAME):
+        now = time.time()
+        elapsed = now - self.stage_starts.get(stage, self.start_time)
+        rate = done / elapsed if elapsed > 0 else None
+        line = {"time": now, "stage": stage, "done": done, "total": total,
+                "elapsed_seconds": elapsed, "items_per_second": rate}
+        line.update(self.to_json())
+        with open(json_filename, "a") as json_file:
+            json_file.write(json.dumps(line) + "\n")
+        with open(prometheus_filename + ".tmp", "w") as prometheus_file:
+            prometheus_file.write(self.to_prometheus())
+            prometheus_file.write("# TYPE " + METRIC_PREFIX + "stage_done gauge\n")
+            prometheus_file.write(METRIC_PREFIX + "stage_done" + '{stage="' + stage + '"} ' + str(done) + "\n")
+            if total is not None:
+                prometheus_file.write("# TYPE " + METRIC_PREFIX + "stage_total gauge\n")
+                prometheus_file.write(METRIC_PREFIX + "stage_total" + '{stage="' + stage + '"} ' + str(total) + "\n")
+        os.replace(prometheus_filename + ".tmp", prometheus_filename)
+
+        message = stage + ": " + str(done) + (" of " + str(total) if total is not None else "") + " done"
+        if rate is not None:
+            message += " (" + str(round(rate, 1)) + "/sec)"
+        print(message)
+
+    # Starts timing the rate of a stage from now (otherwise it is timed from the start of the process)
+    def start_stage(self, stage):
+        self.stage_starts[stage] = time.time()
+
+
+# The metrics of this process
+METRICS = Metrics()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import cProfile
+import pstats
+import time
+from contextlib import contextmanager
+
+
+PROFILE_DIR = "output"
+
+
+# Scripts run with --profile are profiled with cProfile, with --profile=pyinstrument with pyinstrument (if installed)
+# While profiling, the scripts run their worker tasks in the main process (worker_pool.InProcessPool), so that the
+# time spent in them (downloading, parsing) shows up in the profile
+def get_profiler(argv):
+    for arg in argv:
+        if arg == "--profile":
+            return "cprofile"
+        if arg.startswith("--profile="):
+            return arg[len("--profile="):]
+    return None
+
+
+# Profiles the enclosed block if a profiler is given, writing the results to output/profile_<name>.prof (cProfile,
+# e.g. for snakeviz or pstats) or output/profile_<name>.html (pyinstrument) and printing a summary
+@contextmanager
+def profiled(name, profiler=None, profile_dir=PROFILE_DIR):
+    if profiler is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(profile_dir + "/profile_" + name + ".html", "w") as profile_file:
+                profile_file.write(profile.output_html())
+            print(profile.output_text(unicode=True, color=False))
+    elif profiler == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(profile_dir + "/profile_" + name + ".prof")
+            pstats.Stats(profile).sort_stats("cumulative").print_stats(30)
+    else:
+        raise ValueError("Unknown profiler: " + profiler)
+    print("Profiled", name, "in", round(time.perf_counter() - start, 2), "seconds, results saved in", profile_dir)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+import sqlite3
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from establishments import ESTABLISHMENT_INDEX_FILENAME
+from geocodes import GEOCODES_FILENAME
+from inspection_parser import SUMMARY_COLUMNS, VIOLATION_DETAIL_COLUMNS
+from output_store import get_output_format, iterate_table, table_exists
+from violation_codes import VIOLATION_CODES_FILENAME, VIOLATION_CODE_COLUMNS
+
+
+# The extracted tables, geocodes and establishment ids in one SQLite file (output/inspections.sqlite), indexed for the
+# usual lookups, so that they can be queried without loading the CSV files or Parquet datasets into memory
+# python query_store.py [--csv] loads (or reloads) everything into it; loading is an upsert keyed on the inspection id,
+# so it can be repeated at any time (e.g. after each run of 02 or 03alt) and gives the same result
+
+DATABASE_FILENAME = "output/inspections.sqlite"
+
+# The tables saved by 02 and 03alt (see output_store.py)
+OUTPUT_TABLES = ["inspection_summary_data", "violations_details_data", "potential_inspection_summary_data",
+                 "potential_violation_details_data"]
+
+INSPECTION_COLUMNS = SUMMARY_COLUMNS + ["known_valid", "inspection_type_category"]
+# Violation rows keep the code of their description (see violation_codes.py), or the description itself if they were
+# extracted before the codes were introduced; the violation_details view has the description either way
+VIOLATION_COLUMNS = VIOLATION_DETAIL_COLUMNS + ["violation_code"]
+INTEGER_COLUMNS = {"inspection_id", "risk_category", "known_valid", "total_violations", "violation_code"} | \
+    {x + y for x in ["priority_violations", "priority_foundation_violations", "core_violations",
+                     "critical_violations", "noncritical_violations"]
+     for y in ["", "_corrected_on_site", "_repeated"]}
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS inspections (" +
+    ", ".join(x + (" INTEGER" if x in INTEGER_COLUMNS else " TEXT") + (" PRIMARY KEY" if x == "inspection_id" else "")
+              for x in INSPECTION_COLUMNS) + ")",
+    "CREATE TABLE IF NOT EXISTS violations (" +
+    ", ".join(x + (" INTEGER" if x in INTEGER_COLUMNS else " TEXT") for x in VIOLATION_COLUMNS) + ")",
+    "CREATE TABLE IF NOT EXISTS violation_codes (violation_code INTEGER PRIMARY KEY, report_format TEXT, "
+    "violation_number TEXT, violation_description TEXT)",
+    "CREATE VIEW IF NOT EXISTS violation_details AS SELECT " +
+    ", ".join("COALESCE(violation_codes.violation_description, violations.violation_description) AS "
+              "violation_description" if x == "violation_description" else "violations." + x
+              for x in VIOLATION_DETAIL_COLUMNS) +
+    " FROM violations LEFT JOIN violation_codes USING (violation_code)",
+    "CREATE TABLE IF NOT EXISTS geocodes (inspection_id INTEGER PRIMARY KEY, latitude REAL, longitude REAL)",
+    "CREATE TABLE IF NOT EXISTS establishments (inspection_id INTEGER PRIMARY KEY, establishment_id INTEGER)",
+    "CREATE INDEX IF NOT EXISTS inspections_license_number ON inspections (license_number)",
+    "CREATE INDEX IF NOT EXISTS inspections_inspection_date ON inspections (inspection_date)",
+    "CREATE INDEX IF NOT EXISTS violations_inspection_id ON violations (inspection_id)",
+    "CREATE INDEX IF NOT EXISTS establishments_establishment_id ON establishments (establishment_id)"]
+
+
+# Values as SQLite takes them: dates as ISO strings, missing values as NULL, numpy scalars as Python ones
+def _rows(data, columns):
+    data = data.reindex(columns=columns).copy()
+    for column in columns:
+        if pd.api.types.is_datetime64_any_dtype(data[column]):
+            data[column] = data[column].dt.strftime("%Y-%m-%d")
+        elif column in INTEGER_COLUMNS:
+            data[column] = data[column].astype("Int64")
+    data = data.astype(object).where(data.notna(), None)
+    return [tuple(x.item() if isinstance(x, np.generic) else x for x in row)
+            for row in data.itertuples(index=False, name=None)]
+
+
+class InspectionStore:
+    def __init__(self, filename=DATABASE_FILENAME):
+        self.connection = sqlite3.connect(filename)
+        # Stores created before the violation codes were introduced get the new column
+        existing_columns = [x[1] for x in self.connection.execute("PRAGMA table_info(violations)")]
+        if len(existing_columns) > 0 and "violation_code" not in existing_columns:
+            self.connection.execute("ALTER TABLE violations ADD COLUMN violation_code INTEGER")
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    # Inserts the rows (replacing the given columns of any existing row with the same inspection id)
+    def _upsert(self, table, data, columns):
+        updates = ", ".join(x + " = excluded." + x for x in columns if x != "inspection_id")
+        self.connection.executemany(
+            "INSERT INTO " + table + " (" + ", ".join(columns) + ") VALUES (" + ", ".join("?" * len(columns)) + ")" +
+            " ON CONFLICT (inspection_id) DO UPDATE SET " + updates, _rows(data, columns))
+
+    # Summary rows, from the 03alt (potential) or the 02 (scraped links, all known to be valid) summary table
+    def upsert_inspections(self, data):
+        if "known_valid" not in data:
+            data = data.assign(known_valid=True)
+        self._upsert("inspections", data, [x for x in INSPECTION_COLUMNS if x in data])
+
+    # Violation details rows; all earlier rows of each inspection that has not been loaded yet in this run (given by
+    # replaced_ids, which is updated) are replaced
+    def upsert_violations(self, data, replaced_ids):
+        new_ids = [int(x) for x in data["inspection_id"].unique() if x not in replaced_ids]
+        self.connection.executemany("DELETE FROM violations WHERE inspection_id = ?", [(x,) for x in new_ids])
+        replaced_ids.update(new_ids)
+        self.connection.executemany(
+            "INSERT INTO violations (" + ", ".join(VIOLATION_COLUMNS) + ") VALUES (" +
+            ", ".join("?" * len(VIOLATION_COLUMNS)) + ")", _rows(data, VIOLATION_COLUMNS))
+
+    def upsert_violation_codes(self, data):
+        self.connection.executemany("INSERT OR REPLACE INTO violation_codes (" + ", ".join(VIOLATION_CODE_COLUMNS) +
+                                    ") VALUES (?, ?, ?, ?)", _rows(data, VIOLATION_CODE_COLUMNS))
+
+    def upsert_geocodes(self, data):
+        self._upsert("geocodes", data, ["inspection_id", "latitude", "longitude"])
+
+    def upsert_establishments(self, data):
+        self._upsert("establishments", data, ["inspection_id", "establishment_id"])
+
+    # Loads every output table that exists, a piece at a time, in one transaction per table
+    # The violations of every loaded inspection are replaced (so one that no longer has any loses them), and
+    # inspections that are no longer in any of the tables (e.g. removed when their page turned out not to be a report)
+    # are deleted with their violations
+    # Returns the names of the tables that do not exist (which are reported, as a missing table usually means a script
+    # has not been run yet, or was run with the other output format)
+    def ingest(self, output_format):
+        loaded_ids = set()
+        missing_tables = [x for x in OUTPUT_TABLES if not table_exists(x, output_format)]
+        for table in missing_tables:
+            print("Table " + table + " (" + output_format + ") not found, nothing loaded from it.")
+        for summary_table, violations_table in [("inspection_summary_data", "violations_details_data"),
+                                                ("potential_inspection_summary_data",
+                                                 "potential_violation_details_data")]:
+            summary_ids = set()
+            with self.connection:
+                if table_exists(summary_table, output_format):
+                    for chunk in iterate_table(summary_table, output_format=output_format):
+                        self.upsert_inspections(chunk)
+                        summary_ids.update(int(x) for x in chunk["inspection_id"])
+            with self.connection:
+                self.connection.executemany("DELETE FROM violations WHERE inspection_id = ?",
+                                            [(x,) for x in summary_ids])
+                replaced_ids = set(summary_ids)
+                if table_exists(violations_table, output_format):
+                    for chunk in iterate_table(violations_table, output_format=output_format):
+                        self.upsert_violations(chunk, replaced_ids)
+            loaded_ids |= summary_ids
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE loaded_ids (inspection_id INTEGER PRIMARY KEY)")
+            self.connection.executemany("INSERT INTO loaded_ids VALUES (?)", [(x,) for x in loaded_ids])
+            for table in ["inspections", "violations"]:
+                self.connection.execute("DELETE FROM " + table + " WHERE inspection_id NOT IN "
+                                        "(SELECT inspection_id FROM loaded_ids)")
+            self.connection.execute("DROP TABLE loaded_ids")
+        for filename, upsert in [(VIOLATION_CODES_FILENAME, self.upsert_violation_codes),
+                                 (GEOCODES_FILENAME, self.upsert_geocodes),
+                                 (ESTABLISHMENT_INDEX_FILENAME, self.upsert_establishments)]:
+            if not Path(filename).exists():
+                print(filename + " not found, nothing loaded from it.")
+                missing_tables.append(filename)
+            else:
+                with self.connection:
+                    for chunk in pd.read_csv(filename, chunksize=50000):
+                        upsert(chunk.drop_duplicates(chunk.columns[0], keep="last"))
+        return missing_tables
+
+    def query(self, sql, parameters=()):
+        return pd.read_sql_query(sql, self.connection, params=parameters)
+
+    # Summary of one inspection, as a dict (None if it is not in the store)
+    def inspection(self, inspection_id):
+        rows = self.query("SELECT * FROM inspections WHERE inspection_id = ?", (int(inspection_id),))
+        return rows.iloc[0].to_dict() if len(rows) > 0 else None
+
+    def violations(self, inspection_id):
+        return self.query("SELECT * FROM violation_details WHERE inspection_id = ?", (int(inspection_id),))
+
+    def inspections_with_license(self, license_number):
+        return self.query("SELECT * FROM inspections WHERE license_number = ? ORDER BY inspection_date",
+                          (license_number,))
+
+    # Inspections of one establishment (see establishments.py) with their geocodes, in date order
+    def inspections_of_establishment(self, establishment_id):
+        return self.query("SELECT inspections.*, latitude, longitude FROM establishments "
+                          "JOIN inspections USING (inspection_id) LEFT JOIN geocodes USING (inspection_id) "
+                          "WHERE establishment_id = ? ORDER BY inspection_date", (int(establishment_id),))
+
+    # Inspections from start_date up to and including end_date (ISO date strings)
+    def inspections_between(self, start_date, end_date, known_valid_only=True):
+        return self.query("SELECT * FROM inspections WHERE inspection_date BETWEEN ? AND ?" +
+                          (" AND known_valid = 1" if known_valid_only else "") + " ORDER BY inspection_date",
+                          (start_date, end_date))
+
+    # Number of inspections and of each kind of violation per inspection year
+    def violation_counts_by_year(self, known_valid_only=True):
+        counts = ", ".join("SUM(" + x + ") AS " + x for x in ["total_violations", "priority_violations",
+                                                              "priority_foundation_violations", "core_violations",
+                                                              "critical_violations", "noncritical_violations"])
+        return self.query("SELECT substr(inspection_date, 1, 4) AS inspection_year, COUNT(*) AS inspections, " +
+                          counts + " FROM inspections" + (" WHERE known_valid = 1" if known_valid_only else "") +
+                          " GROUP BY inspection_year ORDER BY inspection_year")
+
+    # Most frequently cited violations (by DCMR 25 code), with the number of inspections they were cited in
+    def most_cited_violations(self, limit=20):
+        return self.query("SELECT dcmr_25_code, COUNT(DISTINCT inspection_id) AS inspections FROM violations "
+                          "WHERE dcmr_25_code IS NOT NULL GROUP BY dcmr_25_code ORDER BY inspections DESC LIMIT ?",
+                          (int(limit),))
+
+
+if __name__ == "__main__":
+    store = InspectionStore()
+    store.ingest(get_output_format(sys.argv[1:]))
+    for table in ["inspections", "violations", "geocodes", "establishments"]:
+        print(table + ":", store.query("SELECT COUNT(*) AS n FROM " + table)["n"].iloc[0], "rows")
+    print(store.violation_counts_by_year().to_string(index=False))
+    store.close()
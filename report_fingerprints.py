@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+import hashlib
+import sys
+import numpy as np
+import pandas as pd
+from inspection_parser import SUMMARY_COLUMNS
+from output_store import get_output_format, load_table, replace_csv
+
+
+# Finds reports that are copies of each other (the server has broken duplicates of some reports under other ids, and
+# ids that are not known to be valid often turn out to be clones of ones that are)
+# The raw pages cannot be compared because every download is signed differently, so the reports are compared on their
+# extracted fields: each report becomes a set of tokens (one per summary field, one per violation, and 3-word shingles
+# of the inspector comments), which is hashed into an exact content fingerprint and a MinHash signature
+# Near-identical signatures are found with locality sensitive hashing (signatures that agree on every row of some band
+# land in the same bucket), so only reports that share a bucket are ever compared, in a single pass over the corpus
+
+FINGERPRINTS_FILENAME = "output/report_fingerprints.csv"
+
+# Summary fields that make up a report's tokens (the id differs between copies, and the comments are shingled)
+FINGERPRINT_FIELDS = [x for x in SUMMARY_COLUMNS if x not in ["inspection_id", "inspector_comments"]]
+
+NUMBER_OF_HASHES = 64
+NUMBER_OF_BANDS = 16
+# Reports are duplicates if their estimated Jaccard similarity is at least this, and they are of the same date
+SIMILARITY_THRESHOLD = 0.9
+SHINGLE_WORDS = 3
+
+_HASH_SEEDS = np.random.default_rng(17).integers(1, 2 ** 63, size=(2, NUMBER_OF_HASHES), dtype=np.uint64)
+
+
+# Table of (inspection_id, token) with the token set of every report
+def report_tokens(summary, violation_details):
+    summary = summary.drop_duplicates("inspection_id", keep="last")
+    fields = [x for x in FINGERPRINT_FIELDS if x in summary.columns]
+    field_tokens = summary.melt(id_vars="inspection_id", value_vars=fields).dropna(subset="value")
+    field_tokens["token"] = field_tokens["variable"] + "=" + field_tokens["value"].astype(str).str.strip()
+
+    violation_tokens = violation_details.dropna(subset="violation_number").assign(
+        token=lambda x: "violation=" + x["violation_number"].astype(str) + ":" +
+        x["violation_text"].fillna("").astype(str).str.split().str.join(" "))
+
+    comments = summary["inspector_comments"] if "inspector_comments" in summary else pd.Series(None, summary.index)
+    comment_tokens = summary[["inspection_id"]].assign(
+        token=comments.fillna("").astype(str).str.upper().str.split().map(_shingles))
+    comment_tokens = comment_tokens.explode("token").dropna(subset="token")
+
+    tokens = pd.concat([x[["inspection_id", "token"]] for x in [field_tokens, violation_tokens, comment_tokens]],
+                       ignore_index=True)
+    return tokens.drop_duplicates().sort_values("inspection_id", kind="stable").reset_index(drop=True)
+
+
+def _shingles(words):
+    if len(words) <= SHINGLE_WORDS:
+        return ["comments=" + " ".join(words)] if len(words) > 0 else []
+    return ["comments=" + " ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+
+
+# Exact content fingerprint of every report (sha256 of its sorted token hashes), and its MinHash signature (the
+# minimum of each of NUMBER_OF_HASHES hash functions over its tokens), for a table sorted by inspection id
+def fingerprint_reports(tokens, chunk_size=100000):
+    token_hashes = pd.util.hash_array(tokens["token"].to_numpy(dtype=object))
+    inspection_ids, starts = np.unique(tokens["inspection_id"].to_numpy(), return_index=True)
+    ends = np.append(starts[1:], len(tokens))
+
+    order = np.lexsort([token_hashes, tokens["inspection_id"].to_numpy()])
+    sorted_hashes = token_hashes[order]
+    content_fingerprints = [hashlib.sha256(sorted_hashes[start:end].tobytes()).hexdigest()
+                            for start, end in zip(starts, ends)]
+
+    # Each hash function is a multiply-shift hash of the token hash (the high 32 bits of a*h + b mod 2^64); the tokens
+    # are processed in chunks that start at a report boundary, to bound the size of the tokens x hashes matrix
+    signatures = np.empty((len(inspection_ids), NUMBER_OF_HASHES), dtype=np.uint32)
+    first_report = 0
+    while first_report < len(inspection_ids):
+        last_report = max(np.searchsorted(starts, starts[first_report] + chunk_size, side="right"), first_report + 1)
+        chunk = token_hashes[starts[first_report]:ends[last_report - 1]]
+        hashed = ((chunk[:, None] * _HASH_SEEDS[0] + _HASH_SEEDS[1]) >> np.uint64(32)).astype(np.uint32)
+        signatures[first_report:last_report] = np.minimum.reduceat(
+            hashed, starts[first_report:last_report] - starts[first_report], axis=0)
+        first_report = last_report
+    return inspection_ids, content_fingerprints, signatures
+
+
+# Pairs of rows of signatures that share a bucket in at least one band
+def candidate_pairs(signatures, number_of_bands=NUMBER_OF_BANDS):
+    rows_per_band = signatures.shape[1] // number_of_bands
+    pairs = []
+    for band in range(number_of_bands):
+        buckets = np.zeros(len(signatures), dtype=np.uint64)
+        for row in range(band * rows_per_band, (band + 1) * rows_per_band):
+            buckets = buckets * np.uint64(0x100000001B3) + signatures[:, row].astype(np.uint64)
+        order = np.argsort(buckets, kind="stable")
+        sorted_buckets = buckets[order]
+        # Each member of a bucket is paired with the first member, which is enough to connect the bucket
+        first = np.searchsorted(sorted_buckets, sorted_buckets, side="left")
+        in_bucket = first != np.arange(len(order))
+        pairs.append(np.column_stack([order[first[in_bucket]], order[in_bucket]]))
+    pairs = np.concatenate(pairs) if len(pairs) > 0 else np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.sort(pairs, axis=1), axis=0)
+
+
+# Group number (the lowest row in the group) of every row, given the pairs of rows that are linked
+def _connected_components(size, pairs):
+    labels = np.arange(size)
+    while len(pairs) > 0:
+        lowest = np.minimum(labels[pairs[:, 0]], labels[pairs[:, 1]])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, pairs[:, 0], lowest)
+        np.minimum.at(new_labels, pairs[:, 1], lowest)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels
+
+
+# One row per report with its content fingerprint, the group of near-identical reports it belongs to (named after the
+# report that is kept: the lowest known valid id in the group, or else the lowest id), whether it is an exact or near
+# duplicate of that report, and whether it is a clone of a known valid report without being known valid itself
+def find_duplicates(summary, violation_details):
+    summary = summary.drop_duplicates("inspection_id", keep="last")
+    inspection_ids, content_fingerprints, signatures = fingerprint_reports(report_tokens(summary, violation_details))
+    reports = pd.DataFrame({"inspection_id": inspection_ids, "content_fingerprint": content_fingerprints})
+    reports = reports.merge(summary[["inspection_id", "inspection_date", "known_valid"]], on="inspection_id",
+                            how="left")
+    reports["known_valid"] = reports["known_valid"].fillna(False).astype(bool)
+
+    pairs = candidate_pairs(signatures)
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    inspection_dates = reports["inspection_date"].astype(str).to_numpy()
+    same_date = inspection_dates[pairs[:, 0]] == inspection_dates[pairs[:, 1]]
+    exact = reports["content_fingerprint"].to_numpy()
+    pairs = pairs[((similarity >= SIMILARITY_THRESHOLD) & same_date) |
+                  (exact[pairs[:, 0]] == exact[pairs[:, 1]])]
+    groups = _connected_components(len(reports), pairs)
+
+    # The report kept from each group: known valid ones first, then the lowest id
+    kept = reports.assign(group=groups).sort_values(["known_valid", "inspection_id"], ascending=[False, True]) \
+        .drop_duplicates("group").set_index("group")
+    reports["duplicate_of"] = kept.loc[groups, "inspection_id"].to_numpy()
+    kept_rows = pd.Series(np.arange(len(reports)), index=reports["inspection_id"])[reports["duplicate_of"]].to_numpy()
+    reports["is_duplicate"] = reports["duplicate_of"] != reports["inspection_id"]
+    reports["exact_duplicate"] = reports["is_duplicate"] & (exact == exact[kept_rows])
+    reports["similarity"] = (signatures == signatures[kept_rows]).mean(axis=1).round(3)
+    reports["known_valid_clone"] = reports["is_duplicate"] & ~reports["known_valid"] & \
+        reports["known_valid"].to_numpy()[kept_rows]
+    return reports.drop(columns="inspection_date")
+
+
+# Ids of the reports flagged as duplicates by the last run of this script (none if it has not been run)
+def load_duplicate_ids(fingerprints_filename=FINGERPRINTS_FILENAME):
+    try:
+        fingerprints = pd.read_csv(fingerprints_filename, usecols=["inspection_id", "is_duplicate"])
+    except FileNotFoundError:
+        return pd.Series(dtype="int64")
+    return fingerprints.loc[fingerprints["is_duplicate"], "inspection_id"]
+
+
+# Fingerprints the potential inspection reports extracted by 03alt and writes output/report_fingerprints.csv
+if __name__ == "__main__":
+    output_format = get_output_format(sys.argv[1:])
+    summary_data = load_table("potential_inspection_summary_data", output_format=output_format)
+    violation_details_data = load_table("potential_violation_details_data",
+                                        ["inspection_id", "violation_number", "violation_text"],
+                                        output_format=output_format)
+    print(int(summary_data["inspection_id"].duplicated().sum()), "repeated rows of the same inspection id.")
+    duplicates = find_duplicates(summary_data, violation_details_data)
+    replace_csv(duplicates, FINGERPRINTS_FILENAME)
+    print(len(duplicates), "reports,", int(duplicates["is_duplicate"].sum()), "of them duplicates,",
+          int(duplicates["exact_duplicate"].sum()), "of them exact.")
+    print(int(duplicates["known_valid_clone"].sum()),
+          "reports that are not known to be valid are clones of known valid reports.")
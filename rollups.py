@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from establishments import load_establishment_index
+from output_store import get_output_format, load_table, load_tombstones, replace_csv, table_batches, table_exists
+from report_fingerprints import load_duplicate_ids
+
+
+# Monthly violation counts of the valid inspections in the potential inspection summary data (the same ones as
+# overdue_followups.py uses), by establishment, by inspector and by risk category, kept up to date incrementally
+# Each inspection is reduced to one row of facts (output/rollup_inspection_facts.csv: its month, establishment,
+# inspector, risk category and counts), and only the months that new, changed or removed inspections fall in (before
+# or after the change) are recomputed from the facts; the rows of the other months are kept as they are
+# python rollups.py [--csv] [--full] updates the rollups (--full rebuilds them), e.g. after each run of 03alt,
+# establishments.py or report_fingerprints.py
+
+FACTS_FILENAME = "output/rollup_inspection_facts.csv"
+# Rollup file and the columns (besides the month) it is grouped by
+ROLLUPS = {"output/rollup_by_month.csv": [],
+           "output/rollup_by_establishment_month.csv": ["establishment_id"],
+           "output/rollup_by_inspector_month.csv": ["inspector_badge_number"],
+           "output/rollup_by_risk_category_month.csv": ["risk_category"]}
+
+VIOLATION_KINDS = ["priority", "priority_foundation", "core", "critical", "noncritical"]
+SOURCE_COLUMNS = ["inspection_id", "inspection_date", "risk_category", "inspector_badge_number", "known_valid",
+                  "inspection_type_category", "total_violations"] + \
+    [x + y for x in VIOLATION_KINDS for y in ["_violations", "_violations_corrected_on_site"]]
+# Counts summed in every rollup: violations of each kind, those left uncorrected at the end of the inspection, and the
+# number of inspections that left any (as in Issue17_Shashank.R)
+MEASURES = ["inspections", "routine_inspections", "follow_up_inspections", "total_violations"] + \
+    [x + y for x in VIOLATION_KINDS for y in ["_violations", "_violations_left"]] + \
+    ["inspections_with_" + x + "_left" for x in VIOLATION_KINDS]
+FACT_COLUMNS = ["inspection_id", "inspection_month", "risk_category", "inspector_badge_number", "known_valid"] + \
+    MEASURES + ["row_hash", "_batch", "establishment_id", "included"]
+
+
+# One row of facts per inspection of the given summary rows (inspections without a date are left out)
+def inspection_facts(summary):
+    summary = summary.drop_duplicates("inspection_id", keep="last")
+    summary = summary.loc[summary["inspection_date"].notna()].reset_index(drop=True)
+    facts = pd.DataFrame({"inspection_id": summary["inspection_id"].astype(np.int64),
+                          "inspection_month": pd.to_datetime(summary["inspection_date"]).dt.strftime("%Y-%m"),
+                          "risk_category": summary["risk_category"].astype("Int64"),
+                          "inspector_badge_number": summary["inspector_badge_number"].astype(object),
+                          "known_valid": summary["known_valid"].fillna(False).astype(bool),
+                          "inspections": 1,
+                          "routine_inspections": (summary["inspection_type_category"] == "routine").astype(int),
+                          "follow_up_inspections": (summary["inspection_type_category"] == "follow_up").astype(int),
+                          "total_violations": summary["total_violations"].fillna(0).astype(int)})
+    for kind in VIOLATION_KINDS:
+        violations = summary[kind + "_violations"].fillna(0).astype(int)
+        left = (violations - summary[kind + "_violations_corrected_on_site"].fillna(0).astype(int)).clip(lower=0)
+        facts[kind + "_violations"] = violations
+        facts[kind + "_violations_left"] = left
+        facts["inspections_with_" + kind + "_left"] = (left > 0).astype(int)
+    # Hash of the values the facts are made from, to tell a changed inspection from one that was only re-saved
+    facts["row_hash"] = pd.util.hash_pandas_object(facts[FACT_COLUMNS[1:-4]], index=False).to_numpy().view(np.int64)
+    facts["_batch"] = summary["_batch"].to_numpy() if "_batch" in summary else 0
+    return facts
+
+
+def load_facts(filename=FACTS_FILENAME):
+    if not Path(filename).exists():
+        return pd.DataFrame({x: pd.Series(dtype=object) for x in FACT_COLUMNS})
+    facts = pd.read_csv(filename, dtype={"inspection_month": str, "inspector_badge_number": object})
+    for column in ["risk_category", "establishment_id"]:
+        facts[column] = facts[column].astype("Int64")
+    return facts
+
+
+# Summary rows that may have changed since the facts were last updated, the ids of inspections whose rows have been
+# removed since then, and whether the rows replace all of the facts
+# Parquet tables are only read from the batches saved since then (and their tombstones, see output_store.py); a CSV
+# table has to be read in full, and a Parquet table that has been rewritten (e.g. by 03alt --full) too
+def changed_summary_rows(facts, output_format, full=False):
+    no_ids = pd.Series(dtype="int64")
+    if output_format == "csv":
+        return load_table("potential_inspection_summary_data", SOURCE_COLUMNS, output_format=output_format), \
+            no_ids, True
+    if full or len(facts) == 0:
+        return load_table("potential_inspection_summary_data", SOURCE_COLUMNS + ["_batch"]), no_ids, True
+    last_batch = int(facts["_batch"].max())
+    batches = table_batches("potential_inspection_summary_data")
+    if len(batches) == 0 or batches[0] > last_batch:
+        return load_table("potential_inspection_summary_data", SOURCE_COLUMNS + ["_batch"]), no_ids, True
+    removed_ids = load_tombstones("potential_inspection_summary_data", after_batch=last_batch)["inspection_id"]
+    if batches[-1] <= last_batch and len(removed_ids) == 0:
+        return pd.DataFrame(columns=SOURCE_COLUMNS + ["_batch"]), no_ids, False
+    summary = load_table("potential_inspection_summary_data", SOURCE_COLUMNS + ["_batch"], after_batch=last_batch)
+    return summary, removed_ids[~removed_ids.isin(summary["inspection_id"])], False
+
+
+# Establishment id of each inspection (see establishments.py) and whether it is counted: known valid, and not flagged
+# as a duplicate of another report (see report_fingerprints.py)
+def assign_establishments(facts):
+    facts = facts.copy()
+    facts["establishment_id"] = pd.array(load_establishment_index().establishment_ids(facts["inspection_id"]),
+                                         dtype="Float64").astype("Int64")
+    facts["included"] = facts["known_valid"].astype(bool) & ~facts["inspection_id"].isin(load_duplicate_ids())
+    return facts
+
+
+# Updates the facts and returns them with the months whose rollup rows have to be recomputed
+def update_facts(facts, summary, removed_ids, replaces_all):
+    new_facts = inspection_facts(summary)
+    if not replaces_all:
+        kept = ~facts["inspection_id"].isin(new_facts["inspection_id"]) & ~facts["inspection_id"].isin(removed_ids)
+        new_facts = pd.concat([facts.loc[kept], new_facts])
+    new_facts = assign_establishments(new_facts).sort_values("inspection_id").reset_index(drop=True)
+
+    # An inspection's months (before and after) are dirty if it was added, removed or changed, or if its establishment
+    # or whether it is counted changed (e.g. after establishments.py merged two establishments)
+    # (the hashes are made nullable, as an outer join would turn them into floats, which cannot hold them exactly)
+    compared = facts.astype({"row_hash": "Int64"}).merge(new_facts.astype({"row_hash": "Int64"}), on="inspection_id",
+                                                         how="outer", suffixes=("_old", "_new"), indicator=True)
+    changed = compared["_merge"] != "both"
+    for column in ["row_hash", "establishment_id", "included"]:
+        changed |= compared[column + "_old"].astype(object).fillna(-1) != compared[column + "_new"].astype(object) \
+            .fillna(-1)
+    dirty_months = set(compared.loc[changed, "inspection_month_old"].dropna()) | \
+        set(compared.loc[changed, "inspection_month_new"].dropna())
+    return new_facts, dirty_months
+
+
+# Rollup rows of the given months, from the facts of the inspections that are counted
+def compute_rollup(facts, group_columns, months):
+    facts = facts.loc[facts["included"].astype(bool) & facts["inspection_month"].isin(months)]
+    return facts.groupby(["inspection_month"] + group_columns, dropna=False)[MEASURES].sum().reset_index()
+
+
+# Replaces the rows of the dirty months in a rollup file (or writes it from scratch if it does not exist, or if
+# rebuild is set)
+def update_rollup(filename, facts, group_columns, dirty_months, rebuild=False):
+    if Path(filename).exists() and not rebuild:
+        rollup = pd.read_csv(filename, dtype={"inspection_month": str, "inspector_badge_number": object})
+        rollup = rollup.loc[~rollup["inspection_month"].isin(dirty_months)]
+    else:
+        rollup = None
+        dirty_months = set(facts["inspection_month"])
+    rollup = pd.concat([x for x in [rollup, compute_rollup(facts, group_columns, dirty_months)] if x is not None])
+    for column in ["risk_category", "establishment_id"]:
+        if column in rollup:
+            rollup[column] = rollup[column].astype("Int64")
+    replace_csv(rollup.sort_values(["inspection_month"] + group_columns, kind="stable"), filename)
+
+
+def update_rollups(output_format, full=False):
+    facts = load_facts()
+    summary, removed_ids, replaces_all = changed_summary_rows(facts, output_format, full)
+    facts, dirty_months = update_facts(facts, summary, removed_ids, replaces_all)
+    if full:
+        dirty_months |= set(facts["inspection_month"])
+    for filename, group_columns in ROLLUPS.items():
+        update_rollup(filename, facts, group_columns, dirty_months, rebuild=full)
+    # The facts are saved last, so an interrupted update is redone in full by the next run
+    replace_csv(facts[FACT_COLUMNS], FACTS_FILENAME)
+    return facts, dirty_months
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    selected_output_format = get_output_format(sys.argv[1:])
+    if not table_exists("potential_inspection_summary_data", selected_output_format):
+        sys.exit("There is no potential inspection summary data yet (run 03alt_extract_potential_inspection_data.py)")
+    all_facts, updated_months = update_rollups(selected_output_format, "--full" in sys.argv[1:])
+    print(len(all_facts), "inspections,", int(all_facts["included"].sum()), "of them counted, in",
+          all_facts["inspection_month"].nunique(), "months;", len(updated_months), "months updated.")
+    print("Finished in", round(time.perf_counter() - start, 2), "seconds.")
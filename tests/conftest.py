@@ -0,0 +1,41 @@
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import pytest
+
+# The scripts and modules live at the top of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+# Local HTTP server that answers each request with respond(method, path, body), which returns (status, body bytes)
+# Yields the server's base url; every request is recorded in stub_server.requests as (method, path, body)
+@pytest.fixture
+def stub_server():
+    class StubServer:
+        respond = None
+        requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def handle_request(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            StubServer.requests.append((self.command, self.path, body))
+            status, data = StubServer.respond(self.command, self.path, body)
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = handle_request
+        do_POST = handle_request
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubServer.url = "http://127.0.0.1:" + str(server.server_address[1])
+    yield StubServer
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,48 @@
+import numpy as np
+from id_index import DEAD, LIVE, InspectionIdIndex
+from id_probing import ProbingScheduler
+
+
+# Runs the sweep to the end against ids whose liveness is known, and returns its recall report and the true recall
+def sweep(truth, known_valid_ids=()):
+    id_index = InspectionIdIndex()
+    id_index.update(np.asarray(known_valid_ids, dtype=np.int64), LIVE)
+    scheduler = ProbingScheduler(id_index, len(truth) - 1, known_valid_ids)
+    ids = scheduler.next_ids()
+    while len(ids) > 0:
+        id_index.update(ids[truth[ids]], LIVE)
+        id_index.update(ids[~truth[ids]], DEAD)
+        ids = scheduler.next_ids()
+    report = scheduler.recall_report()
+    return report, report["live_ids_found"] / truth[1:].sum()
+
+
+def test_recall_estimate_tracks_the_true_recall():
+    for seed in range(3):
+        rng = np.random.default_rng(seed)
+        truth = np.zeros(400001, dtype=bool)
+        for start in rng.integers(1, 400000, 800):
+            truth[start:start + rng.integers(1, 12)] = True
+        # A dense region, which is fetched in full once found
+        truth[100000:110000] = rng.random(10000) < 0.3
+        report, true_recall = sweep(truth)
+        assert true_recall < 0.9
+        assert abs(report["estimated_recall"] - true_recall) < 0.1
+
+
+def test_nothing_is_missed_when_everything_is_fetched():
+    truth = np.ones(5001, dtype=bool)
+    report, true_recall = sweep(truth)
+    assert true_recall == 1.0
+    assert report["estimated_recall"] == 1.0
+
+
+def test_known_valid_blocks_do_not_count_as_sampled():
+    rng = np.random.default_rng(0)
+    truth = rng.random(20001) < 0.2
+    truth[0] = False
+    known_valid_ids = np.arange(1, 20001, 500)
+    truth[known_valid_ids] = True
+    report, true_recall = sweep(truth, known_valid_ids)
+    assert true_recall == 1.0
+    assert report["estimated_live_ids_missed"] == 0
@@ -0,0 +1,23 @@
+import pytest
+import inspection_cache
+from inspection_cache import InspectionCache
+
+
+def test_missing_codec_fails_when_the_cache_opens(tmp_path, monkeypatch):
+    with open(str(tmp_path) + "/index.csv", "w") as index_file:
+        index_file.write("1," + "0" * 64 + ",1,0,10,zstd\n")
+    monkeypatch.setattr(inspection_cache, "zstandard", None)
+    with pytest.raises(ImportError, match="zstandard"):
+        InspectionCache(str(tmp_path), codec="gzip")
+
+
+def test_grown_segments_are_remapped(tmp_path):
+    cache = InspectionCache(str(tmp_path), codec="gzip", use_mmap=True)
+    cache.put(1, b"<html>first</html>")
+    assert cache.get(1) == b"<html>first</html>"
+    old_map = cache.segment_maps[1]
+    cache.put(2, b"<html>second</html>")
+    assert cache.get(2) == b"<html>second</html>"
+    assert old_map.closed
+    assert cache.get(1) == b"<html>first</html>"
+    cache.close()
@@ -0,0 +1,48 @@
+import socket
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+from inspection_fetcher import fetch_urls, inspection_report_url
+
+
+def inspection_id(path):
+    return int(parse_qs(urlsplit(path).query)["inspectionID"][0])
+
+
+def test_server_errors_are_retried(stub_server):
+    attempts = Counter()
+
+    # Id 1 fails twice before it is served, id 2 is never served, id 3 is not found and id 4 is a dead (empty) id
+    def respond(method, path, body):
+        attempts[inspection_id(path)] += 1
+        if inspection_id(path) == 1:
+            return (500, b"") if attempts[1] <= 2 else (200, b"<html>report 1</html>")
+        if inspection_id(path) == 2:
+            return 503, b""
+        if inspection_id(path) == 3:
+            return 404, b"Not found"
+        return 200, b""
+    stub_server.respond = respond
+
+    urls = [inspection_report_url(x, stub_server.url) for x in [1, 2, 3, 4]]
+    responses = fetch_urls(urls, retries=3, backoff=0.01, concurrency=2)
+    assert [x["url"] for x in responses] == urls
+    assert [x["status"] for x in responses] == [200, 503, 404, 200]
+    assert responses[0]["data"] == b"<html>report 1</html>"
+    assert responses[3]["data"] == b""
+    # Only server errors are retried, up to the given number of times
+    assert attempts == {1: 3, 2: 4, 3: 1, 4: 1}
+
+
+def test_handler_results_are_returned(stub_server):
+    stub_server.respond = lambda method, path, body: (200, str(inspection_id(path)).encode())
+    urls = [inspection_report_url(x, stub_server.url) for x in range(10)]
+    assert fetch_urls(urls, lambda response: int(response["data"]), concurrency=3) == list(range(10))
+
+
+def test_connection_failures_give_no_status():
+    # A port that nothing listens on
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        base_url = "http://127.0.0.1:" + str(unused.getsockname()[1])
+    response = fetch_urls([inspection_report_url(1, base_url)], retries=1, backoff=0.01)[0]
+    assert response["status"] is None and response["data"] is None
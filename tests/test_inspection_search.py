@@ -0,0 +1,34 @@
+import pytest
+from inspection_search import SEARCH_PAGE_PATH, SearchFormError, scrape_inspection_links
+
+SEARCH_PAGE = b"""<html><body><form method="post" action="/results">
+<input type="hidden" name="token" value="abc"><input type="submit" name="btnSearch" value="Search">
+</form></body></html>"""
+
+
+def results_page(ids, next_page=None):
+    links = "".join('<a href="?a=Inspections&inspectionID=' + str(x) + '">Report</a>' for x in ids)
+    if next_page is not None:
+        links += '<a href="' + next_page + '">Next</a>'
+    return ('<html><body><div id="divInspectionSearchResultsListing">' + links + "</div></body></html>").encode()
+
+
+def test_search_results_are_followed_page_by_page(stub_server):
+    def respond(method, path, body):
+        if path == SEARCH_PAGE_PATH:
+            return 200, SEARCH_PAGE
+        if path == "/results":
+            return 200, results_page([1, 2], "/results?page=2")
+        return 200, results_page([3])
+    stub_server.respond = respond
+    found = []
+    assert scrape_inspection_links(found.append, base_url=stub_server.url) == 2
+    assert [len(x) for x in found] == [2, 1]
+    assert found[1][0].endswith("inspectionID=3")
+    assert ("POST", "/results", b"token=abc&btnSearch=Search") in stub_server.requests
+
+
+def test_missing_search_form_is_reported(stub_server):
+    stub_server.respond = lambda method, path, body: (503, b"")
+    with pytest.raises(SearchFormError, match="503"):
+        scrape_inspection_links(print, base_url=stub_server.url)
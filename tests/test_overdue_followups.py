@@ -0,0 +1,46 @@
+import pandas as pd
+from overdue_followups import find_overdue_followups, find_routine_inspection_deficit
+
+
+def inspections(rows):
+    columns = ["inspection_id", "establishment_key", "inspection_date", "inspection_type_category", "risk_category",
+               "priority_violations", "priority_violations_corrected_on_site"]
+    frame = pd.DataFrame(rows, columns=columns)
+    frame["inspection_date"] = pd.to_datetime(frame["inspection_date"])
+    for kind in ["priority_foundation", "core"]:
+        frame[kind + "_violations"] = 0
+        frame[kind + "_violations_corrected_on_site"] = 0
+    return frame
+
+
+def test_follow_ups_are_matched_per_establishment():
+    followups = find_overdue_followups(inspections([
+        # a: followed up on time; b: late (the follow-up of a does not count); c: the inspection before is ignored,
+        # and the follow-up is not due yet; d: everything was corrected on site
+        [1, "a", "2020-01-01", "routine", 1, 2, 0],
+        [2, "a", "2020-01-03", "follow_up", 1, 0, 0],
+        [3, "b", "2020-01-01", "routine", 1, 1, 0],
+        [4, "b", "2020-01-10", "follow_up", 1, 0, 0],
+        [5, "c", "2020-01-05", "follow_up", 1, 0, 0],
+        [6, "c", "2020-01-09", "routine", 1, 1, 0],
+        [7, "d", "2020-01-09", "routine", 1, 2, 2],
+    ]), as_of="2020-01-10")
+    followups = followups.set_index("inspection_id")
+    assert list(followups.index) == [1, 3, 6]
+    assert followups.loc[1, "follow_up_inspection_id"] == 2 and not followups.loc[1, "overdue"]
+    assert followups.loc[3, "follow_up_inspection_id"] == 4 and followups.loc[3, "days_late"] == 6
+    assert followups.loc[3, "overdue"]
+    assert pd.isna(followups.loc[6, "follow_up_inspection_id"]) and followups.loc[6, "pending"]
+
+
+def test_routine_inspection_deficit():
+    deficit = find_routine_inspection_deficit(inspections([
+        [1, "a", "2020-02-01", "routine", 2, 0, 0],
+        [2, "a", "2020-03-01", "follow_up", 3, 0, 0],
+        [3, "a", "2021-02-01", "routine", 1, 0, 0],
+        [4, "b", "2020-02-01", "routine", 1, 0, 0],
+    ])).set_index(["establishment_key", "inspection_year"])
+    # The latest risk category of the year sets the number of routine inspections required
+    assert deficit.loc[("a", 2020), "routine_inspection_deficit"] == 2
+    assert deficit.loc[("a", 2021), "routine_inspection_deficit"] == 0
+    assert deficit.loc[("b", 2020), "routine_inspection_deficit"] == 0
@@ -0,0 +1,32 @@
+import pandas as pd
+from inspection_cache import InspectionCache
+from page_refresh import cached_dates, pages_due_for_refresh
+
+
+def test_pages_never_checked_are_due_from_when_they_were_cached():
+    inspection_dates = pd.Series(pd.to_datetime(["2015-01-01", "2024-01-01", "2024-06-01"]), index=[1, 2, 3])
+    stored_dates = pd.Series(pd.to_datetime(["2024-06-10", "2024-06-10", "2024-06-10"]), index=[1, 2, 3])
+    last_checked_dates = pd.Series(dtype="datetime64[ns]")
+    # Cached a few days ago, so nothing but the most recent inspection is due yet
+    due = pages_due_for_refresh(inspection_dates, last_checked_dates, stored_dates, today="2024-06-20")
+    assert list(due) == [3]
+    # Without the cache dates the pages count as never checked since their inspection
+    due = pages_due_for_refresh(inspection_dates, last_checked_dates, today="2024-06-20")
+    assert list(due) == [3, 2, 1]
+
+
+def test_most_recent_due_pages_come_first():
+    inspection_dates = pd.Series(pd.to_datetime(["2010-01-01", "2023-01-01", "2016-01-01"]), index=[1, 2, 3])
+    last_checked_dates = pd.Series(pd.to_datetime(["2018-01-01", "2023-06-01", "2018-01-01"]), index=[1, 2, 3])
+    due = pages_due_for_refresh(inspection_dates, last_checked_dates, today="2024-06-20")
+    assert list(due) == [2, 3, 1]
+
+
+def test_cached_dates(tmp_path):
+    cache = InspectionCache(str(tmp_path), codec="gzip")
+    cache.put(5, b"<html>report</html>")
+    dates = cached_dates([5, 6], cache)
+    assert list(dates.index) == [5]
+    assert dates[5] == pd.Timestamp.today().normalize()
+    # A second process reading the index sees the same date
+    assert InspectionCache(str(tmp_path), codec="gzip").stored_time(5) == cache.stored_time(5)
@@ -0,0 +1,16 @@
+from page_triage import EMPTY_PAGE, NEW_FORMAT_REPORT, NOT_A_REPORT, OLD_FORMAT_REPORT, triage_page
+
+PADDING = b"<!-- " + b"x" * 2000 + b" -->"
+
+
+def test_small_pages_are_not_reports():
+    assert triage_page(b"") == EMPTY_PAGE
+    assert triage_page(b" \n") == EMPTY_PAGE
+    assert triage_page(b"<span>Food Establishment Inspection Report</span>") == NOT_A_REPORT
+
+
+def test_report_formats():
+    report = b"<span>Food Establishment Inspection Report</span><td>OBSERVATIONS</td>" + PADDING
+    assert triage_page(report + b"Priority Foundation") == NEW_FORMAT_REPORT
+    assert triage_page(report + b"Critical Violations") == OLD_FORMAT_REPORT
+    assert triage_page(PADDING) == NOT_A_REPORT
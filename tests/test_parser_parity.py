@@ -0,0 +1,32 @@
+from pathlib import Path
+import pytest
+from check_parser_parity import indent_report
+from inspection_parser import parse_inspection_report, parse_inspection_report_bs4
+
+# Small synthetic reports laid out like the site's pages, one with each set of violation labels
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+REPORTS = ["old_format_report.html", "new_format_report.html"]
+
+
+@pytest.mark.parametrize("filename", REPORTS)
+@pytest.mark.parametrize("indented", [False, True])
+def test_lxml_parser_matches_bs4(filename, indented):
+    data = (FIXTURES / filename).read_bytes()
+    if indented:
+        data = indent_report(data)
+    expected = parse_inspection_report_bs4(7, data)
+    assert expected is not None and len(expected["violation_details"]) > 0
+    assert parse_inspection_report(7, data) == expected
+
+
+def test_old_and_new_formats_fill_different_counts():
+    old = parse_inspection_report(7, (FIXTURES / "old_format_report.html").read_bytes())["inspection_summary"]
+    new = parse_inspection_report(7, (FIXTURES / "new_format_report.html").read_bytes())["inspection_summary"]
+    assert old["critical_violations"] is not None and old["priority_violations"] is None
+    assert new["priority_violations"] is not None and new["critical_violations"] is None
+
+
+def test_pages_that_are_not_reports():
+    assert parse_inspection_report(7, b"") is None
+    assert parse_inspection_report_bs4(7, b"<html><body>No such inspection</body></html>") is None
+    assert parse_inspection_report(7, b"<html><body>No such inspection</body></html>") is None
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from output_store import append_csv
+
+
+# Every violation row used to carry the full description of its numbered violation, although each report format only
+# has a few dozen of them, so the violation details tables store an integer violation_code instead, and the
+# descriptions are kept once in output/violation_codes.csv
+# The numbering (and wording) of the violations differs between the old (Critical/Noncritical) and new
+# (Priority/Priority Foundation/Core) report formats, so a code stands for a report format, violation number and
+# description; new combinations are given the next free code and added to the file as they turn up
+
+VIOLATION_CODES_FILENAME = "output/violation_codes.csv"
+VIOLATION_CODE_COLUMNS = ["violation_code", "report_format", "violation_number", "violation_description"]
+
+UNKNOWN_REPORT_FORMAT = "unknown"
+
+
+# Report format of each row of a summary table, from which kind of violation counts it has
+def report_formats(summary):
+    formats = pd.Series(UNKNOWN_REPORT_FORMAT, index=summary.index)
+    formats[summary["critical_violations"].notna() | summary["noncritical_violations"].notna()] = "critical"
+    formats[summary["priority_violations"].notna() | summary["core_violations"].notna()] = "priority"
+    return formats
+
+
+class ViolationCodes:
+    def __init__(self, codes=None, filename=VIOLATION_CODES_FILENAME):
+        self.codes = codes if codes is not None else pd.DataFrame(columns=VIOLATION_CODE_COLUMNS)
+        self.filename = filename
+        # (report format, violation number) -> {description: code}
+        self._cache = {}
+        for code, report_format, violation_number, violation_description in \
+                self.codes[VIOLATION_CODE_COLUMNS].itertuples(index=False, name=None):
+            self._cache.setdefault((report_format, violation_number), {})[violation_description] = int(code)
+
+    def code(self, report_format, violation_number, violation_description, new_codes):
+        descriptions = self._cache.setdefault((report_format, violation_number), {})
+        if violation_description not in descriptions:
+            descriptions[violation_description] = len(self.codes) + len(new_codes) + 1
+            new_codes.append((descriptions[violation_description], report_format, violation_number,
+                              violation_description))
+        return descriptions[violation_description]
+
+    # Replaces the violation_description column of a violation details table by violation_code, given the report
+    # format of each row; each distinct combination is only looked up once, and new codes are saved straight away
+    def encode(self, violation_details, formats):
+        keys = pd.DataFrame({"report_format": np.asarray(formats, dtype=object),
+                             "violation_number": violation_details["violation_number"].astype(str).where(
+                                 violation_details["violation_number"].notna(), None).values,
+                             "violation_description": violation_details["violation_description"].values})
+        codes, distinct_keys = pd.factorize(pd.MultiIndex.from_frame(keys))
+        distinct_codes = self._codes_of([[x if isinstance(x, str) else None for x in key] for key in distinct_keys])
+        encoded = violation_details.drop(columns="violation_description")
+        encoded.insert(list(violation_details.columns).index("violation_description"), "violation_code",
+                       distinct_codes[codes] if len(codes) > 0 else np.zeros(0, dtype=np.int32))
+        return encoded
+
+    # The same for an Arrow table (as built by the extraction workers) with dictionary encoded report_format,
+    # violation_number and violation_description columns: only the distinct combinations of dictionary indices are
+    # looked up, and the report_format column is dropped
+    def encode_arrow(self, violation_details):
+        violation_details = violation_details.unify_dictionaries()
+        key_columns = ["report_format", "violation_number", "violation_description"]
+        arrays = [violation_details.column(x).combine_chunks() for x in key_columns]
+        # Missing values get the index -1, which picks the None added to the end of each dictionary
+        dictionaries = [x.dictionary.to_pylist() + [None] for x in arrays]
+        indices = np.column_stack([x.indices.fill_null(-1).to_numpy(zero_copy_only=False) for x in arrays])
+        distinct_indices, inverse = np.unique(indices.reshape(-1, len(key_columns)), axis=0, return_inverse=True)
+        distinct_codes = self._codes_of([[dictionary[i] for dictionary, i in zip(dictionaries, x)]
+                                         for x in distinct_indices])
+        codes = pa.array(distinct_codes[inverse.reshape(-1)], type=pa.int32())
+        position = violation_details.column_names.index("violation_description")
+        violation_details = violation_details.set_column(position, "violation_code", codes)
+        violation_details = violation_details.set_column(violation_details.column_names.index("violation_number"),
+                                                         "violation_number", arrays[1].cast(pa.string()))
+        return violation_details.drop_columns(["report_format"])
+
+    # Codes of a list of (report format, violation number, description) keys, saving any new ones
+    def _codes_of(self, keys):
+        new_codes = []
+        codes = np.array([self.code(*key, new_codes) for key in keys], dtype=np.int32)
+        if len(new_codes) > 0:
+            new_codes = pd.DataFrame.from_records(new_codes, columns=VIOLATION_CODE_COLUMNS)
+            append_csv(new_codes, self.filename)
+            self.codes = pd.concat([self.codes, new_codes], ignore_index=True)
+        return codes
+
+    # Restores the violation_description column of a violation details table from its violation_code column (rows
+    # saved before the codes were introduced keep the description they were saved with)
+    def decode(self, violation_details):
+        if "violation_code" not in violation_details:
+            return violation_details
+        descriptions = self.codes.set_index(self.codes["violation_code"].astype("Int64"))["violation_description"]
+        restored = violation_details["violation_code"].astype("Int64").map(descriptions)
+        if "violation_description" in violation_details:
+            restored = restored.fillna(violation_details["violation_description"])
+        decoded = violation_details.drop(columns=[x for x in ["violation_description"] if x in violation_details])
+        decoded.insert(list(decoded.columns).index("violation_code"), "violation_description", restored)
+        return decoded.drop(columns="violation_code")
+
+
+def load_violation_codes(filename=VIOLATION_CODES_FILENAME):
+    if not Path(filename).exists() or os.path.getsize(filename) == 0:
+        return ViolationCodes(filename=filename)
+    codes = pd.read_csv(filename, dtype={"violation_number": str, "violation_description": object})
+    for column in ["violation_number", "violation_description"]:
+        codes[column] = codes[column].astype(object).where(codes[column].notna(), None)
+    return ViolationCodes(codes, filename)
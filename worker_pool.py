@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import datetime
+import os
+import signal
+import traceback
+from multiprocessing.pool import Pool
+from pathlib import Path
+import pandas as pd
+from output_store import append_csv, replace_csv
+from pipeline_metrics import METRICS
+
+
+# Reports that could not be extracted (because the extraction raised an error or took longer than TASK_TIMEOUT
+# seconds) are recorded here with their traceback, instead of aborting the run
+QUARANTINE_FILENAME = "output/extraction_quarantine.csv"
+
+TASK_TIMEOUT = 60
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+# Number of cores this process may run on
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Worker processes to use: one per available core, unless run with --processes=<n>
+def get_pool_size(argv):
+    for arg in argv:
+        if arg.startswith("--processes="):
+            return int(arg[len("--processes="):])
+    return available_cores()
+
+
+# Stand-in for multiprocessing.pool.Pool that runs everything in the calling process (see profiling.py)
+class InProcessPool:
+    def map(self, func, iterable, chunksize=None):
+        return list(map(func, iterable))
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return map(func, iterable)
+
+    def close(self):
+        pass
+
+
+def get_pool(processes=None, in_process=False):
+    if in_process:
+        return InProcessPool()
+    return Pool(processes or available_cores())
+
+
+def _raise_task_timeout(signum, frame):
+    raise TaskTimeout("Task took longer than the timeout")
+
+
+# Calls function(*args) in a worker and returns (result, None), or (None, failure) if it raised an error or ran for
+# longer than timeout seconds, where failure is a dict with the error and its traceback
+# The timeout is a SIGALRM timer, so this must be called from the main thread of a process (as pool workers are)
+def run_isolated(function, args, timeout=TASK_TIMEOUT):
+    previous_handler = signal.signal(signal.SIGALRM, _raise_task_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(*args), None
+    except Exception as error:
+        METRICS.increment("task_failures", error=type(error).__name__)
+        return None, {"error": type(error).__name__ + ": " + str(error), "traceback": traceback.format_exc()}
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+# Appends failures (dicts with inspection_id, content_hash, error and traceback) to the quarantine table
+def quarantine(failures, script, quarantine_filename=QUARANTINE_FILENAME):
+    if len(failures) == 0:
+        return
+    quarantined = pd.DataFrame.from_records(failures, columns=["inspection_id", "content_hash", "error", "traceback"])
+    quarantined.insert(1, "script", script)
+    quarantined["date_quarantined"] = datetime.datetime.now().isoformat(timespec="seconds")
+    append_csv(quarantined, quarantine_filename)
+    print("Quarantined", len(quarantined), "inspections that could not be extracted (see " + quarantine_filename + ")")
+
+
+# Ids quarantined by the given script
+def load_quarantined_ids(script, quarantine_filename=QUARANTINE_FILENAME):
+    if not Path(quarantine_filename).exists():
+        return pd.Series(dtype="int64")
+    quarantined = pd.read_csv(quarantine_filename, usecols=["inspection_id", "script"])
+    return quarantined.loc[quarantined["script"] == script, "inspection_id"].drop_duplicates()
+
+
+# Removes the given script's quarantine records for the given ids (before they are retried)
+def release_quarantined_ids(script, inspection_ids, quarantine_filename=QUARANTINE_FILENAME):
+    if not Path(quarantine_filename).exists():
+        return
+    quarantined = pd.read_csv(quarantine_filename)
+    released = (quarantined["script"] == script) & quarantined["inspection_id"].isin(inspection_ids)
+    replace_csv(quarantined.loc[~released], quarantine_filename)